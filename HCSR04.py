@@ -1,15 +1,57 @@
 """Interrupt-driven HC-SR04 driver."""
 
+from array import array
+
 from pyb import ExtInt, Pin, elapsed_micros, micros, udelay
 
+from stats import attach
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    try:
+        import asyncio
+    except ImportError:
+        asyncio = None
+
+# Echoes longer than this (about 4m) are out of the sensor's range.
+MAX_ECHO = 23500
+
+# HCSR04 stats counters and timers, see stats.py.
+TRIGGERS = 0
+ECHOES = 1
+BOGUS = 2
+TIMEOUTS = 3
+REJECTED = 4
+ECHO = 0
+IRQ_TIME = 1
+
+
 class HCSR04:
     """Init with pins the trigger and return are tied to.
     
     trigger can be any GPIO pin. Return must be a 5V tolerant GPIO pin
     available for external interrupts. sos is speed of sound per µs in
-    the unit of interest, defaulting to cm."""
+    the unit of interest, defaulting to cm.
+
+    Each echo is also run through a filter as it arrives: readings
+    with no echo, bogus echoes and echoes beyond max_range (in the
+    units of sos, defaulting to about 4m) are rejected, the rest go
+    through a median of the last window readings, and that feeds an
+    exponential moving average weighted alpha/256 towards the new
+    value. See distance, valid and confidence.
+
+    With capture set, echoes are timed by timer input capture with a
+    PulseIn (see pulsein.py) instead of an ExtInt and micros(), so
+    they're exact to the µs whatever the interrupt latency, at the cost
+    of a timer channel pair. return_pin must then have one.
 
-    def __init__(self, trigger_pin, return_pin, sos=0.034029):
+    With stats.enable(), triggers, echoes, bogus echoes, timeouts and
+    rejected readings are counted, and echo lengths and interrupt
+    handler times go in histograms, see stats.py."""
+
+    def __init__(self, trigger_pin, return_pin, sos=0.034029,
+                 max_range=None, window=5, alpha=64, capture=False):
         self.return_pin = return_pin
         trigger_pin.init(mode=Pin.OUT)
         self.trigger_pin = trigger_pin
@@ -18,8 +60,27 @@ class HCSR04:
         self.start_micros = None
         self.elapsed = None
         self.bogus = False
-        self.interrupt = ExtInt(return_pin, ExtInt.IRQ_RISING_FALLING,
-                                Pin.PULL_DOWN, self.IRQ)
+
+        self.max_echo = MAX_ECHO if max_range is None \
+            else round(2 * max_range / sos)
+        self.alpha = alpha
+        self._window = array('H', [0] * max(window, 1))
+        self._sorted = array('H', [0] * max(window, 1))
+        self.reset_filter()
+        self._flag = None
+        self._stats = attach('HCSR04 %s' % return_pin.name(),
+                             ('triggers', 'echoes', 'bogus', 'timeouts',
+                              'rejected'), ('echo', 'irq'))
+
+        if capture:
+            from pulsein import PulseIn
+            self.interrupt = None
+            self.input = PulseIn(return_pin, callback=self._echo,
+                                 pull=Pin.PULL_DOWN)
+        else:
+            self.input = None
+            self.interrupt = ExtInt(return_pin, ExtInt.IRQ_RISING_FALLING,
+                                    Pin.PULL_DOWN, self.IRQ)
 
     def trigger(self):
         self.trigger_pin.low()
@@ -28,23 +89,304 @@ class HCSR04:
         udelay(10)
         self.trigger_pin.low()
         self.elapsed = None
+        if self._stats is not None:
+            self._stats.count(TRIGGERS)
 
-    def distance(self, sos=None):
+    def distance(self, sos=None, filtered=False):
         """Call to get the last distance reading, or 0 if it wasn't valid.
         
-        Override the default sos if desired."""
+        Override the default sos if desired. If filtered is set, get
+        the filtered distance instead, or 0 if there's been no valid
+        reading since the filter was reset."""
 
         self.bogus = False
         if not sos:
             sos = self.sos
+        if filtered:
+            return sos * self._ema / 32 if self._count else 0
         if not self.elapsed:
             return 0
         return sos * self.elapsed / 2
 
+    @property
+    def valid(self):
+        """Was the last reading accepted by the filter?"""
+
+        return bool(self._good & 1)
+
+    @property
+    def confidence(self):
+        """The percentage of the last 16 readings the filter accepted."""
+
+        good, count = self._good, 0
+        while good:
+            good &= good - 1
+            count += 1
+        return count * 100 // 16
+
+    def reset_filter(self):
+        """Forget all the readings the filter has seen."""
+
+        self._next = self._count = self._good = 0
+        self._ema = 0
+
+    def no_echo(self):
+        """Tell the filter a reading timed out."""
+
+        if self._stats is not None:
+            self._stats.count(TIMEOUTS)
+        self._filter(0)
+
+    def _filter(self, echo):
+        """Add an echo length to the filter. Runs in the IRQ, so no allocation."""
+
+        if not 0 < echo <= self.max_echo:
+            self._good = self._good << 1 & 0xffff
+            if echo and self._stats is not None:
+                self._stats.count(REJECTED)
+            return
+        self._good = (self._good << 1 | 1) & 0xffff
+
+        # Replace the oldest reading in the window, and in the sorted copy.
+        window, ordered = self._window, self._sorted
+        size, count = len(window), self._count
+        old = window[self._next]
+        window[self._next] = echo
+        self._next = (self._next + 1) % size
+        if count == size:
+            i = 0
+            while ordered[i] != old:
+                i += 1
+            while i < count - 1:
+                ordered[i] = ordered[i + 1]
+                i += 1
+            count -= 1
+        i = count
+        while i and ordered[i - 1] > echo:
+            ordered[i] = ordered[i - 1]
+            i -= 1
+        ordered[i] = echo
+        self._count = count = count + 1
+
+        # The average is kept with 4 fractional bits.
+        median = ordered[count // 2] << 4
+        if count == 1:
+            self._ema = median
+        else:
+            self._ema += (median - self._ema) * self.alpha >> 8
+
+    async def measure(self, timeout_ms=30, sos=None, filtered=False):
+        """Trigger, and return the distance once the echo arrives.
+
+        Other tasks run while waiting. Returns 0 if there's no echo
+        within timeout_ms. See distance for sos and filtered."""
+
+        if self._flag is None:
+            # Set from the IRQ, so needs to be a ThreadSafeFlag on
+            # micropython. CPython only sees simulated interrupts.
+            self._flag = asyncio.ThreadSafeFlag() \
+                if hasattr(asyncio, 'ThreadSafeFlag') else asyncio.Event()
+        # Cleared before the trigger, and only then, so an echo that
+        # lands between the check below and the wait isn't lost.
+        if hasattr(self._flag, 'clear'):
+            self._flag.clear()
+        self.trigger()
+        start = micros()
+        while self.elapsed is None:
+            left = timeout_ms - elapsed_micros(start) // 1000
+            if left <= 0:
+                self.no_echo()
+                return 0
+            try:
+                await _wait_for_ms(self._flag.wait(), left)
+            except asyncio.TimeoutError:
+                pass
+        return self.distance(sos, filtered)
+
+    def readings(self, rate=10, timeout_ms=30, sos=None, filtered=False):
+        """An async iterator of distances, measured rate times a second.
+
+        Use as `async for distance in sensor.readings(20):`. Each
+        reading is a measure call, with the same arguments."""
+
+        return _Readings(self, rate, timeout_ms, sos, filtered)
+
     def IRQ(self, pin):
+        stats = self._stats
+        if stats is not None:
+            start = micros()
         if self.return_pin.value():
             self.start_micros = micros()
         elif self.start_micros is not None:
+            if stats is not None:
+                stats.count(ECHOES)
+                stats.time(ECHO, self.start_micros)
             self.elapsed = elapsed_micros(self.start_micros)
+            self.start_micros = None
+            self._filter(self.elapsed)
+            if self._flag is not None:
+                self._flag.set()
         else:
             self.bogus = True
+            if stats is not None:
+                stats.count(BOGUS)
+            self._filter(0)
+        if stats is not None:
+            stats.time(IRQ_TIME, start)
+
+    def _echo(self, width):
+        """The PulseIn callback, with capture set."""
+
+        stats = self._stats
+        if stats is not None:
+            start = micros()
+            stats.count(ECHOES)
+            stats.add(ECHO, width)
+        self.elapsed = width
+        self._filter(width)
+        if self._flag is not None:
+            self._flag.set()
+        if stats is not None:
+            stats.time(IRQ_TIME, start)
+
+
+def _sleep_ms(ms):
+    if hasattr(asyncio, 'sleep_ms'):
+        return asyncio.sleep_ms(ms)
+    return asyncio.sleep(ms / 1000)
+
+
+def _wait_for_ms(awaitable, ms):
+    if hasattr(asyncio, 'wait_for_ms'):
+        return asyncio.wait_for_ms(awaitable, ms)
+    return asyncio.wait_for(awaitable, ms / 1000)
+
+
+class _Readings:
+    """The async iterator returned by HCSR04.readings."""
+
+    def __init__(self, sensor, rate, timeout_ms, sos, filtered):
+        self.sensor = sensor
+        self.period = 1000 // rate
+        self.args = timeout_ms, sos, filtered
+        self.last = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.last is not None:
+            wait = self.period - elapsed_micros(self.last) // 1000
+            if wait > 0:
+                await _sleep_ms(wait)
+        self.last = micros()
+        return await self.sensor.measure(*self.args)
+
+
+class HCSR04Array:
+    """Ranges with a set of HCSR04s from a timer, keeping recent readings.
+
+    sensors is a list of HCSR04 objects. They're fired a group at a
+    time: groups is a list of lists of sensor indices to trigger
+    together, which should be far enough apart not to hear each
+    other. By default each sensor is its own group, in an interleaved
+    order (0, 2, 4... then 1, 3, 5...) so neighbours don't fire back
+    to back.
+
+    A group is done when all its sensors have an echo, or timeout µs
+    after the trigger, and the next group fires gap µs after that,
+    letting stray echoes die down. Each sensor's last size readings
+    are kept in ring buffers, as the micros() time of the trigger and
+    the echo length in µs, with 0 for no echo.
+
+    The schedule runs from a timer at freq Hz. If timer is None, a
+    free timer is picked (see pwm2.free_timer)."""
+
+    def __init__(self, sensors, groups=None, timeout=30000, gap=2000,
+                 size=16, freq=1000, timer=None):
+        self.sensors = sensors
+        count = len(sensors)
+        if groups is None:
+            groups = [[i] for i in list(range(0, count, 2))
+                      + list(range(1, count, 2))]
+        self.groups = groups
+        self.timeout = timeout
+        self.gap = gap
+        self.size = size
+
+        self.times = [array('L', [0] * size) for _ in sensors]
+        self.echoes = [array('H', [0] * size) for _ in sensors]
+        self.heads = array('H', [0] * count)
+        self.counts = array('L', [0] * count)
+
+        self._group = 0
+        self._firing = False
+        self._since = micros()
+        if timer is None:
+            from pwm2 import free_timer
+            timer = free_timer(freq)
+        self.timer = timer
+        self._tick = self.tick
+
+    def start(self):
+        """Start ranging."""
+
+        self._firing = False
+        self._since = micros()
+        self.timer.callback(self._tick)
+
+    def stop(self):
+        """Stop ranging after the current group."""
+
+        self.timer.callback(None)
+
+    def tick(self, timer):
+        """The timer callback: finish the current group, or fire the next."""
+
+        since = elapsed_micros(self._since)
+        group = self.groups[self._group]
+        if self._firing:
+            timed_out = since > self.timeout
+            for i in group:
+                if self.sensors[i].elapsed is None and not timed_out:
+                    return
+            for i in group:
+                sensor = self.sensors[i]
+                if sensor.elapsed is None:
+                    sensor.no_echo()
+                self._record(i, sensor.elapsed or 0)
+            self._firing = False
+            self._since = micros()
+            self._group = (self._group + 1) % len(self.groups)
+        elif since >= self.gap:
+            self._since = micros()
+            for i in group:
+                self.sensors[i].trigger()
+            self._firing = True
+
+    def _record(self, i, echo):
+        head = self.heads[i]
+        self.times[i][head] = self._since
+        self.echoes[i][head] = min(echo, 0xffff)
+        self.heads[i] = (head + 1) % self.size
+        self.counts[i] += 1
+
+    def latest(self, i):
+        """The (trigger time, echo µs) of sensor i's last reading."""
+
+        head = (self.heads[i] - 1) % self.size
+        return self.times[i][head], self.echoes[i][head]
+
+    def distance(self, i, sos=None):
+        """Sensor i's last distance, or 0 if it wasn't valid."""
+
+        echo = self.latest(i)[1]
+        return (sos or self.sensors[i].sos) * echo / 2
+
+    def history(self, i):
+        """Sensor i's readings as (trigger time, echo µs), oldest first."""
+
+        count = min(self.counts[i], self.size)
+        head = self.heads[i]
+        return [(self.times[i][j % self.size], self.echoes[i][j % self.size])
+                for j in range(head - count, head)]
@@ -0,0 +1,52 @@
+"""Speed tracking with and without a calibration curve.
+
+Runs on the simulator only: an HBridge drives a simulated motor with
+an encoder (sim/motor.py), calibrate() measures it, and for a range
+of commanded speeds the actual speed is printed as a percentage of
+top speed, first mapping speed to duty linearly, then through the
+curve."""
+
+import harness  # noqa: F401 - sets up the path
+
+import pyb
+from motors.curve import calibrate
+from motors.hbridge import HBridge
+from motor import Motor
+
+SAMPLE = 100
+
+
+def measure(motor):
+    """Encoder counts per second over SAMPLE ms."""
+
+    start = motor.count()
+    pyb.delay(SAMPLE)
+    return (motor.count() - start) * 1000 // SAMPLE
+
+
+def tracking(bridge, motor, top):
+    errors = []
+    for speed in range(10, 101, 10):
+        bridge.go(speed)
+        pyb.delay(300)
+        actual = measure(motor) * 100 / top
+        errors.append(abs(actual - speed))
+        print('%8d %8.1f' % (speed, actual), end='')
+    print('\nmean error %.1f%%' % (sum(errors) / len(errors)))
+
+
+def main():
+    for mode, name, pins in ((HBridge.RUN_COAST, 'RUN_COAST', ('PA0', 'PA1')),
+                             (HBridge.RUN_BRAKE, 'RUN_BRAKE', ('PA2', 'PA3'))):
+        bridge = HBridge(mode, pyb.Pin(pins[0]), pyb.Pin(pins[1]))
+        motor = Motor(bridge, exponent=0.7)
+        print(name, 'commanded vs actual speed')
+        tracking(bridge, motor, motor.max_speed)
+        bridge.curve = calibrate(bridge, lambda: measure(motor))
+        print(name, 'calibrated')
+        tracking(bridge, motor, motor.max_speed)
+        motor.remove()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Float setters against their integer counterparts.
+
+For each pair prints the time per call, the bytes allocated per call
+(exact on micropython, a CPython peak otherwise; see harness), and on
+the simulator how many values written to the timer weren't ints -
+each of which would be a boxed float on micropython."""
+
+from harness import allocated, per_call
+
+import pyb
+from pwm2 import PWM
+from motors.servo import Servo
+
+
+def float_writes(channel, fun, *args):
+    if not hasattr(channel, 'float_writes'):
+        return '-'
+    start = channel.float_writes
+    fun(*args)
+    return channel.float_writes - start
+
+
+def compare(label, channel, fun, *args):
+    print('%-28s %8.2f us %6d bytes %4s float writes'
+          % (label, per_call(fun, *args), allocated(fun, *args),
+             float_writes(channel, fun, *args)))
+
+
+def main():
+    pwm = PWM(pyb.Pin('PA6'), freq=20000)
+    servo = Servo(pyb.Pin('PB6'))
+    servo.calibration(1000, 2000, 1500, 500, 500)
+    channel = pwm.channel
+
+    compare('PWM.duty(33)', channel, pwm.duty, 33)
+    compare('PWM.duty(33.3)', channel, pwm.duty, 33.3)
+    compare('PWM.duty_u16(21823)', channel, pwm.duty_u16, 21823)
+    compare('PWM.pulse_width(17)', channel, pwm.pulse_width, 17)
+    compare('PWM.pulse_width_ticks(714)', channel, pwm.pulse_width_ticks, 714)
+    channel = servo.pwm.channel
+    compare('Servo.angle(30)', channel, servo.angle, 30)
+    compare('Servo.angle_millideg(30000)', channel, servo.angle_millideg,
+            30000)
+    compare('Servo.speed(30)', channel, servo.speed, 30)
+    compare('Servo.speed_permille(300)', channel, servo.speed_permille, 300)
+    compare('Servo.angle()', channel, servo.angle)
+    compare('Servo.angle_millideg()', channel, servo.angle_millideg)
+
+
+main()
@@ -0,0 +1,79 @@
+"""Timing and heap helpers shared by the benchmarks.
+
+Importing this on CPython puts the sim directory on sys.path, so run
+the benchmarks from the repository root. On a board the real pyb is
+used, and timing and heap numbers come from ticks_us and gc."""
+
+import gc
+import sys
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    from time import perf_counter_ns
+
+    def ticks_us():
+        return perf_counter_ns() // 1000
+
+    def ticks_diff(a, b):
+        return a - b
+
+    sys.path[:0] = ['sim', '.']
+    from simclock import clock
+    clock.logging = False
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+MICROPYTHON = sys.implementation.name == 'micropython'
+
+
+def heap():
+    """Bytes of heap in use."""
+
+    gc.collect()
+    if tracemalloc:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return tracemalloc.get_traced_memory()[0]
+    return gc.mem_alloc()
+
+
+def allocated(fun, *args, calls=100):
+    """Bytes allocated per call of fun(*args).
+
+    On micropython this is exact, as the collector is off while it
+    runs. CPython allocates for any int over 256, so there it's the
+    peak traced memory of a call, and only useful for comparisons."""
+
+    fun(*args)
+    if MICROPYTHON:
+        gc.collect()
+        gc.disable()
+        start = gc.mem_alloc()
+        for _ in range(calls):
+            fun(*args)
+        used = gc.mem_alloc() - start
+        gc.enable()
+        return used / calls
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    fun(*args)
+    used = tracemalloc.get_traced_memory()[1] - base
+    if not tracing:
+        tracemalloc.stop()     # It slows everything else down.
+    return used
+
+
+def per_call(fun, *args, calls=1000):
+    """Microseconds per call of fun(*args)."""
+
+    start = ticks_us()
+    for _ in range(calls):
+        fun(*args)
+    return ticks_diff(ticks_us(), start) / calls
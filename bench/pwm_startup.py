@@ -0,0 +1,129 @@
+"""Startup and heap cost of pwm2: importing it and constructing PWMs.
+
+pwm2 used to build af_map from pins_af when it was imported. The
+legacy line imports pwm2 and does that too, so it's like for like
+with the plain import, which leaves the table to the first PWM. The
+index lines are that first load, from pins_af or from pwm_af.
+
+Run from the repository root. On CPython the sim directory supplies
+pyb and pins_af; on a board, copy pwm2.py (and optionally pwm_af.py)
+over and run this file."""
+
+import sys
+
+try:
+    import os
+except ImportError:
+    import uos as os
+
+from harness import heap, ticks_diff, ticks_us, tracemalloc
+
+# Pins a board full of motors and servos might use.
+PINS = ('PA0', 'PA1', 'PA2', 'PA3', 'PA6', 'PB9', 'PA8', 'PA9', 'PA10', 'PA11',
+        'PB6', 'PB7')
+
+
+def measure(label, fun, *args):
+    start_heap = heap()
+    start = ticks_us()
+    result = fun(*args)
+    took = ticks_diff(ticks_us(), start)
+    print('%-28s %8d us %8d bytes' % (label, took, heap() - start_heap))
+    return result
+
+
+def forget():
+    """Unload pwm2 and its tables, so the next import starts afresh."""
+
+    for name in 'pwm2', 'pins_af', 'pwm_af':
+        sys.modules.pop(name, None)
+
+
+def import_pwm2():
+    import pwm2
+    return pwm2
+
+
+def import_legacy():
+    """Import pwm2 as it used to be, building af_map at import time."""
+
+    pwm2 = import_pwm2()
+    from pins_af import PINS_AF
+    pwm2.af_map = dict((x[0], x[1:]) for x in PINS_AF)
+    return pwm2
+
+
+def load_index(pwm2, module):
+    """Load the index from module, with none loaded before."""
+
+    if module == 'pwm_af':
+        return pwm2._index()
+    sys.modules['pwm_af'] = None       # Makes the import fail.
+    try:
+        return pwm2._index()
+    finally:
+        del sys.modules['pwm_af']
+
+
+def unload_index(pwm2):
+    pwm2._offsets = pwm2._entries = None
+    sys.modules.pop('pins_af', None)
+    sys.modules.pop('pwm_af', None)
+
+
+def scratch():
+    """A directory to write pwm_af.py in: a new temporary one on
+    CPython, or the current one on a board."""
+
+    try:
+        import tempfile
+    except ImportError:
+        return '.'
+    return tempfile.mkdtemp()
+
+
+def construct(pwm2, pyb):
+    return [pwm2.PWM(pyb.Pin(name), freq=20000) for name in PINS]
+
+
+def main():
+    if tracemalloc:
+        tracemalloc.start()
+    # What both versions of pwm2 import, so it isn't counted in either.
+    import pyb
+    import stats  # noqa: F401
+    forget()
+    measure('import pwm2, legacy af_map', import_legacy)
+    forget()
+    pwm2 = measure('import pwm2', import_pwm2)
+    unload_index(pwm2)
+    measure('index from pins_af', load_index, pwm2, 'pins_af')
+    # Written somewhere out of the way and removed after, so later runs
+    # of anything don't pick up a stale pwm_af.py.
+    folder = scratch()
+    path = folder + '/pwm_af.py'
+    try:
+        pwm2.write_index(path)
+    except OSError:
+        print('pwm_af.py not writable, skipping')
+    else:
+        sys.path.insert(0, folder)
+        try:
+            unload_index(pwm2)
+            measure('index from pwm_af', load_index, pwm2, 'pwm_af')
+        finally:
+            sys.path.remove(folder)
+            sys.modules.pop('pwm_af', None)
+            os.remove(path)
+            if folder != '.':
+                os.rmdir(folder)
+    measure('construct %d PWMs' % len(PINS), construct, pwm2, pyb)
+    pins = [pyb.Pin(name) for name in PINS]
+    start = ticks_us()
+    for pin in pins:
+        pwm2.timer_channels(pin)
+    print('%-28s %8d us' % ('%d lookups' % len(pins),
+                            ticks_diff(ticks_us(), start)))
+
+
+main()
@@ -0,0 +1,113 @@
+"""Software PWM: interrupt cost and jitter against output count.
+
+For each number of outputs, a SoftEngine runs them with the widths
+spread over 5-10% of the period, a servo's range, so every output
+has its own edge, then with all of them at the same width, sharing
+one. The time for a period's interrupts and for one edge's are
+printed, with the share of the CPU they take and how late the edges
+were. On a board lateness is measured from the timer's counter at
+each edge. The simulator's interrupts take no time, so there it's
+modelled from the measured interrupt times instead, which only gives
+a feel for the numbers. Edges start running late once they're closer
+together than an edge interrupt takes, which is the practical limit
+on outputs.
+
+Run from the repository root with `python bench/soft_pwm.py [FREQ]`,
+or call main() on a board."""
+
+import sys
+
+from harness import MICROPYTHON, per_call
+
+import pyb
+from softpwm import GUARD, SoftEngine, SoftPWM
+
+COUNTS = (1, 2, 4, 8, 16, 32)
+PINS = ['PC%d' % n for n in range(16)] + ['PB%d' % n for n in range(16)]
+PERIODS = 50
+
+
+def modelled(times, start, edge):
+    """The worst lateness of edges at times, if the period start's
+    interrupt takes start µs and each edge's takes edge µs."""
+
+    busy, worst = start, 0
+    for time in times:
+        begin = max(time, busy)
+        worst = max(worst, begin - time)
+        busy = begin + edge
+    return worst
+
+
+def measured(engine):
+    """The worst lateness in µs over PERIODS periods of engine."""
+
+    worst = [0]
+    end, timer = engine._end, engine.timer
+
+    def timed(timer):
+        worst[0] = max(worst[0],
+                       timer.counter() - engine._times[engine._edge])
+        end(timer)
+
+    engine.channel.callback(timed)
+    pyb.delay(PERIODS * 1000 // engine.freq)
+    engine.channel.callback(end)
+    return worst[0]
+
+
+def costs(engine):
+    """(µs for a whole period's interrupts, µs for one edge's)."""
+
+    timer, start, end = engine.timer, engine._start, engine._end
+    timer.callback(None)
+    engine.channel.callback(None)
+    edges = engine._edges
+
+    def period():
+        start(timer)
+        while engine._edge < len(edges):
+            end(timer)
+
+    def edge():
+        engine._edge = 0
+        end(timer)
+
+    result = per_call(period, calls=100), per_call(edge, calls=100)
+    timer.callback(start)
+    engine.channel.callback(end)
+    return result
+
+
+def run(freq, count, spread):
+    engine = SoftEngine(freq)
+    outputs = [SoftPWM(pyb.Pin(PINS[i]), engine=engine) for i in range(count)]
+    step = engine.full // 20
+    for i, output in enumerate(outputs):
+        output.pulse_width(step + (i * step // count if spread else step // 2))
+    pyb.delay(2 * 1000 // freq)
+    edges = len(engine._edges)
+    period, edge = costs(engine)
+    if MICROPYTHON:
+        late = measured(engine)
+    else:
+        start = period - edge * edges
+        late = modelled(engine._times[:-1], start, edge)
+    print('%7d %7s %6d %10.1f %6.2f%% %8.1f %8.1f'
+          % (count, 'spread' if spread else 'equal', edges, period,
+             period * freq / 10000, edge, late))
+    for output in outputs:
+        output.deinit()
+    engine.deinit()
+
+
+def main(freq=50):
+    print('%dHz, edges within %dus merged' % (freq, GUARD))
+    print('outputs  widths  edges  us/period     cpu  us/edge  late us')
+    for count in COUNTS:
+        for spread in (True, False):
+            run(freq, count, spread)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
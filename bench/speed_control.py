@@ -0,0 +1,85 @@
+"""Closed loop speed control: step response, loop cost and jitter.
+
+On the simulator an HBridge drives a simulated motor whose encoder
+counts show up in an encoder mode timer (sim/motor.py), so gains can
+be tuned off-target: `python bench/speed_control.py KP KI KD`. For
+each gain setting the motor is stepped to TARGET rpm, and the rise
+time, overshoot and steady state error are printed, along with the
+time and allocation of one loop update and the spread of the
+intervals between updates. On a board, wire a motor and encoder to
+the same pins and call main()."""
+
+import sys
+from array import array
+
+from harness import MICROPYTHON, allocated, per_call
+
+import pyb
+from motors.encoder import Encoder
+from motors.hbridge import HBridge
+from motors.pid import SpeedControl
+from pwm2 import free_timer
+
+COUNTS_PER_REV = 100
+TARGET = 300
+FREQ = 100
+RUN = 2000
+SAMPLE = 20
+GAINS = ((0.2, 0, 0), (0.1, 1.0, 0), (0.1, 2.0, 0.001))
+
+
+def step_response(bridge, encoder, timer, kp, ki, kd):
+    control = SpeedControl([bridge], [encoder], kp, ki, kd, freq=FREQ,
+                           timer=timer)
+    stamps = array('L', [0] * (RUN * FREQ // 1000 + 10))
+    ticks = [0]
+    tick = control.tick
+
+    def timed(timer):
+        if ticks[0] < len(stamps):
+            stamps[ticks[0]] = pyb.micros()
+            ticks[0] += 1
+        tick(timer)
+
+    control.target(0, TARGET)
+    control.start()
+    control.timer.callback(timed)
+    rpms = []
+    last = encoder.position
+    for _ in range(RUN // SAMPLE):
+        pyb.delay(SAMPLE)
+        rpms.append(encoder.rpm(encoder.position - last, SAMPLE))
+        last = encoder.position
+    control.stop()
+
+    rise = next((i * SAMPLE for i, rpm in enumerate(rpms)
+                 if rpm >= 0.9 * TARGET), None)
+    overshoot = max(0, max(rpms) - TARGET) * 100 / TARGET
+    settled = rpms[len(rpms) * 3 // 4:]
+    error = abs(sum(settled) / len(settled) - TARGET) * 100 / TARGET
+    gaps = [stamps[i + 1] - stamps[i] for i in range(ticks[0] - 1)]
+    print('%5.2f %5.2f %6.3f %8s %9.1f%% %8.1f%% %8.2f %6d %6d..%d'
+          % (kp, ki, kd, '%dms' % rise if rise is not None else '-',
+             overshoot, error, per_call(control.tick, control.timer, calls=100),
+             allocated(control.tick, control.timer), min(gaps), max(gaps)))
+
+
+def main(gains=GAINS):
+    bridge = HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA0'), pyb.Pin('PA1'))
+    encoder = Encoder(pyb.Pin('PA6'), pyb.Pin('PA7'),
+                      counts_per_rev=COUNTS_PER_REV)
+    timer = free_timer(FREQ)
+    if not MICROPYTHON:
+        from motor import Motor
+        Motor(bridge, max_speed=COUNTS_PER_REV * 10, encoder=encoder.timer)
+    print('   kp    ki     kd     rise overshoot    error  us/tick  bytes'
+          '  tick gaps')
+    for kp, ki, kd in gains:
+        step_response(bridge, encoder, timer, kp, ki, kd)
+        bridge.go(0)
+        pyb.delay(500)
+
+
+if __name__ == '__main__':
+    main([tuple(float(arg) for arg in sys.argv[1:4])] if len(sys.argv) > 1
+         else GAINS)
@@ -0,0 +1,470 @@
+"""Latency, throughput and allocation benchmarks for the drivers.
+
+Run from the repository root with `python bench/suite.py`. Each public
+driver method is called repeatedly, and the median time per call,
+calls per second and bytes allocated per call are printed. Setters
+alternate between two values, so every call writes. Results are
+compared against bench/baseline.json for this python implementation,
+and the run fails if any allocation grew by more than the threshold
+percentage. On a board, copy the drivers and bench files over and
+call suite.main().
+
+Allocations are the same from run to run, but times aren't: on
+CPython they swing by 2x with whatever else the machine is doing, so
+there they're only reported unless --times is given. On a board, or
+with --times, a time has only regressed if even the fastest of the
+repeats is over the threshold above the baseline's median.
+
+The baseline is only written with --save, after an intended change.
+
+Options:
+  --save           write the results as the new baseline
+  --threshold N    allowed growth, in percent (default 25)
+  --times          gate times on CPython too
+  --only TEXT      only run benchmarks whose name contains TEXT"""
+
+import sys
+
+try:
+    import json
+except ImportError:
+    import ujson as json
+
+from harness import MICROPYTHON, allocated, per_call
+
+import pyb
+import pwm2
+
+BASELINE = 'bench/baseline.json'
+THRESHOLD = 25
+CALLS = 500
+REPEATS = 7
+
+# The integer setters, which must not allocate whether or not they
+# change the output, so they can run in interrupt handlers, and the
+# cached setters repeating a value. On a board these fail the run if
+# they allocate at all, whatever the baseline says.
+NO_ALLOC = ('PWM.duty_u16(set)', 'PWM.pulse_width_ticks(set)',
+            'PWM.pulse_width_ticks(set, fast)', 'PWM.duty(unchanged)',
+            'PWM.pulse_width_ticks(unchanged)', 'Servo.angle_millideg(set)',
+            'Servo.speed_permille(set)', 'Servo.angle(unchanged)',
+            'Servo.speed(unchanged)', 'HBridge.go(ONE_SPEED)',
+            'HBridge.go(RUN_COAST)', 'HBridge.go(RUN_BRAKE)',
+            'HBridge.go(RUN_BRAKE, -60)', 'HBridge.go(RUN_BRAKE, reversing)',
+            'HBridge.go(RUN_BRAKE, unchanged)')
+
+# (name, fun, args) to time, filled in by each group.
+_benchmarks = []
+
+
+def benchmark(name, fun, *args):
+    _benchmarks.append((name, fun, args))
+
+
+def alternate(fun, first, second):
+    """A function calling fun with first, then second, and so on.
+
+    Setters skip writing a value that's already set, so benchmarking
+    one with the same value would only time the skip. Tuples are
+    passed as several arguments."""
+
+    values = [second, first]
+    if isinstance(first, tuple):
+        def call():
+            values.reverse()
+            fun(*values[0])
+    else:
+        def call():
+            values.reverse()
+            fun(values[0])
+    return call
+
+
+def release():
+    """Give back every PWM timer, so the next group can use them."""
+
+    for number, slot in list(pwm2._timers.items()):
+        if slot[1] is not None:
+            slot[0].deinit()
+            del pwm2._timers[number]
+
+
+def pwm_group():
+    from pwm2 import PWM
+
+    pwm = PWM(pyb.Pin('PA6'), freq=20000)
+    benchmark('PWM.duty(set)', alternate(pwm.duty, 40, 60))
+    benchmark('PWM.duty(get)', pwm.duty)
+    benchmark('PWM.duty_u16(set)', alternate(pwm.duty_u16, 26214, 39321))
+    benchmark('PWM.pulse_width(set)', alternate(pwm.pulse_width, 20, 30))
+    benchmark('PWM.pulse_width(get)', pwm.pulse_width)
+    benchmark('PWM.duty(unchanged)', pwm.duty, 40)
+    benchmark('PWM.pulse_width_ticks(unchanged)', pwm.pulse_width_ticks, 1680)
+    benchmark('PWM.pulse_width_ticks(set)',
+              alternate(pwm.pulse_width_ticks, 1680, 2520))
+    fast = PWM(pyb.Pin('PA7'), freq=20000, fast=True)
+    benchmark('PWM.duty(set, fast)', alternate(fast.duty, 40, 60))
+    benchmark('PWM.pulse_width_ticks(set, fast)',
+              alternate(fast.pulse_width_ticks, 1680, 2520))
+
+    from softpwm import SoftEngine, SoftPWM
+    engine = SoftEngine(50)
+    soft = [SoftPWM(pyb.Pin('PC%d' % i), engine=engine) for i in range(16)]
+    for i, output in enumerate(soft):
+        output.pulse_width(1000 + 50 * i)
+    benchmark('SoftPWM.pulse_width(set)',
+              alternate(soft[0].pulse_width, 1200, 1400))
+    benchmark('SoftPWM.pulse_width_ticks(set)',
+              alternate(soft[0].pulse_width_ticks, 1300, 1500))
+    benchmark('SoftEngine.rebuild(16 outputs)', engine.rebuild)
+    benchmark('SoftEngine period start(16)', engine._start, engine.timer)
+
+    def edge(timer):
+        engine._edge = 0
+        engine._end(timer)
+    benchmark('SoftEngine edge', edge, engine.timer)
+
+
+def servo_group():
+    from motors.servo import Servo
+
+    servo = Servo(pyb.Pin('PB6'))
+    servo.calibration(1000, 2000, 1500, 500, 500)
+    benchmark('Servo.angle(set)', alternate(servo.angle, 30, -30))
+    benchmark('Servo.angle(get)', servo.angle)
+    benchmark('Servo.angle(unchanged)', servo.angle, 30)
+    benchmark('Servo.angle_millideg(set)',
+              alternate(servo.angle_millideg, 30000, -30000))
+    benchmark('Servo.speed(set)', alternate(servo.speed, 30, -30))
+    benchmark('Servo.speed(unchanged)', servo.speed, 30)
+    benchmark('Servo.speed_permille(set)',
+              alternate(servo.speed_permille, 300, -300))
+    benchmark('Servo.pulse_width(set)',
+              alternate(servo.pulse_width, 1700, 1300))
+
+    from motors.trajectory import Player, trapezoid, waypoints
+    other = Servo(pyb.Pin('PB7'))
+    other.calibration(1000, 2000, 1500, 500, 500)
+    player = Player()
+    player.load(servo, waypoints(servo, [(0, 0), (1000, 90), (2000, -90)]))
+    player.load(other, trapezoid(other, -90, 90, 180, 360))
+    player.loop = True
+    benchmark('Player.tick(2 servos)', player.tick, player.timer)
+
+    from commands import Queue
+    from ramp import Scheduler
+    queue = Queue(ramps=Scheduler())
+    benchmark('Queue.at(coalesced)', queue.at, pyb.micros() + 1000000, servo,
+              servo.angle_millideg, 30000)
+    for i in range(15):
+        queue.at(pyb.micros() + 1000000, i, servo.angle_millideg, 0)
+    benchmark('Queue.dispatch(16 pending)', queue.dispatch)
+    queue.ramps.timer.callback(None)
+    pwm2.unreserve(queue.ramps.timer)
+
+    from motors.servobank import ServoBank
+    bank = ServoBank()
+    for i in range(16):
+        bank.servo(pyb.Pin('PC%d' % i)).angle(i * 5 - 40)
+    benchmark('ServoBank slot start(16 servos)', bank._start_slot, bank.timer)
+    benchmark('ServoBank pulse end', bank._enders[0], bank.timer)
+
+
+def hbridge_group():
+    from motors.hbridge import HBridge
+
+    one = HBridge(HBridge.ONE_SPEED, pyb.Pin('PC0'), pyb.Pin('PB0'))
+    coast = HBridge(HBridge.RUN_COAST, pyb.Pin('PA0'), pyb.Pin('PA1'))
+    brake = HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA2'), pyb.Pin('PA3'))
+    benchmark('HBridge.go(ONE_SPEED)', alternate(one.go, 60, 40))
+    fast = HBridge(HBridge.ONE_SPEED, pyb.Pin('PC2'), pyb.Pin('PB1'),
+                   fast=True)
+    benchmark('HBridge.go(ONE_SPEED, fast)', alternate(fast.go, 60, 40))
+    benchmark('HBridge.go(RUN_COAST)', alternate(coast.go, 60, 40))
+    benchmark('HBridge.go(RUN_BRAKE)', alternate(brake.go, 60, 40))
+    benchmark('HBridge.go(RUN_BRAKE, -60)', alternate(brake.go, -60, -40))
+    benchmark('HBridge.go(RUN_BRAKE, reversing)',
+              alternate(brake.go, 60, -60))
+    benchmark('HBridge.go(RUN_BRAKE, unchanged)', brake.go, 60)
+    from motors.curve import Curve
+    curved = HBridge(HBridge.RUN_BRAKE, pyb.Pin('PB6'), pyb.Pin('PB7'),
+                     curve=Curve([(1, 10), (50, 40), (100, 100)]))
+    benchmark('HBridge.go(RUN_BRAKE, curve)', alternate(curved.go, 60, 40))
+    slewed = HBridge(HBridge.RUN_BRAKE, pyb.Pin('PB8'), pyb.Pin('PB9'),
+                     accel=0.5)
+    benchmark('HBridge.go(RUN_BRAKE, accel)', alternate(slewed.go, 60, 40))
+    benchmark('HBridge.go(get)', brake.go)
+    benchmark('HBridge.brake', brake.brake)
+    benchmark('HBridge.coast', brake.coast)
+
+
+def gang_group():
+    from motors.gang import Gang
+    from motors.hbridge import HBridge
+
+    left = [HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA0'), pyb.Pin('PA1')),
+            HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA2'), pyb.Pin('PA3'))]
+    right = [HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA8'), pyb.Pin('PA9')),
+             HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA10'), pyb.Pin('PA11'))]
+    gang = Gang(left, right)
+    benchmark('Gang.go(4 motors)', alternate(gang.go, 60, 40))
+    benchmark('Gang.brake(4 motors)', gang.brake)
+    release()
+
+    left = [HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA0'), pyb.Pin('PA1')),
+            HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA2'), pyb.Pin('PA3'))]
+    right = [HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA8'), pyb.Pin('PA9')),
+             HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA10'), pyb.Pin('PA11'))]
+    gang = Gang(left, right, sync=True)
+    benchmark('Gang.go(4 motors, sync)', alternate(gang.go, 60, 40))
+    benchmark('Gang.go(4 motors, sync, reversing)',
+              alternate(gang.go, 60, -60))
+
+
+def drive_group():
+    from motors.drive import Differential, Mecanum
+    from motors.hbridge import HBridge
+
+    left = [HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA0'), pyb.Pin('PA1')),
+            HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA2'), pyb.Pin('PA3'))]
+    right = [HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA8'), pyb.Pin('PA9')),
+             HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA10'), pyb.Pin('PA11'))]
+    drive = Differential(left, right, mirrored=True, trims=[100, 100, 95, 95])
+    benchmark('Differential.go(4 motors)',
+              alternate(drive.go, (60, 20), (40, -20)))
+    benchmark('Differential.tank(4 motors)',
+              alternate(drive.tank, (60, 40), (40, 60)))
+    release()
+
+    mecanum = Mecanum(*[HBridge(HBridge.RUN_BRAKE, pyb.Pin(in1), pyb.Pin(in2))
+                        for in1, in2 in (('PA0', 'PA1'), ('PA8', 'PA9'),
+                                         ('PA2', 'PA3'), ('PA10', 'PA11'))])
+    benchmark('Mecanum.go(4 motors)',
+              alternate(mecanum.go, (60, 30, 20), (40, -30, -20)))
+
+
+def latch_changes(shield):
+    """update_latch, with a motor's direction bit flipped each time."""
+
+    def call():
+        shield.latch_value ^= shield.motor_bits[0][0]
+        shield.update_latch()
+    return call
+
+
+def shield_group():
+    from motors.AFMotorShield import AFMotorShieldV1
+
+    shield = AFMotorShieldV1()
+    for motor in range(1, 5):
+        shield.motor(motor)
+    benchmark('AFMotorShieldV1.update_latch', latch_changes(shield))
+    benchmark('AFMotorShieldV1.go(1 motor)',
+              alternate(shield.go, (60, 1), (40, 1)))
+    benchmark('AFMotorShieldV1.go(4 motors)', alternate(shield.go, 60, 40))
+    benchmark('AFMotorShieldV1.brake', shield.brake)
+    benchmark('AFMotorShieldV1.go(reversing)', alternate(shield.go, 60, -60))
+    release()
+
+    shield = AFMotorShieldV1(fast=True)
+    for motor in range(1, 5):
+        shield.motor(motor)
+    benchmark('AFMotorShieldV1.update_latch(fast)', latch_changes(shield))
+    benchmark('AFMotorShieldV1.go(4 motors, fast)',
+              alternate(shield.go, 60, 40))
+    benchmark('AFMotorShieldV1.go(reversing, fast)',
+              alternate(shield.go, 60, -60))
+    release()
+
+    from motors.latch import SPILatch
+    spi = pyb.SPI(2, pyb.SPI.MASTER, baudrate=4000000, polarity=0)
+    shield = AFMotorShieldV1(latch=SPILatch(spi, pyb.Pin('D12')))
+    for motor in range(1, 5):
+        shield.motor(motor)
+    benchmark('AFMotorShieldV1.go(4 motors, spi)',
+              alternate(shield.go, 60, 40))
+    benchmark('AFMotorShieldV1.go(reversing, spi)',
+              alternate(shield.go, 60, -60))
+    release()
+
+    shield = AFMotorShieldV1(accel=0.5)
+    for motor in range(1, 5):
+        shield.motor(motor)
+    benchmark('AFMotorShieldV1.go(4 motors, accel)',
+              alternate(shield.go, 60, 40))
+    release()
+
+    from motors.AFMotorShield import MICROSTEP
+    shield = AFMotorShieldV1()
+    full = shield.stepper(1)
+    micro = shield.stepper(2, MICROSTEP)
+    for stepper in full, micro:
+        stepper.move(1000000)
+        stepper._wait = 0
+    benchmark('Stepper.tick', full.tick, None)
+    benchmark('Stepper.tick(microstep)', micro.tick, None)
+    benchmark('Stepper._step', full._step, 1)
+    benchmark('Stepper._interval', full._interval)
+    benchmark('Stepper.move_to(moving)', full.move_to, 1000000)
+    full.deinit()
+    micro.deinit()
+
+
+def board_group():
+    from motors.board import Board
+
+    benchmark('Board(fundumoto)', Board, 'fundumoto')
+    board = Board('fundumoto')
+    board.buzzer
+    benchmark('Board.buzzer(built)', getattr, board, 'buzzer')
+
+
+def hcsr04_group():
+    from HCSR04 import HCSR04, HCSR04Array
+
+    sensor = HCSR04(pyb.Pin('PC1'), pyb.Pin('PB5'))
+    sensor.elapsed = 1000
+    benchmark('HCSR04.distance', sensor.distance)
+    sensor._filter(1000)
+    benchmark('HCSR04.distance(filtered)', sensor.distance, None, True)
+    benchmark('HCSR04._filter', sensor._filter, 1000)
+    benchmark('HCSR04.trigger', sensor.trigger)
+    benchmark('HCSR04.IRQ', sensor.IRQ, None)
+    captured = HCSR04(pyb.Pin('PC0'), pyb.Pin('PB7'), capture=True)
+    benchmark('HCSR04._echo', captured._echo, 1000)
+
+    sensors = [HCSR04(pyb.Pin('PC%d' % i), pyb.Pin('PB%d' % (i + 4)))
+               for i in range(4)]
+    ranger = HCSR04Array(sensors, gap=0)
+    benchmark('HCSR04Array.tick(4 sensors)', ranger.tick, ranger.timer)
+    benchmark('HCSR04Array.distance', ranger.distance, 1)
+
+
+def pulsein_group():
+    from pulsein import PulseIn, RCChannel
+
+    pin = pyb.Pin('PB6')
+    polled = PulseIn(pin)
+    benchmark('PulseIn.width(polled)', polled.width)
+    polled.deinit()
+    buffered = PulseIn(pin, size=16)
+    benchmark('PulseIn._trailing', buffered._trailing, None)
+    benchmark('PulseIn.width', buffered.width)
+    buffered.deinit()
+    single = PulseIn(pin, paired=False)
+    benchmark('PulseIn._edge', single._edge, None)
+    single.deinit()
+    rc = RCChannel(pin)
+    rc._pulse(1500)
+    benchmark('RCChannel.value', rc.value)
+
+
+def stats_group():
+    from stats import Stats
+
+    stats = Stats('bench', ('calls',), ('time',))
+    benchmark('Stats.count', stats.count, 0)
+    benchmark('Stats.time', stats.time, 0, pyb.micros())
+
+
+GROUPS = (stats_group, pwm_group, servo_group, hbridge_group, gang_group, drive_group,
+          shield_group, board_group, hcsr04_group, pulsein_group)
+
+
+def run(only=None):
+    """Run the benchmarks.
+
+    Returns {name: [median us per call, bytes per call, best us]}."""
+
+    results = {}
+    for group in GROUPS:
+        del _benchmarks[:]
+        group()
+        for name, fun, args in _benchmarks:
+            if only and only not in name:
+                continue
+            times = sorted(per_call(fun, *args, calls=CALLS)
+                           for _ in range(REPEATS))
+            results[name] = [times[len(times) // 2],
+                             allocated(fun, *args), times[0]]
+        release()
+    return results
+
+
+def load(filename=BASELINE):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def compare(results, baseline, threshold=THRESHOLD, times=MICROPYTHON):
+    """Print results against baseline, returning the names that regressed.
+
+    Times only count if times is set, see above. On a board, the
+    NO_ALLOC benchmarks also regress if they allocate at all."""
+
+    limit = 1 + threshold / 100
+    regressed = []
+    print('%-32s %10s %12s %8s %10s' % ('benchmark', 'us/call', 'calls/s',
+                                        'bytes', 'baseline'))
+    for name in sorted(results):
+        us, used, best = results[name]
+        base = baseline.get(name)
+        note = ''
+        if base:
+            note = '%8.2fus %6d' % (base[0], base[1])
+            if used > base[1] * limit or times and best > base[0] * limit:
+                regressed.append(name)
+                note += '  REGRESSED'
+        if MICROPYTHON and used and name in NO_ALLOC \
+           and name not in regressed:
+            regressed.append(name)
+            note += '  ALLOCATES'
+        print('%-32s %10.2f %12d %8d %s' % (name, us, 1000000 / us if us else 0,
+                                            used, note))
+    return regressed
+
+
+def main(save=False, threshold=THRESHOLD, only=None, filename=BASELINE,
+         times=MICROPYTHON):
+    implementation = 'micropython' if MICROPYTHON else sys.implementation.name
+    results = run(only)
+    baselines = load(filename)
+    regressed = compare(results, baselines.get(implementation, {}), threshold,
+                        times)
+    if save:
+        baseline = baselines.setdefault(implementation, {})
+        for name in results:
+            baseline[name] = results[name][:2]
+        with open(filename, 'w') as f:
+            json.dump(baselines, f)
+        print('Saved baseline to', filename)
+    elif regressed:
+        print('%d regressions over %d%%: %s' % (len(regressed), threshold,
+                                              ', '.join(regressed)))
+    return not regressed
+
+
+def _args(argv):
+    options = dict(save=False, threshold=THRESHOLD, only=None,
+                   times=MICROPYTHON)
+    argv = list(argv)
+    while argv:
+        arg = argv.pop(0)
+        if arg == '--save':
+            options['save'] = True
+        elif arg == '--threshold':
+            options['threshold'] = int(argv.pop(0))
+        elif arg == '--times':
+            options['times'] = True
+        elif arg == '--only':
+            options['only'] = argv.pop(0)
+        else:
+            raise SystemExit(__doc__)
+    return options
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main(**_args(sys.argv[1:])) else 1)
@@ -0,0 +1,205 @@
+"""Commands run at set times, from the ramp scheduler's timer.
+
+Coordinating actuators ("in 50ms, servo 2 to 30 degrees and the left
+wheel to 60%") usually takes a timing loop in the application, so the
+changes land whenever the main loop gets round to them. A Queue holds
+commands with micros() deadlines instead, and runs each from the
+ramp scheduler's tick once it's due (see ramp.py), so they share the
+one interrupt with the ramps and land within a tick of their time,
+however busy the main loop is. Commands due on the same tick run
+together, in deadline order.
+
+A command is a setter to call with a value, for an owner, normally
+the actuator. The setter runs in the timer interrupt, so like a ramp
+setter it must not allocate: use the integer setters, such as
+Servo.angle_millideg, PWM.duty_u16 or PWM.pulse_width_ticks, and
+HBridge.go with ints.
+
+Commands for an owner supersede each other. A new one drops the
+owner's queued commands due at or after it, and when several of an
+owner's commands are due on one tick, only the last runs.
+
+The slots are preallocated, and queuing doesn't allocate either, so
+commands can be queued from interrupt handlers too.
+
+Most code uses the default queue via queue(), which is created on
+first use on the default ramp scheduler."""
+
+from array import array
+
+from pyb import disable_irq, elapsed_micros, enable_irq, micros
+
+from ramp import scheduler
+from stats import attach
+
+DEFAULT_SLOTS = 16
+
+# micros() wraps at 2**30, so deadlines more than half that ago are
+# taken to be in the future.
+MASK = 0x3fffffff
+HALF = 0x20000000
+
+_queue = None
+
+# Queue stats counters and timers, see stats.py.
+QUEUED = 0
+DISPATCHED = 1
+SUPERSEDED = 2
+LATE = 0
+
+
+class QueueError(Exception):
+    pass
+
+
+class Queue:
+    """Up to slots pending commands, dispatched by a ramp Scheduler.
+
+    If ramps is None, the default scheduler is used. A scheduler can
+    only dispatch one queue.
+
+    With stats.enable(), queued, dispatched and superseded commands
+    are counted, and how late each ran goes in a histogram, see
+    stats.py."""
+
+    def __init__(self, slots=DEFAULT_SLOTS, ramps=None):
+        if ramps is None:
+            ramps = scheduler()
+        if ramps.queue is not None:
+            raise QueueError("The scheduler already has a queue")
+        self.ramps = ramps
+        self.deadlines = array('L', [0] * slots)
+        # Queuing order, to keep commands with the same deadline in order.
+        self.order = array('L', [0] * slots)
+        self.active = bytearray(slots)
+        self.owners = [None] * slots
+        self.setters = [None] * slots
+        self.values = [None] * slots
+        self.count = 0
+        self._next = 0
+        self._stats = attach('commands', ('queued', 'dispatched',
+                                          'superseded'), ('late',))
+        ramps.queue = self
+
+    def at(self, deadline, owner, setter, value):
+        """Call setter(value) once micros() reaches deadline.
+
+        Drops owner's commands due at or after deadline. Raises
+        QueueError if all the slots are in use."""
+
+        state = disable_irq()
+        try:
+            free = -1
+            for i in range(len(self.active)):
+                if not self.active[i]:
+                    if free < 0:
+                        free = i
+                elif self.owners[i] is owner and \
+                        (self.deadlines[i] - deadline) & MASK < HALF:
+                    self._free(i)
+                    if free < 0 or i < free:
+                        free = i
+                    if self._stats is not None:
+                        self._stats.count(SUPERSEDED)
+            if free < 0:
+                raise QueueError("All %d commands are in use"
+                                 % len(self.active))
+            self.deadlines[free] = deadline & MASK
+            self.order[free] = self._next
+            self._next = (self._next + 1) & MASK
+            self.owners[free] = owner
+            self.setters[free] = setter
+            self.values[free] = value
+            self.active[free] = 1
+            self.count += 1
+        finally:
+            enable_irq(state)
+        if self._stats is not None:
+            self._stats.count(QUEUED)
+        self.ramps.run()
+
+    def after(self, delay, owner, setter, value):
+        """Call setter(value) delay µs from now, see at."""
+
+        self.at(micros() + delay, owner, setter, value)
+
+    def _free(self, i):
+        self.active[i] = 0
+        self.owners[i] = self.setters[i] = self.values[i] = None
+        self.count -= 1
+
+    def cancel(self, owner):
+        """Drop all of owner's commands."""
+
+        state = disable_irq()
+        for i in range(len(self.active)):
+            if self.active[i] and self.owners[i] is owner:
+                self._free(i)
+        enable_irq(state)
+
+    def pending(self, owner=None):
+        """The number of commands queued for owner, or for anyone."""
+
+        if owner is None:
+            return self.count
+        count = 0
+        for i in range(len(self.active)):
+            if self.active[i] and self.owners[i] is owner:
+                count += 1
+        return count
+
+    def _due(self):
+        """The slot of the earliest due command, or -1 if none is due.
+
+        Deadlines are compared by how long ago they were, so it works
+        across the micros() wrap."""
+
+        best, ago, order = -1, -1, 0
+        for i in range(len(self.active)):
+            if self.active[i]:
+                late = elapsed_micros(self.deadlines[i])
+                if late < HALF and (late > ago or late == ago and
+                                    (self.order[i] - order) & MASK >= HALF):
+                    best, ago, order = i, late, self.order[i]
+        return best
+
+    def _superseded(self, i):
+        """Is another of i's owner's commands due, and queued after it?"""
+
+        owner = self.owners[i]
+        for j in range(len(self.active)):
+            if j != i and self.active[j] and self.owners[j] is owner \
+               and elapsed_micros(self.deadlines[j]) < HALF:
+                return True
+        return False
+
+    def dispatch(self):
+        """Run the due commands, returning True if any are left.
+
+        Called from the scheduler's tick."""
+
+        stats = self._stats
+        i = self._due()
+        while i >= 0:
+            if self._superseded(i):
+                if stats is not None:
+                    stats.count(SUPERSEDED)
+                self._free(i)
+            else:
+                setter, value = self.setters[i], self.values[i]
+                if stats is not None:
+                    stats.count(DISPATCHED)
+                    stats.add(LATE, elapsed_micros(self.deadlines[i]))
+                self._free(i)
+                setter(value)
+            i = self._due()
+        return self.count > 0
+
+
+def queue():
+    """Return the default queue, creating it if needed."""
+
+    global _queue
+    if _queue is None:
+        _queue = Queue()
+    return _queue
@@ -0,0 +1,87 @@
+"""Register level GPIO and timer writes through stm.mem32.
+
+These skip the pyb method calls, for the drivers' hot paths. Drivers
+use them when created with fast=True. The simulator's stm module maps
+the same registers onto its pins and timers, so the fast paths run
+off-target too."""
+
+import stm
+
+GPIO_SIZE = stm.GPIOB - stm.GPIOA
+CCR_OFFSETS = (None, stm.TIM_CCR1, stm.TIM_CCR2, stm.TIM_CCR3, stm.TIM_CCR4)
+
+
+class FastPin:
+    """A GPIO output set through its port's BSRR register.
+
+    Setting and clearing bits are precomputed, so writes don't
+    allocate even for pins whose reset bit isn't a small int."""
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.bsrr = stm.GPIOA + GPIO_SIZE * pin.port() + stm.GPIO_BSRR
+        self.set = 1 << pin.pin()
+        self.reset = self.set << 16
+
+    def on(self):
+        stm.mem32[self.bsrr] = self.set
+
+    def off(self):
+        stm.mem32[self.bsrr] = self.reset
+
+    high = on
+    low = off
+
+    def value(self, value=None):
+        if value is None:
+            return self.pin.value()
+        stm.mem32[self.bsrr] = self.set if value else self.reset
+
+
+class Register:
+    """A 32 bit register, with write usable as a setter for ramps."""
+
+    def __init__(self, address):
+        self.address = address
+
+    def write(self, value):
+        stm.mem32[self.address] = value
+
+    def read(self):
+        return stm.mem32[self.address]
+
+
+def timer_register(timer, offset):
+    """The register at offset (e.g. stm.TIM_CR1) of timer number timer."""
+
+    return Register(getattr(stm, 'TIM%d' % timer) + offset)
+
+
+def compare_register(timer, channel):
+    """The CCR register for channel (1-4) of timer number timer."""
+
+    return timer_register(timer, CCR_OFFSETS[channel])
+
+
+class ShiftRegister:
+    """A 74HC595 style shift register driven through BSRR writes.
+
+    Bits are clocked out most significant first, then the latch pin
+    goes high to copy them to the outputs."""
+
+    def __init__(self, data, clock, latch):
+        self.data = FastPin(data)
+        self.clock = FastPin(clock)
+        self.latch = FastPin(latch)
+
+    def write(self, value, bits=8):
+        mem = stm.mem32
+        data, clock, latch = self.data, self.clock, self.latch
+        clock_bsrr, clock_set, clock_reset = clock.bsrr, clock.set, clock.reset
+        data_bsrr, data_set, data_reset = data.bsrr, data.set, data.reset
+        mem[latch.bsrr] = latch.reset
+        for bit in range(bits - 1, -1, -1):
+            mem[clock_bsrr] = clock_reset
+            mem[data_bsrr] = data_set if value >> bit & 1 else data_reset
+            mem[clock_bsrr] = clock_set
+        mem[latch.bsrr] = latch.set
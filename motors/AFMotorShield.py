@@ -14,15 +14,55 @@ Hence, not properly tested."""
 # Servo #1		D9		PC7		
 # Servo #2		D10		PB6
 
-from pyb import Pin
-from pwm2 import PWM
+from array import array
+from math import cos, pi, sin, sqrt
+
+from pyb import Pin, Timer, disable_irq, enable_irq, micros
+from pwm2 import PWM, PwmError, reserve, unreserve
+from stats import attach
 import stm
 
+from .latch import SoftLatch
+
+# Stats counters and timers, see stats.py.
+GO = 0
+GO_TIME = 0
+STEPS = 0
+MOVES = 1
+STEP_TIME = 0
+
+# Stepper styles, as in Adafruit's library: one coil on at a time, two
+# coils, alternating one and two for half steps, and PWM microsteps.
+SINGLE = 0
+DOUBLE = 1
+INTERLEAVE = 2
+MICROSTEP = 3
+
+# Each style's coil A, B states for a cycle of steps: 1 forward, -1
+# reverse, 0 off. MICROSTEP tables are worked out for the step count.
+_PHASES = (((1, 0), (0, 1), (-1, 0), (0, -1)),
+           ((1, 1), (-1, 1), (-1, -1), (1, -1)),
+           ((1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1),
+            (1, -1)))
+
+# Timers to try for stepping, those with two channels and no shield pins
+# first. The timer counts µs, and each stepper uses a compare channel.
+STEP_TIMERS = (9, 12, 5, 4, 1, 8, 3, 2)
+# The shortest step interval in µs. The step interrupt must finish
+# well inside it, or the next compare is missed for a whole timer cycle.
+MIN_INTERVAL = 200
+
+# The shield, see board.py. Its pins are the latch, clock, enable and
+# data pins of the shift register.
+BOARD = {
+    'shield': ('afmotor', ('D12', 'D4', 'D7', 'D8'), {}),
+}
+
 class MotorError(Exception):
     pass
 
 class AFMotorShieldV1:
-    """Driver for the AdaFruit Motor/Stepper/Shield"""
+    """Driver for the AdaFruit Motor/Stepper/Shield
     
     This uses L293D drivers, but the control pins are tied to an 8 bit
     shift register, not the L293D. So in order to set the mode on the
@@ -33,30 +73,68 @@ class AFMotorShieldV1:
     Yeah, the docs say version 1 is ancient and obsolete, but I have
     one, so..."""
 
-    motors = 4 * [None]
-
     # Each tuple is A, B bitmasks for the latch and pin for PWM speed control
-    motor_bits = [(1 << 2, 1 << 3, 'D12'),
+    motor_bits = [(1 << 2, 1 << 3, 'D11'),
                   (1 << 1, 1 << 4, 'D3'),
                   (1 << 5, 1 << 7, 'D5'),
                   (1 << 0, 1 << 6, 'D6')]
 
-    latch_pin = Pin('D12', Pin.OUT)
-    clk_pin = Pin('D4', Pin.OUT)
-    en_pin = Pin('D7', Pin.OUT)
-    data_pin = Pin('D8', Pin.OUT)
+    def __init__(self, fast=False, accel=None, latch=None, pins=None):
+        """Create my instance variables.
+
+        If fast is set, the latch is written and the motor PWM set
+        through registers, see fastio.py. accel limits how fast motor
+        speeds change, see acceleration.
+
+        latch is the transport for the shift register, see latch.py.
+        It defaults to bit-banging the shield's pins; pass an SPILatch
+        if they're wired to an SPI bus.
 
-    def __init__(self):
-        """Create my instance variables."""
+        pins are the names of the latch, clock, enable and data pins,
+        defaulting to the shield's, see BOARD.
 
-        self.latch_pin = Pin('D12', Pin.OUT)
-        self.clock_pin = Pin('D4', Pin.OUT)
-        self.data_pin = Pin('D8', Pin.OUT)
-        self.en_pin = Pin('D7', Pin.OUT)
+        With stats.enable(), go is counted and timed, and the latch
+        counts its writes, see stats.py."""
 
+        self.motors = 4 * [None]
+        self.steppers = 2 * [None]
+        self._step_timer = None
+
+        latch_pin, clock_pin, en_pin, data_pin = pins or BOARD['shield'][1]
+        self.latch_pin = Pin(latch_pin, Pin.OUT)
+        self.clock_pin = Pin(clock_pin, Pin.OUT)
+        self.data_pin = Pin(data_pin, Pin.OUT)
+        self.en_pin = Pin(en_pin, Pin.OUT)
+
+        self.fast = fast
+        if latch is None:
+            latch = SoftLatch(self.data_pin, self.clock_pin, self.latch_pin,
+                              fast)
+        self.latch = latch
+        self._stats = attach('AFMotorShieldV1', ('go',), ('go',))
         self.latch_value = 0
         self.update_latch()
         self.en_pin.off()
+        self._ramps = None
+        self._rate = 0
+        if accel:
+            self.acceleration(accel)
+
+    def acceleration(self, accel=None):
+        """Limit motor speed changes to accel units per ms.
+
+        go then just sets a target, and each motor's speed heads for
+        it at that rate from the ramp scheduler's timer (see ramp.py),
+        changing direction in the latch as it passes through zero. Set
+        to 0 for no limit. Returns the current limit if called without
+        an argument."""
+
+        if accel is None:
+            return self._rate / 1000 if self._rate else None
+        self._rate = round(accel * 1000)
+        if self._rate and self._ramps is None:
+            from ramp import scheduler
+            self._ramps = scheduler()
 
     def motor(self,  motor, reversed=False):
         """Init motor # motor. Optionally treat it as reversed.
@@ -66,32 +144,91 @@ class AFMotorShieldV1:
 
         if 1 <= motor <= 4:
             motor -= 1
+            if self.steppers[motor // 2] is not None:
+                raise MotorError("Motor %d is part of stepper %d"
+                                 % (motor + 1, motor // 2 + 1))
             self.motors[motor] = _L293D(self, *self.motor_bits[motor],
                                         reversed=reversed)
         else:
             raise MotorError("Motors are 1, 2, 3 and 4")
 
+    def stepper(self, stepper, style=DOUBLE, microsteps=16, speed=200,
+                accel=400):
+        """Init stepper # stepper, and return it.
+
+        Stepper 1 is wired to motors 1 and 2, and stepper 2 to 3 and 4,
+        so those can't also be DC motors. See Stepper for the rest."""
+
+        if stepper not in (1, 2):
+            raise MotorError("Steppers are 1 and 2")
+        first = 2 * (stepper - 1)
+        if self.motors[first] is not None or self.motors[first + 1] is not None:
+            raise MotorError("Motors %d and %d are DC motors"
+                             % (first + 1, first + 2))
+        old = self.steppers[stepper - 1]
+        if old is not None:
+            old.deinit()
+        self.steppers[stepper - 1] = Stepper(
+            self, stepper, self.motor_bits[first], self.motor_bits[first + 1],
+            style, microsteps, speed, accel)
+        return self.steppers[stepper - 1]
+
+    def step_timer(self):
+        """The timer the steppers step from, reserved on first use.
+
+        It runs free counting µs over 16 bits. See STEP_TIMERS."""
+
+        if self._step_timer is None:
+            for number in STEP_TIMERS:
+                try:
+                    prescaler = Timer(number).source_freq() // 1000000 - 1
+                    self._step_timer = reserve(number, prescaler=prescaler,
+                                               period=0xffff)
+                    break
+                except (ValueError, PwmError):
+                    continue
+            else:
+                raise MotorError("No free timer for steppers")
+        return self._step_timer
+
+    def _free_step_timer(self):
+        """Give the step timer back once no stepper is using it."""
+
+        if self._step_timer is not None and self.steppers == [None, None]:
+            unreserve(self._step_timer)
+            self._step_timer = None
+
     def motor_list(self, motor):
         if motor is None:
             return [m for m in self.motors if m is not None]
         elif 1 <= motor <= 4 and self.motors[motor - 1] is not None:
-            return self.motors[motor - 1]
+            return [self.motors[motor - 1]]
         else:
             raise MotorError("Motor %d isn't attached" % motor)
 
     def update_latch(self):
-        """Let the L293 chips know what we want."""
-
-        self.latch_pin.off()
-        self.data_pin.off()
-        for bit in range(7, -1, -1):
-            self.clock_pin.off()
-            if self.latch_value & (1 << bit):
-                self.data_pin.on()
-            else:
-                self.data_pin.off()
-            self.clock_pin.on()
-        self.latch_pin.on()
+        """Let the L293 chips know what we want.
+
+        Nothing is written if the latch already has the value. The
+        write is made with interrupts off, so a stepper or ramp
+        interrupt can't write the latch halfway through it."""
+
+        state = disable_irq()
+        self.latch.update(self.latch_value)
+        enable_irq(state)
+
+    def _latch_bits(self, clear, bits, write=False):
+        """Clear then set bits in latch_value, writing it if write is set.
+
+        The step and ramp interrupts change latch_value too, so this is
+        done with interrupts off, or one landing between the read and
+        the write would lose its bits."""
+
+        state = disable_irq()
+        self.latch_value = self.latch_value & ~clear | bits
+        if write:
+            self.latch.update(self.latch_value)
+        enable_irq(state)
 
     def go(self, speed, motor=None):
         """Run the indicated motor at the given speed.
@@ -99,21 +236,43 @@ class AFMotorShieldV1:
         Speed is from 100 (forward) to -100 (reverse).  If you don't
         provide a motor number, applies to all attached motors."""
 
-        self.en_pin.off()
+        stats = self._stats
+        if stats is not None:
+            stats.count(GO)
+            start = micros()
         motors = self.motor_list(motor)
+        if self._rate:
+            speed = round(speed)
+            for motor in motors:
+                self._ramps.slew(motor, motor._drive, motor._speed, speed,
+                                 self._rate)
+            self.en_pin.on()
+        else:
+            self._set(speed, motors)
+        if stats is not None:
+            stats.time(GO_TIME, start)
+
+    def _set(self, speed, motors):
+        """Set motors to speed now."""
+
+        self.en_pin.off()
         forward = speed > 0
+        # With interrupts off until the latch is written, a stepper
+        # can't write the new direction bits while the old duty runs.
+        state = disable_irq()
         for motor in motors:
+            motor.go(0)
             if forward:
                 motor.forward()
             else:
                 motor.reverse()
-            motor.go(0)
-
         self.update_latch()
+        enable_irq(state)
 
         speed = abs(speed)
         for motor in motors:
             motor.go(speed)
+            motor._speed = speed if forward else -speed
 
         self.en_pin.on()
             
@@ -130,14 +289,24 @@ class AFMotorShieldV1:
     def coast(self, motor=None):
         """Stop the motors."""
         
-        self.go(0, motor)
+        motors = self.motor_list(motor)
+        if self._ramps is not None:
+            for each in motors:
+                self._ramps.cancel(each)
+        self._set(0, motors)
 
     def brake(self, motor=None):
         """Apply the brakes."""
 
-        for motor in self.motor_list(motor):
+        motors = self.motor_list(motor)
+        if self._ramps is not None:
+            for each in motors:
+                self._ramps.cancel(each)
+        state = disable_irq()
+        for motor in motors:
             motor.brake()
         self.update_latch()
+        enable_irq(state)
 
 
 class _L293D:
@@ -154,12 +323,15 @@ class _L293D:
     # AFMotorShieldV1.motor_bits tuple order
     def __init__(self, parent, a, b, pwm, reversed=False):
         self.parent, self.a, self.b = parent, a, b
-        self.pwm = PWM(Pin(pwm), freq=2000)
+        self.pwm = PWM(Pin(pwm), freq=2000, fast=parent.fast)
 
         # _forward indicates the direction we want to go
         # _reversed means our directions are reversed.
         self._forward = True
         self._reversed = reversed
+        # The signed speed, and the ramp setter for it.
+        self._speed = 0
+        self._drive = self.drive
 
         # And make sure we're stopped
         self.brake()
@@ -170,33 +342,292 @@ class _L293D:
         Return current speed if speed is None"""
 
         if speed is None:
-            return speed if self._forward and not self._reversed else -speed
+            return self._speed if not self._reversed else -self._speed
         else:
             self.pwm.duty(speed)
 
+    def drive(self, speed):
+        """Turn at speed from 100 to -100, setting the latch if the
+        direction changes. The acceleration limit's ramp setter."""
+
+        forward = speed > 0
+        if speed and (forward != self._forward or not self._latched()):
+            self.pwm.duty(0)
+            # Changed and written in one interrupt-off section, before
+            # the duty, so it never runs with the old direction bits.
+            self._forward = forward
+            self.parent._latch_bits(self.a | self.b,
+                                    self.a if forward else self.b, True)
+        self._speed = speed
+        self.pwm.duty(speed if forward else -speed)
+
+    def _latched(self):
+        """Are my direction bits set in the latch?"""
+
+        return self.parent.latch_value & (self.a | self.b)
+
     def forward(self):
         """Set the latch bits so I go forward."""
 
         self._forward = True
-        self.parent.latch_value |= self.a
-        self.parent.latch_value &= self.b
+        self.parent._latch_bits(self.b, self.a)
 
     def reverse(self):
         """Set the latch bits so I go in reverse."""
             
         self._forward = False
-        self.parent.latch_value &= ~self.a
-        self.parent.latch_value |= self.b
+        self.parent._latch_bits(self.a, self.b)
 
     def brake(self, latch=True):
         """Hit the brakes."""
 
         self.go(0)	# Coast until we update the latch.
-        self.parent.latch_value &= ~(self.a | self.b)
+        self._speed = 0
+        self.parent._latch_bits(self.a | self.b, 0)
+
+
+class Stepper:
+    """A stepper motor on an AFMotorShieldV1, from its stepper method.
+
+    Coil A is one of the shield's motor outputs and coil B the next.
+    style is SINGLE, DOUBLE, INTERLEAVE (half steps) or MICROSTEP, with
+    microsteps per full step. Positions and speeds count steps of the
+    style, so half steps for INTERLEAVE and microsteps for MICROSTEP.
+
+    Each step's coil states are worked out ahead of time as the bits
+    to put in the latch (and for MICROSTEP, the coil PWM widths), so a
+    step is one latch write. Steps are made by a compare channel of
+    the shield's step timer, with the interval to the next worked out
+    in integers for a trapezoidal speed profile: accelerating at
+    accel steps/s/s up to speed steps/s, then slowing to stop on the
+    target. The main loop only sets targets.
+
+    With stats.enable(), steps and moves are counted and the step
+    interrupt is timed, see stats.py."""
+
+    def __init__(self, parent, number, coil_a, coil_b, style=DOUBLE,
+                 microsteps=16, speed=200, accel=400):
+        self.parent = parent
+        self.number = number
+        self.style = style
+        (a1, b1, pin_a), (a2, b2, pin_b) = coil_a, coil_b
+        self._mask = a1 | b1 | a2 | b2
+        self.pwm_a = PWM(Pin(pin_a), freq=2000, fast=parent.fast)
+        self.pwm_b = PWM(Pin(pin_b), freq=2000, fast=parent.fast)
+
+        if style == MICROSTEP:
+            count = 4 * microsteps
+            phases = [(cos(2 * pi * i / count), sin(2 * pi * i / count))
+                      for i in range(count)]
+            self._widths_a = array('H', [round(abs(a) * self.pwm_a.full)
+                                         for a, b in phases])
+            self._widths_b = array('H', [round(abs(b) * self.pwm_b.full)
+                                         for a, b in phases])
+        else:
+            phases = _PHASES[style]
+            self._widths_a = self._widths_b = None
+            self.pwm_a.duty(100)
+            self.pwm_b.duty(100)
+        self._table = bytearray(
+            (a1 if a > 1e-9 else b1 if a < -1e-9 else 0)
+            | (a2 if b > 1e-9 else b2 if b < -1e-9 else 0)
+            for a, b in phases)
+
+        self._stats = attach('AFMotorShieldV1 stepper %d' % number,
+                             ('steps', 'moves'), ('step',))
+        self.timer = parent.step_timer()
+        self.channel = self.timer.channel(number, Timer.OC_TIMING, compare=0)
+        self._tick = self.tick
+
+        # The step sequence state, all small ints for the interrupt.
+        self._phase = 0
+        self._position = self._target = 0
+        self._direction = 1
+        # Ramp step count, negative while slowing, and the interval as
+        # µs << 8 (see _interval).
+        self._n = 0
+        self._c = 0
+        # µs still to wait before the next step, and the compare value.
+        self._wait = 0
+        self._at = 0
+        self.moving = False
+        self.speed(speed)
+        self.acceleration(accel)
+        self.hold()
+
+    def speed(self, steps=None):
+        """Get/Set the top speed in steps per second."""
+
+        if steps is None:
+            return 1000000 / (self._cmin >> 8)
+        self._cmin = max(MIN_INTERVAL, round(1000000 / steps)) << 8
+
+    def acceleration(self, accel=None):
+        """Get/Set the acceleration in steps per second per second."""
+
+        if accel is None:
+            return self._accel
+        self._accel = accel
+        # The first interval from rest, from Austin's "Generate stepper
+        # motor speed profiles in real time", with its 0.676 correction.
+        # Capped so the fixed point value stays a small int.
+        self._c0 = min(round(676000 * sqrt(2 / accel)), 0x3fffff) << 8
+
+    def position(self, steps=None):
+        """Get the position in steps, or set it while stopped."""
+
+        if steps is None:
+            return self._position
+        if self.moving:
+            raise MotorError("Stepper %d is moving" % self.number)
+        self._position = self._target = steps
+
+    def target(self):
+        """The position being moved to."""
+
+        return self._target
+
+    def move_to(self, position):
+        """Move to position, starting now or changing the current move.
+
+        A move the other way slows to a stop first, then comes back."""
+
+        self._target = position
+        if self._stats is not None:
+            self._stats.count(MOVES)
+        if not self.moving and position != self._position:
+            self._wait = self._interval()
+            if self._wait:
+                self.moving = True
+                self._at = self.timer.counter()
+                self._advance()
+                self.channel.callback(self._tick)
+
+    def move(self, steps):
+        """Move steps from the current target."""
+
+        self.move_to(self._target + steps)
+
+    def stop(self):
+        """Slow to a stop as soon as the acceleration allows."""
+
+        if self.moving:
+            n = self._n
+            self._target = self._position + self._direction * (
+                n if n > 0 else -n)
+
+    def hold(self):
+        """Power the coils at the current step, holding the position."""
+
+        self._step(0)
+
+    def release(self):
+        """Turn the coils off, so the motor turns freely.
+
+        The next move powers them again, from the same step."""
+
+        self.channel.callback(None)
+        self.moving = False
+        self._target = self._position
+        self._n = 0
+        self.parent._latch_bits(self._mask, 0, True)
+
+    def deinit(self):
+        """Release the motor, and give its PWMs and channel back."""
+
+        self.release()
+        self.pwm_a.deinit()
+        self.pwm_b.deinit()
+        parent = self.parent
+        if parent.steppers[self.number - 1] is self:
+            parent.steppers[self.number - 1] = None
+        parent._free_step_timer()
+
+    def _step(self, direction):
+        """Move direction (-1, 0 or 1) steps, with one latch write."""
+
+        phase = (self._phase + direction) % len(self._table)
+        self._phase = phase
+        self._position += direction
+        if self._widths_a is not None:
+            self.pwm_a._write(self._widths_a[phase])
+            self.pwm_b._write(self._widths_b[phase])
+        self.parent._latch_bits(self._mask, self._table[phase], True)
+
+    def _interval(self):
+        """The µs to the next step, or 0 to stop there.
+
+        Sets the direction for it. Each interval is the last less
+        2 * last / (4 * n + 1), n counting steps into the ramp, which
+        approximates constant acceleration without a square root. n
+        counts up from minus the steps to stop while slowing, and
+        while accelerating it is the number of steps it will take to
+        stop, so that's when to turn round."""
+
+        ahead = (self._target - self._position) * self._direction
+        n = self._n
+        if n == 0:
+            if not ahead:
+                return 0
+            if ahead < 0:
+                self._direction = -self._direction
+            self._c = c = self._c0
+        else:
+            if not ahead and -1 <= n <= 1:
+                self._n = 0
+                return 0
+            if n > 0 and ahead <= n:
+                n = -n
+            elif n < 0 and ahead > -n:
+                n = -n
+            c = self._c
+            c -= 2 * c // (4 * n + 1)
+        if c <= self._cmin:
+            # At full speed: n stays at the steps needed to stop.
+            c = self._cmin
+            if n < 0:
+                n += 1
+        else:
+            n += 1
+        self._n = n
+        self._c = c
+        return c >> 8
+
+    def _advance(self):
+        """Set the compare for the next wait, at most half a timer cycle."""
+
+        wait = self._wait
+        if wait > 0x8000:
+            wait = 0x8000
+        self._wait -= wait
+        self._at = (self._at + wait) & 0xffff
+        self.channel.compare(self._at)
+
+    def tick(self, timer):
+        """The step timer channel callback."""
+
+        if self._wait:
+            self._advance()
+            return
+        stats = self._stats
+        if stats is not None:
+            start = micros()
+            stats.count(STEPS)
+        self._step(self._direction)
+        self._wait = self._interval()
+        if self._wait:
+            self._advance()
+        else:
+            self.moving = False
+            self.channel.callback(None)
+        if stats is not None:
+            stats.time(STEP_TIME, start)
 
 
 gpio_size = stm.GPIOB - stm.GPIOA
 def make_gpio(pin):
-    """Given a pin, return a pair of ODR & mask for it."""
+    """Given a pin, return a pair of ODR & mask for it.
+
+    See fastio.FastPin for writing pins through BSRR."""
 
     return stm.GPIOA + gpio_size * pin.port() + stm.GPIO_ODR, 1 << pin.pin()
@@ -10,13 +10,42 @@ hbridge.md for more information on those.
 
 A board for the controller. This almost always does power management,
 may select the mode for the controller, and if designed for a specific
-µ-controller board may determine what pins are used."""
+µ-controller board may determine what pins are used.
 
-# Keys Fundumoto Arduino shield. An L298 with two h-bridges (motor_a and motor_b)
-# in ONE_SPEED mode, and a buzzer wired to specific arduino pins.
-from . import fundumoto
+Nothing is imported until it's used: the names below are loaded from
+their modules on first access, so importing motors costs nothing."""
 
-# DRV8835 h-bridge chip drivers. Two h-bridges that can be used in ONE_SPEED
-# mode (though it's run/brake instead of run/coast) or controlled directly, but
-# both must be the same. Also available on an Arduino shield.
-from .  drv8835 import DRV8835
+# name: module it's loaded from.
+_LAZY = {
+    # Keys Fundumoto Arduino shield. An L298 with two h-bridges (motor_a and
+    # motor_b) in ONE_SPEED mode, and a buzzer wired to specific arduino pins.
+    'fundumoto': None,
+    # DRV8835 h-bridge chip drivers. Two h-bridges that can be used in
+    # ONE_SPEED mode (though it's run/brake instead of run/coast) or
+    # controlled directly, but both must be the same. Also available on an
+    # Arduino shield.
+    'DRV8835': 'drv8835',
+    # Drive kinematics for differential, skid-steer and mecanum platforms,
+    # mixing motion commands into wheel speeds set through a Gang.
+    'Differential': 'drive',
+    'Mecanum': 'drive',
+    'SkidSteer': 'drive',
+    # Quadrature encoders on timers in encoder mode, and closed loop speed
+    # control for h-bridges from them.
+    'Encoder': 'encoder',
+    'PID': 'pid',
+    'SpeedControl': 'pid',
+    # Declarative shield and board descriptions, see board.py.
+    'Board': 'board',
+}
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(name)
+    module = _LAZY[name] or name
+    value = __import__('motors.' + module, None, None, (name,))
+    if _LAZY[name] is not None:
+        value = getattr(value, name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,219 @@
+"""Declarative board and shield descriptions, built lazily.
+
+A description is a dict of output name to (kind, pins, options): kind
+says what driver to build, pins is a tuple of pin names, and options
+are the driver's keyword arguments. For instance:
+
+    ROBOT = {
+        'left': ('hbridge', ('D12', 'D10'), {'mode': 'ONE_SPEED'}),
+        'right': ('hbridge', ('D11', 'D13'), {'mode': 'ONE_SPEED'}),
+        'pan': ('servo', ('D9',), {'length': 20000}),
+        'buzzer': ('pin', ('D4',), {'mode': 'OUT'}),
+    }
+
+The kinds are in KINDS: 'hbridge' (mode is an HBridge mode name),
+'servo', 'pin' (mode is a Pin mode name), 'pulsein' and 'afmotor'
+(an AFMotorShieldV1, with the latch, clock, enable and data pins).
+Since it's all strings, numbers, lists and dicts, a description can
+also be kept in a JSON file.
+
+Board checks a description when it's created: no pin is used twice,
+and the PWM outputs all fit on their timers, with every output on a
+timer wanting the same frequency. Each PWM output's timer is settled
+then, so outputs get the same timers whatever order they're built in.
+Nothing is built until it's first used, as board['left'] or
+board.left, so a description can list everything a fleet's variants
+might have, at the cost of only what's used.
+
+The shield modules describe themselves as BOARD, so
+Board('fundumoto') is the Fundumoto's outputs."""
+
+from pyb import Pin
+
+from pwm2 import INVERTED, PwmError, _timers, pick, timer_channels
+
+
+class BoardError(Exception):
+    pass
+
+
+def _hbridge(pins, options):
+    from .hbridge import HBridge
+
+    options = dict(options)
+    mode = getattr(HBridge, options.pop('mode', 'ONE_SPEED'))
+    return HBridge(mode, Pin(pins[0]), Pin(pins[1]), **options)
+
+
+def _hbridge_pwms(pins, options):
+    freq = options.get('freq') or 20000
+    if options.get('mode', 'ONE_SPEED') == 'ONE_SPEED':
+        return ((pins[1], 'timer_1', freq),)
+    return ((pins[0], 'timer_1', freq),
+            (pins[1], 'timer_2', options.get('freq_2') or freq))
+
+
+def _servo(pins, options):
+    from .servo import Servo
+
+    return Servo(Pin(pins[0]), **options)
+
+
+def _servo_pwms(pins, options):
+    # Pins without a timer channel get software PWM, see pwm2.output.
+    if not timer_channels(Pin(pins[0])):
+        return ()
+    return ((pins[0], 'timer', 1000000 / options.get('length', 20000)),)
+
+
+def _pin(pins, options):
+    return Pin(pins[0], getattr(Pin, options.get('mode', 'OUT')))
+
+
+def _pulsein(pins, options):
+    from pulsein import PulseIn
+
+    return PulseIn(Pin(pins[0]), **options)
+
+
+def _afmotor(pins, options):
+    from .AFMotorShield import AFMotorShieldV1
+
+    return AFMotorShieldV1(pins=pins, **options)
+
+
+def _afmotor_pwms(pins, options):
+    from .AFMotorShield import AFMotorShieldV1
+
+    # The motors' PWM timers are picked when they're attached.
+    return tuple((bits[2], None, 2000) for bits in AFMotorShieldV1.motor_bits)
+
+
+def _none(pins, options):
+    return ()
+
+
+# kind: (builder, pwms). builder(pins, options) returns the driver.
+# pwms(pins, options) returns the (pin, timer option, freq) of each
+# PWM output it will claim; the timer option is the keyword to pass
+# the timer picked for it, or None if it can't be passed.
+KINDS = {
+    'hbridge': (_hbridge, _hbridge_pwms),
+    'servo': (_servo, _servo_pwms),
+    'pin': (_pin, _none),
+    'pulsein': (_pulsein, _none),
+    'afmotor': (_afmotor, _afmotor_pwms),
+}
+
+
+def describe(source):
+    """The description for source: a dict is used as is, a name ending
+    in .json is read from that file, and anything else is the name of
+    a module in motors with a BOARD description."""
+
+    if isinstance(source, dict):
+        return source
+    if source.endswith('.json'):
+        try:
+            import json
+        except ImportError:
+            import ujson as json
+        with open(source) as f:
+            return json.load(f)
+    return __import__('motors.' + source, None, None, ('BOARD',)).BOARD
+
+
+class Board:
+    """The outputs of a description, built on first use.
+
+    source is a description, or where to find one, see describe.
+    Keyword arguments named for outputs are dicts of options to
+    override theirs, such as Board('fundumoto', A={'freq': 1000}).
+    Raises BoardError if the outputs can't all be used together."""
+
+    def __init__(self, source, **overrides):
+        specs = {}
+        for name, (kind, pins, options) in describe(source).items():
+            if kind not in KINDS:
+                raise BoardError("%s: unknown kind %s" % (name, kind))
+            options = dict(options)
+            options.update(overrides.get(name, ()))
+            specs[name] = kind, tuple(pins), options
+        self._specs = specs
+        self._outputs = {}
+        self._check()
+
+    def _check(self):
+        """Check the outputs' pins and timers, settling the timers.
+
+        PWM timers are picked as pwm2 would, against those already in
+        use, and written into the options of the outputs that take
+        them."""
+
+        # Keyed by the cpu pin name, so board aliases of a pin (like
+        # 'D12' and 'PA6') are caught too.
+        owners = {}
+        for name, (kind, pins, options) in self._specs.items():
+            for pin in pins:
+                key = Pin(pin).name()
+                if key in owners:
+                    raise BoardError("%s and %s both use %s"
+                                     % (owners[key], name, pin))
+                owners[key] = name
+
+        # A plan of the timers in use, like pwm2._timers but with the
+        # name of the output that set the frequency in place of the
+        # timer.
+        plan = {number: [None, slot[1], slot[2]]
+                for number, slot in _timers.items()}
+        channels = {}
+        for name, (kind, pins, options) in self._specs.items():
+            for pin, option, freq in KINDS[kind][1](pins, options):
+                timer = options.get(option) if option else None
+                try:
+                    af, number, channel = pick(Pin(pin), timer, freq, 0, plan)
+                except PwmError as error:
+                    raise BoardError("%s: %s on %s" % (name, error, pin))
+                channel &= ~INVERTED
+                slot = plan.get(number)
+                if slot is None:
+                    plan[number] = [name, freq, 1 << channel]
+                elif slot[1] != freq:
+                    raise BoardError("%s: TIM%d is needed at %s Hz, but %s "
+                                     "runs it at %s Hz"
+                                     % (name, number, freq,
+                                        slot[0] or "something else", slot[1]))
+                elif slot[2] & 1 << channel:
+                    raise BoardError("%s: TIM%d channel %d is used by %s"
+                                     % (name, number, channel,
+                                        channels.get((number, channel),
+                                                     "something else")))
+                else:
+                    slot[2] |= 1 << channel
+                channels[number, channel] = name
+                if option:
+                    options[option] = 'TIM%d' % number
+
+    def names(self):
+        """The names of the outputs."""
+
+        return list(self._specs)
+
+    def built(self, name):
+        """Has output name been built yet?"""
+
+        return name in self._outputs
+
+    def __getitem__(self, name):
+        output = self._outputs.get(name)
+        if output is None:
+            kind, pins, options = self._specs[name]
+            output = self._outputs[name] = KINDS[kind][0](pins, options)
+        return output
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name not in self._specs:
+            raise AttributeError(name)
+        return self[name]
@@ -0,0 +1,104 @@
+"""Speed to duty cycle calibration curves for motors.
+
+Motors don't turn in proportion to duty cycle: there's a dead zone at
+low duty where the motor doesn't move at all, which is much wider in
+run/coast mode, and the response above that is rarely a straight
+line. A Curve maps a commanded speed to the duty cycle that gives that
+speed, so HBridge.go(50) really runs at about half speed.
+
+The mapping is a lookup table from each whole speed percentage to a
+duty cycle in hundredths of a percent, built once from a few points,
+so applying it is an index with no float math. calibrate() measures a
+motor to make a curve."""
+
+from array import array
+
+from pyb import delay
+
+# Table entries are in hundredths of a percent.
+UNIT = 10000
+
+
+class Curve:
+    """A speed to duty cycle lookup table.
+
+    points is a list of (speed, duty) pairs with speed increasing,
+    both in percent. Duty is interpolated between points, speeds below
+    the first point use its duty and those above the last use
+    its. Speed 0 is always duty 0, so the motor can stop. mode is the
+    HBridge mode the curve was measured in, if it matters."""
+
+    def __init__(self, points, mode=None):
+        if not points:
+            raise ValueError("Need at least one point")
+        self.points = [(speed, duty) for speed, duty in points]
+        self.mode = mode
+        steps = [(round(speed), round(duty * 100)) for speed, duty in points]
+        table = array('H', [0] * 101)
+        point = 0
+        for speed in range(1, 101):
+            while point < len(steps) - 1 and steps[point + 1][0] <= speed:
+                point += 1
+            s0, d0 = steps[point]
+            if speed <= s0 or point == len(steps) - 1:
+                duty = d0
+            else:
+                s1, d1 = steps[point + 1]
+                duty = (d0 * (s1 - speed) + d1 * (speed - s0)) // (s1 - s0)
+            table[speed] = min(max(duty, 0), UNIT)
+        self.table = table
+
+    def __repr__(self):
+        return 'Curve(%r, %r)' % (self.points, self.mode)
+
+    def duty(self, speed):
+        """The duty cycle in percent for speed, from 0 to 100."""
+
+        return self.table[int(min(abs(speed), 100))] / 100
+
+
+def calibrate(motor, measure, steps=20, settle=200):
+    """Measure motor to make a Curve for it.
+
+    motor is an HBridge, driven forward at steps duty cycles from 0
+    to 100 without any curve. After settle ms at each, measure() is
+    called, and should return the motor's speed in any units, e.g.
+    from an encoder. The speeds are taken as percentages of the
+    fastest one, and inverted to find the duty for each speed. The
+    motor is stopped and its own curve restored afterwards."""
+
+    curve, motor.curve = motor.curve, None
+    duties, speeds = [], []
+    try:
+        for step in range(steps + 1):
+            duty = 100 * step // steps
+            motor.go(duty)
+            delay(settle)
+            duties.append(duty)
+            speeds.append(max(measure(), 0))
+    finally:
+        motor.go(0)
+        motor.curve = curve
+
+    top = max(speeds)
+    if not top:
+        raise ValueError("The motor didn't move")
+    # Percentages of top speed, never decreasing so the inverse exists.
+    seen = 0
+    for i in range(len(speeds)):
+        seen = max(seen, speeds[i] * 100 / top)
+        speeds[i] = seen
+
+    points = []
+    i = 1
+    for speed in range(1, 101):
+        while speeds[i] < speed:
+            i += 1
+        low, high = speeds[i - 1], speeds[i]
+        if high == low:
+            duty = duties[i]
+        else:
+            duty = duties[i - 1] + (duties[i] - duties[i - 1]) \
+                * (speed - low) / (high - low)
+        points.append((speed, round(duty, 2)))
+    return Curve(points, motor.mode)
@@ -0,0 +1,162 @@
+"""Drive kinematics: mixing motion commands into wheel speeds.
+
+A Drive takes a motion command of up to three axes and turns it into
+a speed for each of its motors through an integer mixing table, then
+sets them all through a Gang in one batched update. The table, trims
+and speed buffer are all built up front, so a command doesn't
+allocate or use floats.
+
+Commands and wheel speeds are from -100 to 100. If a command would
+drive any wheel past 100, all the wheels are scaled back together, so
+the robot keeps the commanded direction and turn at a lower speed."""
+
+from array import array
+
+from .gang import Gang
+
+# Mixing weights are fixed point, with ONE a weight of 1.
+SHIFT = 8
+ONE = 1 << SHIFT
+
+
+class Drive:
+    """Drive motors from a mixing table.
+
+    forward and reverse are lists of motors as for Gang. table has a
+    row for each motor, forward motors first, of weights for the
+    three command axes. trims is a list of percentages scaling each
+    motor's speed, for matching motors that run at different speeds,
+    defaulting to 100. sync is passed to Gang, and defaults to on, so
+    the motors must be HBridges unless it's turned off."""
+
+    def __init__(self, forward, reverse, table, trims=None, sync=True):
+        self.gang = Gang(forward, reverse, sync=sync)
+        count = len(self.gang._motors)
+        if len(table) != count:
+            raise ValueError("Need a table row for each of %d motors" % count)
+        self._count = count
+        self._table = array('h', [round(weight * ONE) for row in table
+                                  for weight in row])
+        self._trims = array('h', [ONE] * count)
+        if trims:
+            self.trim(trims)
+        self._speeds = array('h', [0] * count)
+
+    def trim(self, trims):
+        """Set the per-motor trim percentages."""
+
+        for i in range(self._count):
+            self._trims[i] = trims[i] * ONE // 100
+
+    def speeds(self):
+        """The wheel speeds from the last command."""
+
+        return self._speeds
+
+    def _mix(self, a, b, c):
+        """Mix a command into wheel speeds, and set them."""
+
+        table, speeds = self._table, self._speeds
+        j = 0
+        for i in range(self._count):
+            speeds[i] = (table[j] * a + table[j + 1] * b
+                         + table[j + 2] * c) >> SHIFT
+            j += 3
+        self._apply()
+
+    def _apply(self):
+        """Scale back and trim the wheel speeds, and set them."""
+
+        trims, speeds = self._trims, self._speeds
+        peak = 100
+        for i in range(self._count):
+            speed = speeds[i]
+            if speed > peak:
+                peak = speed
+            elif -speed > peak:
+                peak = -speed
+        for i in range(self._count):
+            speed = speeds[i]
+            if peak > 100:
+                speed = speed * 100 // peak
+            speeds[i] = speed * trims[i] >> SHIFT
+        self.gang.set(speeds)
+
+    def coast(self):
+        """Stop running the motors."""
+
+        self._stop()
+        self.gang.coast()
+
+    def brake(self):
+        """Active braking if the drivers support it."""
+
+        self._stop()
+        self.gang.brake()
+
+    def _stop(self):
+        for i in range(self._count):
+            self._speeds[i] = 0
+
+
+class Differential(Drive):
+    """A differential drive: left and right wheels, turning by speed difference.
+
+    left and right are lists of motors, so skid-steer platforms with
+    several wheels a side are the same thing. If mirrored is set, the
+    right motors are mounted facing the other way, and run in reverse
+    to go forward, as with Gang."""
+
+    def __init__(self, left, right, mirrored=False, trims=None, sync=True):
+        left, right = list(left), list(right)
+        self._left = len(left)
+        table = [(1, -1, 0)] * len(left) + [(1, 1, 0)] * len(right)
+        if mirrored:
+            Drive.__init__(self, left, right, table, trims, sync)
+        else:
+            Drive.__init__(self, left + right, [], table, trims, sync)
+
+    def go(self, speed, turn=0):
+        """Go at speed (-100 to 100) while turning at turn.
+
+        Positive turn is anticlockwise (to the left), and at 100 with
+        no speed the wheels run in opposite directions at full speed."""
+
+        self._mix(speed, turn, 0)
+
+    def tank(self, left, right):
+        """Set the left and right side speeds directly."""
+
+        speeds = self._speeds
+        for i in range(self._count):
+            speeds[i] = left if i < self._left else right
+        self._apply()
+
+
+# Skid-steer is mixed the same way as differential drive.
+SkidSteer = Differential
+
+
+class Mecanum(Drive):
+    """Four mecanum wheels, which can move in any direction while turning.
+
+    The rollers should form an X seen from above. If mirrored is set,
+    the right motors run in reverse to go forward, as with Gang. Trims
+    and speeds are in the order front left, rear left, front right,
+    rear right."""
+
+    def __init__(self, front_left, front_right, rear_left, rear_right,
+                 mirrored=False, trims=None, sync=True):
+        left, right = [front_left, rear_left], [front_right, rear_right]
+        table = [(1, -1, -1), (1, 1, -1), (1, 1, 1), (1, -1, 1)]
+        if mirrored:
+            Drive.__init__(self, left, right, table, trims, sync)
+        else:
+            Drive.__init__(self, left + right, [], table, trims, sync)
+
+    def go(self, forward, left=0, turn=0):
+        """Move forward and left (-100 to 100) while turning at turn.
+
+        Positive turn is anticlockwise."""
+
+        self._mix(forward, left, turn)
@@ -4,6 +4,14 @@ from pyb import Pin
 
 from . hbridge import HBridge
 
+# The Pololu shield's outputs, see board.py. The shield's mode pin
+# defaults to PHASE_ENABLE; override mode to RUN_BRAKE or RUN_COAST if
+# it's jumpered for IN_IN.
+BOARD = {
+    'M1': ('hbridge', ('D7', 'D9'), {'mode': 'ONE_SPEED'}),
+    'M2': ('hbridge', ('D8', 'D10'), {'mode': 'ONE_SPEED'}),
+}
+
 class DRV8835:
     """Control software for a DRV8835 motor driver chip.
 
@@ -29,7 +37,7 @@ class DRV8835:
             pin.value(mode)
 
     def motor(self, in1, in2, coast=False, timer=None, freq=None,
-              timer_2=None, freq_2=None):
+              timer_2=None, freq_2=None, fast=False, curve=None):
         """Returns a driver for one of the motors attached to the chip.
         
         Use the in1 & in2 pins to control the motor using this chip's
@@ -48,7 +56,8 @@ class DRV8835:
         If timer is set but not timer2, then timer will be used for
         timer2. freq and freq2 are treated the same. If a timer is not
         set, the first timer on the pin will be used. If freq is not
-        set, it will default to 20000."""
+        set, it will default to 20000. fast and curve are passed to
+        HBridge."""
 
         if self._mode == DRV8835.PHASE_ENABLE:
             mode = HBridge.ONE_SPEED
@@ -58,20 +67,22 @@ class DRV8835:
             mode = HBridge.RUN_BRAKE
 
         return HBridge(mode, in1, in2, freq=freq, timer_1=timer,
-                       freq_2=freq_2, timer_2=timer_2)
+                       freq_2=freq_2, timer_2=timer_2, fast=fast, curve=curve)
 
 
 class PololuShield(DRV8835):
+    # The motor pins by number, from BOARD.
+    motors = dict((motor, BOARD['M%d' % motor][1]) for motor in (1, 2))
+
     def __init__(self, mode):
         self._mode = mode
 
-    motors = {1: ('D7', 'D9'), 2: ('D8', 'D10')}
-
     def motor(self, motor, coast=False, timer=None, freq=None,
-              timer_2=None, freq_2=None):
+              timer_2=None, freq_2=None, fast=False, curve=None):
         """Return motor 1 or motor 2, as labelled on shield."""
 
-        return DRV8835.motor(self, Pin(self.motors[motor][0]),
-                             Pin(self.motors[motor][1]),
+        pins = self.motors[motor]
+        return DRV8835.motor(self, Pin(pins[0]), Pin(pins[1]),
                              coast=coast, timer=timer, freq=freq,
-                             timer_2=timer_2, freq_2=freq_2)
+                             timer_2=timer_2, freq_2=freq_2, fast=fast,
+                             curve=curve)
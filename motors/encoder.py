@@ -0,0 +1,94 @@
+"""Quadrature encoders read by timers in encoder mode.
+
+The timer counts the encoder's edges in hardware, so there are no
+interrupts per edge. Its counter is only 16 bits, so Encoder extends
+it in software; call count() (or delta()) often enough that the
+motor can't turn 32767 counts between calls - a speed control loop
+does."""
+
+from pyb import Pin, Timer
+
+from pwm2 import PwmError, release, reserve, timer_channels
+
+# Timers with an encoder mode.
+ENCODER_TIMERS = (1, 2, 3, 4, 5, 8)
+
+
+class Encoder:
+    """A quadrature encoder on pins a and b.
+
+    The pins must be channels 1 and 2 of the same timer, in either
+    order; the timer is found from pins_af like pwm2.PWM does, or
+    given as a string 'TIM#'. Counts go up when a leads b, and there
+    are four per encoder cycle. counts_per_rev is the counts for one
+    turn of whatever's being measured, for rpm()."""
+
+    def __init__(self, a, b, timer=None, counts_per_rev=None):
+        want = int(timer[3:]) if timer and len(timer) > 3 else 0
+        found = None
+        a_timers, b_timers = timer_channels(a), timer_channels(b)
+        for i in range(0, len(a_timers), 3):
+            number, channel = a_timers[i + 1], a_timers[i + 2]
+            if number not in ENCODER_TIMERS or channel not in (1, 2) \
+               or want and number != want:
+                continue
+            for j in range(0, len(b_timers), 3):
+                if b_timers[j + 1] == number and b_timers[j + 2] == 3 - channel:
+                    found = a_timers[i], b_timers[j], number, channel
+                    break
+            if found:
+                break
+        if found is None:
+            raise PwmError("Pins are not channels 1 and 2 of a timer")
+
+        a_af, b_af, number, channel = found
+        # Counting down when the pins are the other way round.
+        self.sign = 1 if channel == 1 else -1
+        self.timer = reserve(number, prescaler=0, period=0xffff)
+        self.timer_id = number
+        a.init(Pin.AF_PP, pull=Pin.PULL_UP, alt=a_af)
+        b.init(Pin.AF_PP, pull=Pin.PULL_UP, alt=b_af)
+        self.channel = self.timer.channel(1, Timer.ENC_AB)
+        self.counts_per_rev = counts_per_rev
+        self.position = 0
+        self._last = self.timer.counter()
+        self._since = 0
+
+    def deinit(self):
+        """Stop counting and give the timer back."""
+
+        for channel in range(1, 5):
+            release(self.timer_id, channel)
+
+    def count(self):
+        """The count since the encoder was created, or last reset.
+
+        Doesn't allocate, so it's safe to call from interrupt
+        handlers."""
+
+        counter = self.timer.counter()
+        change = (counter - self._last) & 0xffff
+        if change & 0x8000:
+            change -= 0x10000
+        self._last = counter
+        self.position += self.sign * change
+        return self.position
+
+    def delta(self):
+        """The change in count since the last call."""
+
+        position = self.count()
+        change = position - self._since
+        self._since = position
+        return change
+
+    def reset(self, position=0):
+        """Set the count."""
+
+        self.count()
+        self.position = self._since = position
+
+    def rpm(self, counts, ms):
+        """Convert counts in ms milliseconds to revolutions per minute."""
+
+        return counts * 60000 / (self.counts_per_rev * ms)
@@ -6,24 +6,36 @@ from pyb import Pin
 from . hbridge import HBridge
 from . servo import Servo
 
+# The shield's outputs, see board.py.
+BOARD = {
+    'A': ('hbridge', ('D12', 'D10'), {'mode': 'ONE_SPEED'}),
+    'B': ('hbridge', ('D11', 'D13'), {'mode': 'ONE_SPEED'}),
+    'buzzer': ('pin', ('D4',), {'mode': 'OUT'}),
+    'servo': ('servo', ('D9',), {}),
+}
+
 
 class Fundumoto:
-    motors = dict(A=('D12', 'D10'), B=('D11', 'D13'))
+    # The motor pins by name, from BOARD.
+    motors = dict((name, BOARD[name][1]) for name in ('A', 'B'))
 
     @classmethod
-    def motor(cls, name, freq=None, timer=None):
-        """Return motor for motor A or motor B, as labelled on shield."""
-        return HBridge(HBridge.ONE_SPEED, Pin(cls.motors[name][0]),
-                       Pin(cls.motors[name][1]), freq=freq, timer_1=timer)
+    def motor(cls, name, freq=None, timer=None, fast=False, curve=None):
+        """Return motor for motor A or motor B, as labelled on shield.
+
+        curve is an optional speed to duty Curve, see motors/curve.py."""
+        pins = cls.motors[name]
+        return HBridge(HBridge.ONE_SPEED, Pin(pins[0]), Pin(pins[1]),
+                       freq=freq, timer_1=timer, fast=fast, curve=curve)
 
     @staticmethod
     def buzzer():
         """Get the buzzer pin."""
 
-        return Pin('D4', mode=Pin.OUT)
+        return Pin(BOARD['buzzer'][1][0], mode=Pin.OUT)
 
     @staticmethod
     def servo(timer=None, length=20000):
         """Get the servo connector."""
 
-        return Servo(Pin('D9'), timer, length)
+        return Servo(Pin(BOARD['servo'][1][0]), timer, length)
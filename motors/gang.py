@@ -1,10 +1,26 @@
+from pyb import disable_irq, enable_irq
+
+# The update disable bit in a timer's CR1. While it's set, preloaded
+# compare values aren't copied to the outputs.
+UDIS = 1 << 1
+
+
 class Gang:
     """Coordinated control of groups of motors.
     
     Pass in two lists of motors: the forward set runs forward to go
-    forward, the reverse set needs to run in reverse to go forward."""
+    forward, the reverse set needs to run in reverse to go forward.
+
+    If sync is set, the motors must be HBridges, and are updated
+    together: every motor's new inputs are worked out first, then the
+    ones that changed are written with interrupts off and the timers'
+    update events held, so all the wheels change in the same PWM
+    period. Direction pins of ONE_SPEED motors change as they're
+    written, at most a period ahead of their new duty cycle. Any ramp
+    or acceleration slew a motor has running is cancelled first, so
+    it can't overwrite the synchronized speeds."""
 
-    def __init__(self, forward, reverse):
+    def __init__(self, forward, reverse, sync=False):
         self._forward = forward
         self._reverse = reverse
         delta = len(forward) - len(reverse)
@@ -12,12 +28,42 @@ class Gang:
             self._reverse += [None] * delta
         elif delta < 0:
             self._forward +=  [None] * -delta
-        
+
+        # The motors in the order set takes their speeds.
+        self._motors = [m for m in self._forward + self._reverse if m]
+        self._signs = [1 if m in forward else -1 for m in self._motors]
+        self.sync = sync
+        if sync:
+            from fastio import timer_register
+            import stm
+
+            timers = set()
+            for motor in self._motors:
+                for pwm in motor.pwms():
+                    timers.add(pwm.timer_id)
+            self._control = [timer_register(timer, stm.TIM_CR1)
+                             for timer in sorted(timers)]
+
     def go(self, speed):
         """Go at given speed, from -100 to 100.
             
         Set forward to false to go in reverse."""
 
+        if self.sync:
+            changed = False
+            for m1, m2 in zip(self._forward, self._reverse):
+                if m1:
+                    m1._cancel()
+                    if m1.stage(speed):
+                        changed = True
+                if m2:
+                    m2._cancel()
+                    if m2.stage(-speed):
+                        changed = True
+            if changed:
+                self.commit()
+            return
+
         # Zip the engines together so we have at most one extra engine
         # in a gang running.
         for m1, m2 in zip(self._forward, self._reverse):
@@ -25,6 +71,44 @@ class Gang:
                 m1.go(speed)
             if m2:
                 m2.go(-speed)
+
+    def set(self, speeds):
+        """Set each motor's speed, from -100 to 100.
+
+        speeds is a sequence with a speed for each forward motor then
+        each reverse motor, in the order they were passed in. Reverse
+        motors run in reverse for positive speeds, as with go."""
+
+        motors, signs = self._motors, self._signs
+        if self.sync:
+            changed = False
+            for i in range(len(motors)):
+                motors[i]._cancel()
+                if motors[i].stage(signs[i] * speeds[i]):
+                    changed = True
+            if changed:
+                self.commit()
+            return
+
+        for i in range(len(motors)):
+            motors[i].go(signs[i] * speeds[i])
+
+    def commit(self):
+        """Write the staged inputs of all the motors at once.
+
+        Does nothing unless sync is set, as go and set write the
+        motors directly then."""
+
+        if not self.sync:
+            return
+        state = disable_irq()
+        for control in self._control:
+            control.write(control.read() | UDIS)
+        for motor in self._motors:
+            motor.commit()
+        for control in self._control:
+            control.write(control.read() & ~UDIS)
+        enable_irq(state)
         
     def forward(self, speed):
         """Drive motors to go forward."""
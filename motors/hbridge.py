@@ -2,8 +2,14 @@
 
 Provides an interface to a generic h-bridge motor drive."""
 
-from pyb import Pin
+from pyb import Pin, micros
 from pwm2 import PWM
+from stats import attach
+
+# Stats counters and timers, see stats.py.
+GO = 0
+WRITES = 1
+GO_TIME = 0
 
 class HBridge:
     """A generic h-bridge dual motor controller."""
@@ -13,7 +19,8 @@ class HBridge:
     RUN_BRAKE = 2
 
     def __init__(self, mode, in1, in2, freq=None, timer_1=None,
-                 freq_2=None, timer_2=None):
+                 freq_2=None, timer_2=None, fast=False, curve=None,
+                 accel=None):
         """Specify the run mode and two input pins for the HBridge.
 
         If mode is ONE_SPEED, then in1 is a digital pin that controls
@@ -23,52 +30,188 @@ class HBridge:
         
         Otherwise, in1 and in2 are both PWM pins for speed
         control. in1 uses freq and timer_1. as above. in2 uses freq_2
-        and timer2, with freq_2 defaulting to freq."""
+        and timer2, with freq_2 defaulting to freq.
+
+        If fast is set, the direction pin and PWM outputs are written
+        through their registers, see fastio.py.
+
+        curve is a motors.curve.Curve mapping speeds to duty cycles,
+        to make up for the motor's dead zone. It can be changed later
+        by setting self.curve.
+
+        accel limits how fast the speed changes, in speed units per
+        ms, see acceleration.
+
+        With stats.enable(), calls to go and writes to the inputs are
+        counted, and go is timed, see stats.py."""
 
         self.mode = mode
+        if curve is not None and curve.mode not in (None, mode):
+            raise ValueError("Curve was measured in another mode")
+        self.curve = curve
         if freq is None:
             freq = 20000
         if mode == self.ONE_SPEED:
+            in1.init(mode=Pin.OUT)
+            if fast:
+                from fastio import FastPin
+                in1 = FastPin(in1)
             self.in1 = in1
-            self.in1.init(mode=Pin.OUT)
-            self.in2 = PWM(in2, timer=timer_1, freq=freq)
+            self.in2 = PWM(in2, timer=timer_1, freq=freq, fast=fast)
         else:
-            self.in1 = PWM(in1, timer=timer_1, freq=freq)
-            self.in2 = PWM(in2, timer=timer_2, freq=freq_2 if freq_2 else freq)
+            self.in1 = PWM(in1, timer=timer_1, freq=freq, fast=fast)
+            self.in2 = PWM(in2, timer=timer_2, freq=freq_2 if freq_2 else freq,
+                           fast=fast)
+        self._speed = 0
+        self._ramps = None
+        self._step = self.step
+        self._rate = 0
+        if accel:
+            self.acceleration(accel)
+        # The committed and staged input values: direction or ticks for
+        # in1, ticks for in2.
+        self._out1 = self._out2 = self._next1 = self._next2 = None
+        self._stats = attach('HBridge', ('go', 'writes'), ('go',))
         self.go(0)
 
-    def go(self, speed=None):
+    def go(self, speed=None, time=0, profile=0):
         """Go at given speed, from 100 (forward) to -100 (reverse).
             
-        Call with no arguments to get the last set value."""
+        Call with no arguments to get the last set value. If time is
+        set, the speed changes over that many milliseconds, using the
+        ramp scheduler and profile as described in ramp.py. Otherwise
+        if there's an acceleration limit, the speed heads for the new
+        one at that rate in the background."""
 
         if speed is None:
             return self._speed
-        self._speed = speed
+        stats = self._stats
+        if stats is not None:
+            stats.count(GO)
+            start = micros()
+        if time:
+            # Each tick only changes the inputs that differ, like a
+            # slew, rather than stopping first as _drive does.
+            self._scheduler().start(self, self._step, round(self._speed),
+                                    round(speed), time, profile)
+        elif self._rate:
+            self._scheduler().slew(self, self._step, round(self._speed),
+                                   round(speed), self._rate)
+        else:
+            self._cancel()
+            self._drive(speed)
+        if stats is not None:
+            stats.time(GO_TIME, start)
+
+    def acceleration(self, accel=None):
+        """Limit speed changes to accel units per ms.
+
+        Changes from go without a time then ramp linearly to the new
+        speed from the ramp scheduler's timer, without the stop
+        between speeds, so reversing passes smoothly through zero.
+        Set to 0 for no limit. Returns the current limit if called
+        without an argument."""
+
+        if accel is None:
+            return self._rate / 1000 if self._rate else None
+        # Kept as units per second, so go doesn't need floats.
+        self._rate = round(accel * 1000)
+
+    def _scheduler(self):
+        if self._ramps is None:
+            from ramp import scheduler
+            self._ramps = scheduler()
+        return self._ramps
+
+    def _cancel(self):
+        """Stop any speed ramp in progress."""
+
+        if self._ramps is not None:
+            self._ramps.cancel(self)
+
+    def _drive(self, speed):
+        """Set the inputs for speed. Also the ramp scheduler setter.
+
+        Nothing is written if the inputs are already set for speed."""
+
+        if not self.stage(speed):
+            return
 
         # Shut motors down to avoid jerks
         self.in2.duty(0)
         if self.mode != self.ONE_SPEED:
             self.in1.duty(0)
 
+        self.commit(True)
+
+    def step(self, speed):
+        """Set the inputs for speed, changing only those that differ.
+
+        The acceleration limit's ramp setter."""
+
+        self.stage(speed)
+        self.commit()
+
+    def stage(self, speed):
+        """Work out the inputs for speed, without setting them.
+
+        Returns True if they differ from what was last committed.
+        Gang uses this with commit to update all its motors at once."""
+
+        self._speed = speed
         forward = speed > 0
         speed = min(abs(speed), 100)
+        # The duty cycle, out of unit.
+        if self.curve is None:
+            unit = 100
+        else:
+            speed, unit = self.curve.table[int(speed)], 10000
         if self.mode == self.ONE_SPEED:
-            self.in1.value(forward)
-            self.in2.duty(speed)
+            in1, in2 = 1 if forward else 0, speed
         elif self.mode == self.RUN_COAST:
-            if forward:
-                self.in1.duty(0)
-                self.in2.duty(speed)
-            else:
-                self.in1.duty(speed)
-                self.in2.duty(0)
+            in1, in2 = (0, speed) if forward else (speed, 0)
         elif forward:
-            self.in1.duty(100 - speed)
-            self.in2.duty(100)
+            in1, in2 = unit - speed, unit
         else:
-            self.in1.duty(100)
-            self.in2.duty(100 - speed)
+            in1, in2 = unit, unit - speed
+        if self.mode != self.ONE_SPEED:
+            in1 = int(self.in1.full * in1 // unit)
+        self._next1 = in1
+        self._next2 = int(self.in2.full * in2 // unit)
+        return self._next1 != self._out1 or self._next2 != self._out2
+
+    def commit(self, force=False):
+        """Set the inputs worked out by stage, if they've changed."""
+
+        if self._next1 != self._out1 or force:
+            self._out1 = self._next1
+            if self.mode == self.ONE_SPEED:
+                self.in1.value(self._out1)
+            else:
+                self.in1.pulse_width_ticks(self._out1)
+            if self._stats is not None:
+                self._stats.count(WRITES)
+        if self._next2 != self._out2 or force:
+            self._out2 = self._next2
+            self.in2.pulse_width_ticks(self._out2)
+            if self._stats is not None:
+                self._stats.count(WRITES)
+
+    def pwms(self):
+        """The PWM outputs used by this h-bridge."""
+
+        return [self.in2] if self.mode == self.ONE_SPEED else [self.in1,
+                                                               self.in2]
+
+    def _outputs(self, in1, in2):
+        """Set both PWM inputs to duty cycles in1 and in2."""
+
+        self._cancel()
+        self._speed = 0
+        self._next1 = self._out1 = int(self.in1.full * in1 // 100)
+        self._next2 = self._out2 = int(self.in2.full * in2 // 100)
+        self.in1.pulse_width_ticks(self._out1)
+        self.in2.pulse_width_ticks(self._out2)
 
     def forward(self, speed):
         """Go forward at given speed (from 0 to 100)."""
@@ -84,11 +227,10 @@ class HBridge:
         """Stop the motors."""
         
         if self.mode == self.ONE_SPEED:
-            self.go(0)
+            self._cancel()
+            self._drive(0)
         else:
-            self._speed = 0
-            self.in1.duty(0)
-            self.in2.duty(0)
+            self._outputs(0, 0)
 
     def brake(self):
         """Apply the motors brakes.
@@ -96,8 +238,7 @@ class HBridge:
         In ONE_SPEED mode, this is the same as coast."""
         
         if self.mode == self.ONE_SPEED:
-            self.go(0)
+            self._cancel()
+            self._drive(0)
         else:
-            self._speed = 0
-            self.in1.duty(100)
-            self.in2.duty(100)
+            self._outputs(100, 100)
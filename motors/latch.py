@@ -0,0 +1,93 @@
+"""Transports for 74HC595 style latches, as used on motor shields.
+
+A latch holds the direction bits for the motors, and writing it means
+shifting all eight bits out then pulsing the latch pin. Latch does
+the bookkeeping common to every transport, skipping writes of the
+value already in the latch, and each subclass gives it the function
+that writes a value.
+
+SoftLatch bit-bangs any three pins. SPILatch uses a hardware SPI bus,
+which needs the latch's data and clock inputs wired to the bus's MOSI
+and SCK pins."""
+
+from pyb import Pin
+
+from stats import attach
+
+# Stats counters, see stats.py.
+UPDATES = 0
+WRITES = 1
+
+
+class Latch:
+    """The common latch handling, around write(value), which puts value
+    in the latch.
+
+    With stats.enable(), updates and actual writes are counted, see
+    stats.py."""
+
+    def __init__(self, write):
+        self.value = None
+        self.write = write
+        self._stats = attach(type(self).__name__, ('updates', 'writes'))
+
+    def update(self, value):
+        """Set the latch to value, if it isn't already."""
+
+        stats = self._stats
+        if stats is not None:
+            stats.count(UPDATES)
+        if value != self.value:
+            self.value = value
+            self.write(value)
+            if stats is not None:
+                stats.count(WRITES)
+
+
+class SoftLatch(Latch):
+    """A latch bit-banged on the data, clock and latch pins.
+
+    If fast is set, it's shifted out through fastio.ShiftRegister."""
+
+    def __init__(self, data, clock, latch, fast=False):
+        for pin in data, clock, latch:
+            pin.init(Pin.OUT)
+        self.data, self.clock, self.latch = data, clock, latch
+        if fast:
+            from fastio import ShiftRegister
+            Latch.__init__(self, ShiftRegister(data, clock, latch).write)
+        else:
+            Latch.__init__(self, self._shift)
+
+    def _shift(self, value):
+        self.latch.off()
+        self.data.off()
+        for bit in range(7, -1, -1):
+            self.clock.off()
+            if value & (1 << bit):
+                self.data.on()
+            else:
+                self.data.off()
+            self.clock.on()
+        self.latch.on()
+
+
+class SPILatch(Latch):
+    """A latch shifted out by a hardware SPI bus.
+
+    spi is a pyb.SPI, set up as master with polarity 0 and phase 0 so
+    the latch shifts on the rising clock edge, and latch is the latch
+    pin. A single byte is sent from a preallocated buffer, so writes
+    don't allocate."""
+
+    def __init__(self, spi, latch):
+        latch.init(Pin.OUT)
+        self.spi, self.latch = spi, latch
+        self._buffer = bytearray(1)
+        Latch.__init__(self, self._send)
+
+    def _send(self, value):
+        self._buffer[0] = value
+        self.latch.off()
+        self.spi.send(self._buffer)
+        self.latch.on()
@@ -0,0 +1,152 @@
+"""Integer PID control, and closed loop motor speed control.
+
+PID works entirely in small ints, so update() doesn't allocate and
+can run in a timer callback. SpeedControl uses one per motor to hold
+motors at target speeds read from their encoders."""
+
+from pyb import micros
+
+from pwm2 import free_timer
+from stats import attach
+
+# Gains are fixed point with SHIFT fractional bits.
+SHIFT = 12
+# Measured speeds are counts per tick with FRACTION fractional bits.
+FRACTION = 4
+
+# SpeedControl stats counters and timers, see stats.py.
+TICKS = 0
+SATURATED = 1
+TICK = 0
+
+
+class PID:
+    """A PID controller with integer gains and state.
+
+    kp, ki and kd are the gains per unit of error, per update for ki
+    and kd. The output is clamped to +/-limit, and so is the integral
+    term, so it can't wind up while the output is saturated."""
+
+    def __init__(self, kp, ki=0, kd=0, limit=100):
+        self.limit = limit
+        self.gains(kp, ki, kd)
+        self.reset()
+
+    def gains(self, kp, ki=0, kd=0):
+        """Change the gains, keeping the loop's state."""
+
+        one = 1 << SHIFT
+        self._kp, self._ki, self._kd = (round(kp * one), round(ki * one),
+                                        round(kd * one))
+
+    def reset(self):
+        """Forget the integral and last error."""
+
+        self._integral = 0
+        self._last = 0
+
+    def update(self, error):
+        """The output for error."""
+
+        bound = self.limit << SHIFT
+        integral = self._integral + self._ki * error
+        if integral > bound:
+            integral = bound
+        elif integral < -bound:
+            integral = -bound
+        self._integral = integral
+        out = (self._kp * error + integral
+               + self._kd * (error - self._last)) >> SHIFT
+        self._last = error
+        if out > self.limit:
+            return self.limit
+        if out < -self.limit:
+            return -self.limit
+        return out
+
+
+class SpeedControl:
+    """Hold motors at target speeds from a timer callback at freq Hz.
+
+    motors is a list of HBridges, or a Gang, and encoders a list of
+    motors.encoder.Encoders, one per motor, with counts_per_rev set.
+    With a Gang the encoders follow the order of Gang.set, targets
+    are in the motors' own directions, and a sync Gang has all its
+    motors updated at once.
+
+    kp is in speed percent per rpm of error, ki in speed percent per
+    rpm second, and kd in speed percent per rpm per second. If timer
+    is None, a free timer is picked (see pwm2.free_timer).
+
+    With stats.enable(), ticks and motor updates with the output at
+    its limit are counted, and ticks are timed, see stats.py."""
+
+    def __init__(self, motors, encoders, kp, ki=0, kd=0, freq=100,
+                 timer=None):
+        from .gang import Gang
+
+        self._gang = None
+        if isinstance(motors, Gang):
+            if motors.sync:
+                self._gang = motors
+            motors = motors._motors
+        if len(motors) != len(encoders):
+            raise ValueError("Need an encoder for each motor")
+        self.motors = motors
+        self.encoders = encoders
+        self.freq = freq
+        self.pids = []
+        self._targets = [0] * len(motors)
+        for encoder in encoders:
+            # Error is in counts per tick with FRACTION bits, so
+            # convert the gains from rpm.
+            rpm = 60 * freq / encoder.counts_per_rev / (1 << FRACTION)
+            self.pids.append(PID(kp * rpm, ki * rpm / freq, kd * rpm * freq))
+        self.timer = timer if timer is not None else free_timer(freq)
+        self._tick = self.tick
+        self._stats = attach('SpeedControl', ('ticks', 'saturated'),
+                             ('tick',))
+
+    def target(self, index, rpm):
+        """Set motor index's target speed in rpm."""
+
+        self._targets[index] = round(rpm * self.encoders[index].counts_per_rev
+                                     * (1 << FRACTION) / (60 * self.freq))
+
+    def start(self):
+        """Start controlling the motors."""
+
+        for i in range(len(self.motors)):
+            self.encoders[i].delta()
+            self.pids[i].reset()
+        self.timer.callback(self._tick)
+
+    def stop(self):
+        """Stop controlling the motors, and stop them."""
+
+        self.timer.callback(None)
+        for motor in self.motors:
+            motor.go(0)
+
+    def tick(self, timer):
+        """The timer callback: one update of every motor."""
+
+        stats = self._stats
+        if stats is not None:
+            start = micros()
+        motors, encoders, pids, targets = (self.motors, self.encoders,
+                                           self.pids, self._targets)
+        for i in range(len(motors)):
+            speed = encoders[i].delta() << FRACTION
+            output = pids[i].update(targets[i] - speed)
+            motors[i].stage(output)
+            if stats is not None and abs(output) >= pids[i].limit:
+                stats.count(SATURATED)
+        if self._gang is not None:
+            self._gang.commit()
+        else:
+            for i in range(len(motors)):
+                motors[i].commit()
+        if stats is not None:
+            stats.count(TICKS)
+            stats.time(TICK, start)
@@ -16,20 +16,36 @@ commonly used with the Pyboard. There is no real industry standard,
 and most servos will vary from these values, so you need to calibrate
 your servos in any case."""
 
-from pwm2 import PWM
+from pwm2 import output, scale
 
 class Servo:
-    def __init__(self, pin, timer=None, length=20000):
+    def __init__(self, pin, timer=None, length=20000, pwm=None):
         """Init PWM signal on pin
         
          Optionally specify timer (see pwm2.py for details), and the
-         PWM pulse length in microseconds."""
+         PWM pulse length in microseconds. Pins with no timer channel
+         get software PWM (see softpwm.py).
 
-        self.pwm = PWM(pin, timer, length=length)
+         pwm is an output to use instead of a pwm2.PWM on pin, such as
+         one of a ServoBank's (see servobank.py). It needs PWM's
+         length, full, ticks, pulse_width and pulse_width_ticks."""
+
+        if pwm is None:
+            pwm = output(pin, timer, length=length)
+        else:
+            length = pwm.length
+        self.pwm = pwm
         self.pulse_min = round(length * .05)
         self.pulse_max = round(length * .1)
         self.pulse_centre = round(length * .075)
         self.pulse_angle_90 = self.pulse_speed_100 = self.pulse_max
+        # The last angles and speeds set and read, each with the pulse
+        # width in ticks it went with. While the width is unchanged,
+        # getters return the last value read, and setting the last
+        # value set again does nothing.
+        self._set_angle = self._got_angle = None
+        self._set_speed = self._got_speed = None
+        self._precompute()
 
         self.angle(0)
 
@@ -51,35 +67,112 @@ class Servo:
             self.pulse_angle_90 = pulse_angle_90
         if pulse_speed_100 is not None:
             self.pulse_speed_100 = pulse_speed_100
+        self._precompute()
+
+    def _precompute(self):
+        """Convert the calibration to ticks for the integer methods."""
+
+        pwm = self.pwm
+        self._set_angle_at = self._got_angle_at = None
+        self._set_speed_at = self._got_speed_at = None
+        self._min = pwm.ticks(self.pulse_min)
+        self._max = pwm.ticks(self.pulse_max)
+        self._centre = pwm.ticks(self.pulse_centre)
+        angle_90 = pwm.ticks(self.pulse_angle_90)
+        speed_100 = pwm.ticks(self.pulse_speed_100)
+        self._angle = scale(angle_90, 90000, 360000)
+        self._from_angle = scale(90000, angle_90, pwm.full)
+        self._speed = scale(speed_100, 1000, 2000)
+        self._from_speed = scale(1000, speed_100, pwm.full)
+
+    def angle_ticks(self, angle):
+        """The pulse width in timer ticks for angle in degrees.
 
-    def angle(self, angle=None, time=0):
+        Clamped to the calibrated range. This isn't for hot paths; use
+        it to precompute tick values, as trajectory.py does."""
+
+        mul, shift = self._angle
+        return min(max(self._centre + (round(angle * 1000) * mul >> shift),
+                       self._min), self._max)
+
+    def angle(self, angle=None, time=0, profile=0):
         """Get/set the current angle.
         
-        Output rounded to the nearest integer."""
+        Output rounded to the nearest integer. See pwm2.py for time
+        and profile."""
 
+        ticks = self.pwm.pulse_width_ticks()
         if angle is None:
-            return round(90 * (self.pulse_width() - self.pulse_centre)
-                         / self.pulse_angle_90)
+            if ticks != self._got_angle_at:
+                self._got_angle_at = ticks
+                self._got_angle = round(90 * (self.pulse_width()
+                                              - self.pulse_centre)
+                                        / self.pulse_angle_90)
+            return self._got_angle
+        if not time and ticks == self._set_angle_at \
+           and angle == self._set_angle:
+            return
         width = self.pulse_centre + self.pulse_angle_90 * angle / 90
-        self.pulse_width(width, time=time)
+        self.pulse_width(width, time=time, profile=profile)
+        self._set_angle = angle
+        self._set_angle_at = None if time else self.pwm.pulse_width_ticks()
     
-    def speed(self, speed=None, time=0):
+    def speed(self, speed=None, time=0, profile=0):
         """Get/set the current speed.
         
-        Output rounded to the nearest integer."""
+        Output rounded to the nearest integer. See pwm2.py for time
+        and profile."""
 
+        ticks = self.pwm.pulse_width_ticks()
         if speed is None:
-            return round(100 * (self.pulse_width() - self.pulse_centre)
-                         / self.pulse_speed_100)
+            if ticks != self._got_speed_at:
+                self._got_speed_at = ticks
+                self._got_speed = round(100 * (self.pulse_width()
+                                               - self.pulse_centre)
+                                        / self.pulse_speed_100)
+            return self._got_speed
+        if not time and ticks == self._set_speed_at \
+           and speed == self._set_speed:
+            return
         width = self.pulse_centre + self.pulse_speed_100 * speed / 100
-        self.pulse_width(width, time=time)
+        self.pulse_width(width, time=time, profile=profile)
+        self._set_speed = speed
+        self._set_speed_at = None if time else self.pwm.pulse_width_ticks()
     
-    def pulse_width(self, width=None, time=0):
+    def angle_millideg(self, angle=None):
+        """Get/set the current angle in thousandths of a degree.
+
+        Integer only, and doesn't allocate, so it can be used from
+        interrupt handlers. Changes happen immediately."""
+
+        if angle is None:
+            mul, shift = self._from_angle
+            return (self.pwm.pulse_width_ticks() - self._centre) * mul >> shift
+        mul, shift = self._angle
+        self.pwm.pulse_width_ticks(min(max(
+            self._centre + (angle * mul >> shift), self._min), self._max))
+
+    def speed_permille(self, speed=None):
+        """Get/set the current speed, from -1000 to 1000.
+
+        The integer version of speed, see angle_millideg."""
+
+        if speed is None:
+            mul, shift = self._from_speed
+            return (self.pwm.pulse_width_ticks() - self._centre) * mul >> shift
+        mul, shift = self._speed
+        self.pwm.pulse_width_ticks(min(max(
+            self._centre + (speed * mul >> shift), self._min), self._max))
+
+    def pulse_width(self, width=None, time=0, profile=0):
         """Get/set the current pulse width in microseconds.
         
         This returns the pwm2 PWM class pulse_width."""
 
         if width is None:
             return self.pwm.pulse_width()
+        if time:
+            # The width is about to change without the ticks showing it.
+            self._set_angle_at = self._set_speed_at = None
         self.pwm.pulse_width(min(max(width, self.pulse_min), self.pulse_max),
-                             time)
+                             time, profile)
@@ -0,0 +1,184 @@
+"""Many servos on one timer, with software sequenced pulses.
+
+A pwm2.PWM per servo uses up a timer channel each, and the chip runs
+out of them long before a robot arm runs out of joints. Servos only
+need a short pulse every 20ms, so a ServoBank takes turns instead:
+the frame is split into slots, and in each slot the timer's four
+channels time one pulse each, raising a GPIO pin at the start of the
+slot and lowering it from the channel's compare interrupt. With the
+default 8 slots of 2.5ms, one timer drives 32 servos on any pins, and
+the interrupt load is the same however many are attached.
+
+bank.servo(pin) returns an ordinary Servo, so calibration, angle,
+speed, the integer methods and trajectories all work as usual."""
+
+from array import array
+
+from pyb import Pin, Timer
+
+from pwm2 import PwmError, free_timer, reserve, unreserve
+
+CHANNELS = 4
+
+# Timers with four compare channels, to try for the bank.
+BANK_TIMERS = (5, 4, 3, 2, 1, 8)
+
+
+class ServoBank:
+    """Up to 4 * slots servos on one timer, each slot slot µs long.
+
+    The timer counts µs, so pulse widths are in µs too, and each
+    pulse must end before its slot does. If timer is None, a free
+    timer with four channels is picked, otherwise it's a string
+    'TIM#'. If fast is set, pins are set through their registers (see
+    fastio.py)."""
+
+    def __init__(self, timer=None, slots=8, slot=2500, fast=False):
+        self.slots = slots
+        self.slot = slot
+        self.fast = fast
+        if timer is None:
+            self.timer = free_timer(1000000 // slot, BANK_TIMERS)
+        else:
+            self.timer = reserve(int(timer[3:]), freq=1000000 // slot)
+        self.timer.init(prescaler=self.timer.source_freq() // 1000000 - 1,
+                        period=slot - 1)
+
+        size = CHANNELS * slots
+        self.widths = array('H', [0] * size)
+        self._raise = [None] * size
+        self._lower = [None] * size
+        self._current = 0
+        self._enders = [self._ender(k) for k in range(CHANNELS)]
+        self.channels = [self.timer.channel(k + 1, Timer.OC_TIMING,
+                                            compare=slot,
+                                            callback=self._enders[k])
+                         for k in range(CHANNELS)]
+        self.timer.callback(self._start_slot)
+
+    def _ender(self, k):
+        """The compare callback for channel k, ending its pulse."""
+
+        lower = self._lower
+
+        def end(timer):
+            off = lower[self._current + k]
+            if off is not None:
+                off()
+        return end
+
+    def _start_slot(self, timer):
+        """The update callback: start the next slot's pulses."""
+
+        current = self._current + CHANNELS
+        if current >= len(self.widths):
+            current = 0
+        self._current = current
+        widths, channels = self.widths, self.channels
+        for k in range(CHANNELS):
+            width = widths[current + k]
+            if width:
+                self._raise[current + k]()
+                channels[k].compare(width)
+            else:
+                # Past the end of the period, so it never matches.
+                channels[k].compare(self.slot)
+
+    def servo(self, pin):
+        """Return a Servo on pin, run by the bank."""
+
+        from .servo import Servo
+
+        # Fill each slot's first channel before any second ones, to
+        # spread the pulses through the frame.
+        for k in range(CHANNELS):
+            for slot in range(self.slots):
+                index = slot * CHANNELS + k
+                if self._raise[index] is None:
+                    return Servo(pin, pwm=BankOutput(self, index, pin))
+        raise PwmError("All %d bank outputs are in use" % len(self.widths))
+
+    def deinit(self):
+        """Stop the bank, leaving all the pins low."""
+
+        self.timer.callback(None)
+        for off in self._lower:
+            if off is not None:
+                off()
+        unreserve(self.timer)
+
+
+class BankOutput:
+    """One ServoBank output, standing in for a pwm2.PWM for Servo."""
+
+    def __init__(self, bank, index, pin):
+        pin.init(Pin.OUT)
+        pin.off()
+        if bank.fast:
+            from fastio import FastPin
+            pin = FastPin(pin)
+        self.bank, self.index = bank, index
+        self.length = bank.slots * bank.slot
+        self.full = bank.slot
+        self._limit = bank.slot - 1
+        self._ramps = None
+        self._ramped = False
+        self._write = self._set
+        bank.widths[index] = 0
+        bank._lower[index] = pin.off
+        bank._raise[index] = pin.on
+
+    def ticks(self, width):
+        """Convert a width in microseconds to timer ticks, which are µs."""
+
+        return int(width)
+
+    def _set(self, ticks):
+        self.bank.widths[self.index] = max(0, min(ticks, self._limit))
+
+    def _cancel(self):
+        if self._ramped:
+            self._ramped = False
+            self._ramps.cancel(self)
+
+    def pulse_width_ticks(self, ticks=None):
+        """Get/Set the pulse width in timer ticks. Doesn't allocate."""
+
+        if ticks is None:
+            return self.bank.widths[self.index]
+        if self._ramped:
+            self._cancel()
+        self._set(ticks)
+
+    def pulse_width(self, width=None, time=0, profile=0):
+        """Get/Set the pulse width in microseconds, as pwm2.PWM does."""
+
+        if width is None:
+            return self.bank.widths[self.index]
+        target = round(width)
+        if time == 0:
+            self._cancel()
+            self._set(target)
+        else:
+            if self._ramps is None:
+                from ramp import scheduler
+                self._ramps = scheduler()
+            self._ramped = True
+            self._ramps.start(self, self._write, self.bank.widths[self.index],
+                              target, time, profile)
+
+    def duty(self, percentage=None):
+        """Get/Set the duty cycle over the whole frame, as a percentage."""
+
+        if percentage is None:
+            return round(100 * self.bank.widths[self.index] / self.length)
+        self.pulse_width(self.length * percentage / 100)
+
+    def deinit(self):
+        """Stop this output and give it back to the bank."""
+
+        self._cancel()
+        bank = self.bank
+        bank.widths[self.index] = 0
+        bank._lower[self.index]()
+        bank._raise[self.index] = bank._lower[self.index] = None
@@ -0,0 +1,183 @@
+"""Servo trajectories, compiled to tables and played from a timer.
+
+A trajectory is compiled once into an array('H') of pulse widths in
+timer ticks, one per frame (array('L') on 32 bit timers). waypoints()
+builds one from (time, angle) pairs, eased between them with the
+ramp.py profiles, and trapezoid() from a move with speed and
+acceleration limits. A Player then plays
+tables for any number of servos in lock-step from one timer, one
+frame per tick, so playback is a table lookup and a register write
+per servo, with no math at all."""
+
+from array import array
+
+from pyb import disable_irq, enable_irq
+
+from ramp import LINEAR, ONE, ease
+
+
+def frames(time, rate):
+    """The number of frames at rate Hz in time ms, rounded up."""
+
+    return (time * rate + 999) // 1000
+
+
+def _table(servo, count, fill=0):
+    """An array for count frames of servo's pulse widths.
+
+    array('H') unless the servo is on a 32 bit timer whose ticks
+    don't fit."""
+
+    return array('H' if servo.pwm.full <= 0x10000 else 'L', [fill] * count)
+
+
+def waypoints(servo, points, rate=50, profile=LINEAR):
+    """Compile a list of (time ms, angle) waypoints for servo.
+
+    Times must increase; the servo is at the first angle until its
+    time. Between waypoints the angle moves with profile, so
+    ramp.EASE_IN_OUT gives a cubic that stops at each waypoint."""
+
+    if not points:
+        raise ValueError("Need at least one waypoint")
+    count = frames(points[-1][0], rate) + 1
+    table = _table(servo, count, servo.angle_ticks(points[0][1]))
+    point = 0
+    for frame in range(count):
+        time = frame * 1000 / rate
+        while point < len(points) - 1 and points[point + 1][0] <= time:
+            point += 1
+        start, angle = points[point]
+        if point < len(points) - 1 and time > start:
+            end, target = points[point + 1]
+            progress = ease(profile, round((time - start) * ONE
+                                           / (end - start)))
+            angle += (target - angle) * progress / ONE
+        table[frame] = servo.angle_ticks(angle)
+    return table
+
+
+def trapezoid(servo, start, end, speed, accel, rate=50):
+    """Compile a move from angle start to end for servo.
+
+    The servo accelerates at accel degrees/s² up to speed degrees/s,
+    cruises, and slows to a stop at end. Short moves never reach
+    speed, so are triangular."""
+
+    distance = abs(end - start)
+    sign = 1 if end >= start else -1
+    ramp = speed / accel
+    if accel * ramp * ramp > distance:
+        ramp = (distance / accel) ** 0.5
+        speed = accel * ramp
+    cruise = (distance - accel * ramp * ramp) / speed if speed else 0
+    total = 2 * ramp + cruise
+    count = frames(round(total * 1000), rate) + 1
+    table = _table(servo, count)
+    for frame in range(count):
+        t = min(frame / rate, total)
+        if t < ramp:
+            done = accel * t * t / 2
+        elif t < ramp + cruise:
+            done = accel * ramp * ramp / 2 + speed * (t - ramp)
+        else:
+            left = total - t
+            done = distance - accel * left * left / 2
+        table[frame] = servo.angle_ticks(start + sign * done)
+    return table
+
+
+class Player:
+    """Plays trajectory tables for several servos in lock-step.
+
+    Each tick of the timer, at rate Hz, every loaded servo gets its
+    table's next pulse width, so the tables should be compiled at the
+    same rate. A servo whose table is shorter than the others holds
+    its last position. If timer is None, a free timer is picked (see
+    pwm2.free_timer)."""
+
+    def __init__(self, rate=50, timer=None):
+        self.rate = rate
+        self.servos = []
+        self.frame = 0
+        self.frames = 0
+        self.loop = False
+        self.playing = False
+        self._tables = []
+        self._writers = []
+        if timer is None:
+            from pwm2 import free_timer
+            timer = free_timer(rate)
+        self.timer = timer
+        self._tick = self.tick
+
+    def load(self, servo, table):
+        """Set servo's table, replacing any it had.
+
+        It can be called while playing: the tick sees the new table
+        from its next frame."""
+
+        writer = servo.pwm.pulse_width_ticks
+        i = self.servos.index(servo) if servo in self.servos else -1
+        frames = max([len(table)] + [len(each) for j, each
+                                     in enumerate(self._tables) if j != i])
+        # Made with interrupts off, so the tick never sees a table
+        # without its writer, or a frame count that doesn't match.
+        state = disable_irq()
+        if i < 0:
+            self.servos.append(servo)
+            self._writers.append(writer)
+            self._tables.append(table)
+        else:
+            self._tables[i] = table
+        self.frames = frames
+        enable_irq(state)
+
+    def play(self, loop=False):
+        """Play from the start. If loop is set, start again at the end."""
+
+        self.loop = loop
+        self.frame = 0
+        self.resume()
+
+    def pause(self):
+        """Hold all the servos where they are."""
+
+        self.playing = False
+        self.timer.callback(None)
+
+    def resume(self):
+        """Carry on from where pause stopped."""
+
+        if self.frame < self.frames:
+            self.playing = True
+            self.timer.callback(self._tick)
+
+    stop = pause
+
+    def elapsed(self):
+        """The time in ms into the trajectories of the next frame."""
+
+        return self.frame * 1000 // self.rate
+
+    def seek(self, time):
+        """Move to time ms, without moving the servos until the next tick."""
+
+        self.frame = min(time * self.rate // 1000, self.frames)
+
+    def tick(self, timer):
+        """The timer callback: move every servo to the next frame."""
+
+        frame, tables, writers = self.frame, self._tables, self._writers
+        for i in range(len(tables)):
+            table = tables[i]
+            if frame < len(table):
+                writers[i](table[frame])
+        frame += 1
+        if frame >= self.frames:
+            if self.loop:
+                frame = 0
+            else:
+                self.playing = False
+                timer.callback(None)
+        self.frame = frame
@@ -0,0 +1,215 @@
+"""Pulse widths measured by timer input capture.
+
+Timing a pulse with an ExtInt callback calling micros() is only as
+good as the interrupt latency, and costs an interrupt per edge. A
+PulseIn uses a timer's input capture instead: the timer counts µs,
+and the hardware latches the count on each edge, so widths are exact
+to the µs whatever the latency.
+
+By default a channel pair is used (1 and 2, or 3 and 4): the pin's
+own channel captures the leading edge, and its partner is switched to
+capture the trailing edge of the same pin, so both edges are caught
+in hardware. The width can then be read at any time without any
+interrupts at all, or with one interrupt per pulse if a callback or
+a ring buffer of widths is wanted. With paired=False, only the pin's
+channel is used, capturing both edges with an interrupt each, so a
+timer can measure four pins instead of two.
+
+Capture timers run free at 1MHz over 16 bits, so pulses up to 65ms
+can be measured, and they're shared by all the inputs on them. The
+timer channel for a pin is found with the same pins_af data pwm2
+uses, so a capture timer can't also run PWM outputs.
+
+RCChannel reads an RC receiver channel as -100 to 100, and HCSR04
+can time its echoes with a PulseIn."""
+
+from array import array
+
+import stm
+from pyb import Pin, Timer, elapsed_millis, millis
+
+from pwm2 import PwmError, claim, partner, pick, release
+
+# Capture timers count µs over 16 bits, which is this many Hz.
+FREQ = 1000000 / 0x10000
+MASK = 0xffff
+
+CCMR = (None, stm.TIM_CCMR1, stm.TIM_CCMR1, stm.TIM_CCMR2, stm.TIM_CCMR2)
+
+
+def _timer(number, channel):
+    """Claim channel on capture timer number, starting it if needed."""
+
+    prescaler = Timer(number).source_freq() // 1000000 - 1
+    return claim(number, channel, FREQ, prescaler=prescaler, period=MASK)
+
+
+class PulseIn:
+    """Measures the pulses on pin with timer input capture.
+
+    level is the level of the pulses to measure, 1 for high. If timer
+    is None a timer channel for pin is picked, otherwise it's a
+    'TIM#' string. size is the number of widths to keep in a ring
+    buffer, and callback is called with each width as it's measured,
+    from the capture interrupt. Without either, a paired PulseIn
+    doesn't use interrupts at all."""
+
+    def __init__(self, pin, level=1, timer=None, size=0, callback=None,
+                 paired=True, pull=Pin.PULL_NONE):
+        af, number, channel = pick(pin, timer, FREQ, 2 if paired else 1)
+        self.pin, self.level = pin, level
+        self.paired = paired
+        self.timer = _timer(number, channel)
+        self._claim = [(number, channel)]
+        pin.init(Pin.AF_PP, pull, alt=af)
+        lead = Timer.RISING if level else Timer.FALLING
+        trail = Timer.FALLING if level else Timer.RISING
+
+        self.callback = callback
+        self.widths = array('H', [0] * size)
+        self.head = self.count = 0
+        self._width = self._period = 0
+        self._start = None
+        self._interrupts = interrupts = bool(size or callback)
+        if paired:
+            other = partner(channel)
+            try:
+                claim(number, other, FREQ)
+            except PwmError:
+                release(number, channel)
+                raise
+            self._claim.append((number, other))
+            self.lead = self.timer.channel(channel, Timer.IC, pin=pin,
+                                           polarity=lead)
+            self.trail = self.timer.channel(
+                other, Timer.IC, polarity=trail,
+                callback=self._trailing if interrupts else None)
+            self._indirect(number, other)
+        else:
+            self.lead = self.trail = self.timer.channel(
+                channel, Timer.IC, pin=pin, polarity=Timer.BOTH,
+                callback=self._edge)
+
+    def _indirect(self, number, channel):
+        """Switch channel to capture its partner's pin.
+
+        The input selection can only change while the channel is off."""
+
+        base = getattr(stm, 'TIM%d' % number)
+        ccer, ccmr = base + stm.TIM_CCER, base + CCMR[channel]
+        enable = 1 << 4 * (channel - 1)
+        shift = 0 if channel & 1 else 8
+        stm.mem32[ccer] &= ~enable
+        stm.mem32[ccmr] = stm.mem32[ccmr] & ~(3 << shift) | 2 << shift
+        stm.mem32[ccer] |= enable
+
+    def _store(self, width):
+        self._width = width
+        if len(self.widths):
+            self.widths[self.head] = width
+            self.head = (self.head + 1) % len(self.widths)
+            self.count += 1
+        if self.callback is not None:
+            self.callback(width)
+
+    def _trailing(self, timer):
+        """The paired trailing edge callback."""
+
+        lead = self.lead.capture()
+        if self._start is not None:
+            self._period = (lead - self._start) & MASK
+        self._start = lead
+        self._store((self.trail.capture() - lead) & MASK)
+
+    def _edge(self, timer):
+        """The unpaired callback, for both edges."""
+
+        at = self.lead.capture()
+        if self.pin.value() == self.level:
+            if self._start is not None:
+                self._period = (at - self._start) & MASK
+            self._start = at
+        elif self._start is not None:
+            self._store((at - self._start) & MASK)
+
+    def width(self):
+        """The width in µs of the last complete pulse, or 0 if none."""
+
+        if self.paired and not self._interrupts:
+            now = self.timer.counter()
+            lead, trail = self.lead.capture(), self.trail.capture()
+            # While a pulse is under way, the trailing capture is
+            # older than the leading one, and the last width stands.
+            if (now - trail) & MASK <= (now - lead) & MASK:
+                self._width = (trail - lead) & MASK
+        return self._width
+
+    def period(self):
+        """The µs between the last two pulses, or 0 if unknown.
+
+        Needs interrupts, so a paired PulseIn needs a size or callback."""
+
+        return self._period
+
+    def duty(self):
+        """The last pulse's width as a percentage of the period."""
+
+        return 100 * self._width / self._period if self._period else 0
+
+    def history(self):
+        """The widths in the ring buffer, oldest first."""
+
+        size = len(self.widths)
+        count = min(self.count, size)
+        return [self.widths[i % size] for i in range(self.head - count,
+                                                     self.head)]
+
+    def deinit(self):
+        """Stop measuring and give the timer channels back."""
+
+        self.lead.callback(None)
+        self.trail.callback(None)
+        for number, channel in self._claim:
+            release(number, channel)
+
+
+class RCChannel:
+    """One channel of an RC receiver, read as -100 to 100.
+
+    Receivers send a pulse of low to high µs every 20ms or so, with
+    centre at the middle. Readings within deadband of the centre are
+    0. If no pulse arrives for timeout ms, value returns failsafe.
+    Pulses are measured by a PulseIn, see there for timer."""
+
+    def __init__(self, pin, low=1000, high=2000, centre=1500, deadband=2,
+                 timeout=100, failsafe=0, timer=None):
+        self.low, self.high, self.centre = low, high, centre
+        self.deadband = deadband
+        self.timeout = timeout
+        self.failsafe = failsafe
+        self._seen = None
+        self.input = PulseIn(pin, timer=timer, callback=self._pulse)
+
+    def _pulse(self, width):
+        self._seen = millis()
+
+    def width(self):
+        """The last pulse width in µs, or 0 if the signal's lost."""
+
+        if self._seen is None or elapsed_millis(self._seen) > self.timeout:
+            return 0
+        return self.input.width()
+
+    def value(self):
+        """The stick position from -100 to 100, or failsafe."""
+
+        width = self.width()
+        if not width:
+            return self.failsafe
+        offset = width - self.centre
+        span = self.high - self.centre if offset > 0 else self.centre - self.low
+        value = max(-100, min(100, offset * 100 // span))
+        return 0 if abs(value) <= self.deadband else value
+
+    def deinit(self):
+        self.input.deinit()
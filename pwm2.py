@@ -2,100 +2,461 @@
 
 from pyb import Pin, Timer
 
-from  pins_af import PINS_AF
-af_map = dict((x[0], x[1:]) for x in PINS_AF)
+from stats import attach
+
+# Pin -> timer channel index, loaded on first use. _offsets holds a
+# little-endian 16 bit offset for each port * 16 + pin, giving the
+# range of _entries (in 3 byte entries) for that pin. Both are bytes,
+# so a frozen pwm_af module's copies stay in flash. Each entry is the alternate function number,
+# the timer number and the channel number, with INVERTED set if it's
+# an inverted (CHxN) output.
+INVERTED = 0x80
+_offsets = None
+_entries = None
+
+# Timers in use by PWM outputs: timer number -> [Timer, freq, channels],
+# where channels is a bitmask of the channels in use.
+_timers = {}
+ALL_CHANNELS = 0x1e
+
+# Timers to try for free_timer, those with no outputs first.
+TICK_TIMERS = (6, 7, 14, 13, 12, 11, 10, 9, 8, 5, 4, 3, 2, 1)
+
+# The ramp scheduler, once something has used it.
+_scheduler = None
+
+# PWM stats counters, see stats.py.
+SETS = 0
+RAMPS = 1
+
 
 class PwmError(Exception):
     pass
-    
+
+
+def _parse(name):
+    """Return the port * 16 + pin key for a pin name like 'PA5', or None."""
+
+    if len(name) < 3 or name[0] != 'P' or not 'A' <= name[1] <= 'K':
+        return None
+    try:
+        pin = int(name[2:])
+    except ValueError:
+        return None
+    return (ord(name[1]) - ord('A')) * 16 + pin if pin < 16 else None
+
+
+def build_index(pins_af):
+    """Build the (offsets, entries) index from a PINS_AF table."""
+
+    rows = {}
+    for row in pins_af:
+        key = _parse(row[0])
+        if key is None:
+            continue
+        data = rows.setdefault(key, bytearray())
+        for af, name in row[1:]:
+            if not name.startswith('TIM'):
+                continue
+            timer, channel = name.split('_', 1)
+            if not channel.startswith('CH'):
+                continue
+            data.extend((af, int(timer[3:]),
+                         int(channel[2:3]) | (INVERTED if channel.endswith('N')
+                                              else 0)))
+    size = max(rows) + 2 if rows else 1
+    offsets = bytearray(2 * size)
+    entries = bytearray()
+    for key in range(size):
+        offset = len(entries) // 3
+        offsets[2 * key] = offset & 0xff
+        offsets[2 * key + 1] = offset >> 8
+        entries.extend(rows.get(key, b''))
+    return bytes(offsets), bytes(entries)
+
+
+def write_index(filename='pwm_af.py'):
+    """Write the index for this board as a python module.
+
+    Copy the resulting file to the board next to pwm2.py, and
+    pins_af.py won't need to be loaded at all. It's just two bytes
+    constants, so frozen into the firmware or compiled with mpy-cross
+    it costs next to no RAM."""
+
+    offsets, entries = _index()
+    with open(filename, 'w') as out:
+        out.write('# Generated by pwm2.write_index() - do not edit.\n')
+        out.write('OFFSETS = %r\n' % (offsets,))
+        out.write('ENTRIES = %r\n' % (entries,))
+
+
+def _index():
+    """Return the (offsets, entries) index, loading it if needed."""
+
+    global _offsets, _entries
+    if _offsets is None:
+        try:
+            from pwm_af import OFFSETS, ENTRIES
+            _offsets, _entries = OFFSETS, ENTRIES
+        except ImportError:
+            from pins_af import PINS_AF
+            _offsets, _entries = build_index(PINS_AF)
+    return _offsets, _entries
+
+
+def timer_channels(pin):
+    """Return the (af, timer, channel) entries for pin as a memoryview.
+
+    Entries are 3 bytes each, see INVERTED for the channel flag."""
+
+    offsets, entries = _index()
+    key = 2 * (pin.port() * 16 + pin.pin())
+    if key + 3 >= len(offsets):
+        return memoryview(b'')
+    start = offsets[key] | offsets[key + 1] << 8
+    end = offsets[key + 2] | offsets[key + 3] << 8
+    return memoryview(entries)[3 * start:3 * end]
+
+
+def claim(number, channel, freq, **kwargs):
+    """Claim channel on timer number, running at freq.
+
+    The timer is initialised if nobody is using it, otherwise it's
+    shared as is. Raises PwmError if the timer is running at a
+    different frequency or the channel is already taken. If kwargs
+    are given, the timer is initialised with those rather than freq,
+    which should be the frequency they give."""
+
+    slot = _timers.get(number)
+    if slot is None:
+        timer = Timer(number, **kwargs) if kwargs else Timer(number, freq=freq)
+        _timers[number] = [timer, freq, 1 << channel]
+        return timer
+    if slot[1] != freq:
+        raise PwmError("TIM%d is already running at %s Hz" % (number, slot[1]))
+    if slot[2] & (1 << channel):
+        raise PwmError("TIM%d channel %d is already in use" % (number, channel))
+    slot[2] |= 1 << channel
+    return slot[0]
+
+
+def release(number, channel):
+    """Release channel on timer number, stopping the timer if it's unused."""
+
+    slot = _timers.get(number)
+    if slot is None:
+        return
+    slot[2] &= ~(1 << channel)
+    if not slot[2]:
+        slot[0].deinit()
+        del _timers[number]
+
+
+def scale(numer, denom, limit):
+    """Return (mul, shift) so x * mul >> shift is about x * numer / denom.
+
+    The shift is as large as it can be while x * mul stays a small int
+    for any abs(x) <= limit, so the hot paths never allocate."""
+
+    shift = 0
+    while shift < 24 and limit * numer << (shift + 1) < denom << 29:
+        shift += 1
+    return ((numer << shift) + denom // 2) // denom, shift
+
+
+def reserve(number, **kwargs):
+    """Claim all of timer number for something other than PWM outputs.
+
+    The timer is initialised with kwargs, and PWM outputs won't try
+    to share it. Raises PwmError if anything is already using it."""
+
+    if number in _timers:
+        raise PwmError("TIM%d is already in use" % number)
+    timer = Timer(number, **kwargs)
+    _timers[number] = [timer, None, ALL_CHANNELS]
+    return timer
+
+
+def free_timer(freq, numbers=TICK_TIMERS):
+    """Claim a timer no PWM is using to run callbacks at freq.
+
+    The first timer in numbers that exists and is free is used, and
+    it's reserved so PWM outputs won't try to share it."""
+
+    for number in numbers:
+        if number in _timers:
+            continue
+        try:
+            return reserve(number, freq=freq)
+        except ValueError:
+            continue
+    raise PwmError("No free timer")
+
+
+def unreserve(timer):
+    """Stop a timer claimed with reserve or free_timer, and give it back."""
+
+    for number, slot in _timers.items():
+        if slot[0] is timer:
+            del _timers[number]
+            break
+    timer.deinit()
+
+
+def output(pin, timer=None, length=None, freq=None, fast=False):
+    """A PWM on pin, or a softpwm.SoftPWM if pin has no timer channel.
+
+    The arguments are PWM's. Software PWM has the same methods, but
+    its edges jitter by the interrupt latency, so only use this for
+    things that don't mind, like LEDs and servos. timer and fast
+    don't apply to it."""
+
+    if timer_channels(pin):
+        return PWM(pin, timer, length, freq, fast)
+    from softpwm import SoftPWM
+    return SoftPWM(pin, length, freq)
+
+
+def _ramps():
+    """The ramp scheduler, loaded on first use."""
+
+    global _scheduler
+    if _scheduler is None:
+        from ramp import scheduler
+        _scheduler = scheduler()
+    return _scheduler
+
+
+def partner(channel):
+    """The channel paired with channel for input capture: 1-2 or 3-4."""
+
+    return channel + 1 if channel & 1 else channel - 1
+
+
+def pick(pin, timer, freq, inputs=0, timers=None):
+    """Pick the (af, timer number, channel) entry to use for pin.
+
+    timer is a 'TIM#' string to insist on, or None. Timers already
+    running at freq are preferred, then free ones. inputs is 0 for an
+    output, 1 for an input on the channel, or 2 for an input needing
+    the channel's partner too. Inverted (CHxN) channels can't be
+    inputs. If nothing is usable the first candidate is returned, so
+    claim can explain why. timers is the table of timers in use to
+    pick against, defaulting to the real one; motors.board passes a
+    plan to check a board's outputs before claiming anything."""
+
+    if timers is None:
+        timers = _timers
+    entries = timer_channels(pin)
+    want = int(timer[3:]) if timer and len(timer) > 3 else 0
+    best, choice = 0, None
+    for i in range(0, len(entries), 3):
+        number, channel = entries[i + 1], entries[i + 2]
+        if want and number != want or inputs and channel & INVERTED:
+            continue
+        usable = _usable(number, channel & ~INVERTED, freq, timers)
+        if inputs == 2:
+            usable = min(usable, _usable(number, partner(channel), freq,
+                                         timers))
+        if choice is None or usable > best:
+            best, choice = usable, i
+            if usable == 2:
+                break
+    if choice is None:
+        raise PwmError("Pin does not support timer %s" % timer if want
+                       else "Pin has no timer channel")
+    return entries[choice:choice + 3]
+
+
+def _usable(number, channel, freq, timers):
+    """0 if we can't use the timer channel, 1 if it's free, 2 if shared."""
+
+    slot = timers.get(number)
+    if slot is None:
+        return 1
+    if slot[1] != freq or slot[2] & (1 << channel):
+        return 0
+    return 2
+
+
 class PWM:
     """A PWM output on the given pin.
-    
-    This uses the pins_af.py file created by the micropython build.
+
+    This uses the pins_af.py file created by the micropython build, or
+    the pwm_af.py file written by write_index if one is available.
 
     The timer argument is the name of the timer to use, as a string in
-    the form 'TIM#'.  If it is not set, the first timer available for
-    the pin will be used. Either length or freq can be used to specify
-    the pulse length of the pwm signal. Length is the total pulse
+    the form 'TIM#'.  If it is not set, a timer for the pin will be
+    picked, preferring one that is already running at the requested
+    frequency, then an unused one. Timers are shared between PWM
+    outputs, so adding a channel doesn't reinitialise a running timer,
+    but all the channels on a timer must use the same frequency.
+
+    Either length or freq can be used to specify the pulse length of
+    the pwm signal. Length is the total pulse
     length in microseconds, and frequency is Hz, so length=20000
     implies freq=50, which is the default. If both are specified, freq
     is ignored.
 
+    If fast is set, the setters write the timer's compare register
+    directly (see fastio.py) rather than going through pyb.
+
     self.timer & self.channel are made available if you want to read or
-    adjust the settings after initialization."""
+    adjust the settings after initialization, and self.timer_id is the
+    timer's number.
 
-    def __init__(self, pin, timer=None, length=None, freq=None):
-        timers = af_map['P' + pin.name()]
+    The pulse width last written is cached, so getters don't read the
+    timer, and setting the width it already has doesn't write it.
+
+    With stats.enable(), sets and timed changes are counted, see
+    stats.py."""
+
+    def __init__(self, pin, timer=None, length=None, freq=None, fast=False):
+        timers = timer_channels(pin)
         if not timers:
-            raise PwmError("Pin does not support PWM.")
-
-        if not timer:
-            timer = 'TIM'
-        for af, name in timers:
-            if name.startswith(timer):
-                timer_af, timer_name = af, name
-                timer_full, channel = timer_name.split('_')
-                if channel.startswith('CH'):
-                    break
-        else:
-            raise PwmError("Pin does not support timer %s" % timer)
-        
+            raise PwmError("Pin does not support PWM, see pwm2.output.")
+
         if length:
             freq = 1000000 / length
         elif not freq:
             freq = 50
+
+        # If nothing was usable, claim will explain why.
+        af, number, channel = pick(pin, timer, freq)
+        self.timer = claim(number, channel & ~INVERTED, freq)
         pin.init(Pin.OUT, alt=af)
-        self.timer = Timer(int(timer_full[3:]), freq=freq)
-        self.channel = self.timer.channel(int(channel[2:3]), 
-                    Timer.PWM_INVERTED if channel.endswith('N') else Timer.PWM,
+        self.channel = self.timer.channel(channel & ~INVERTED,
+                    Timer.PWM_INVERTED if channel & INVERTED else Timer.PWM,
                     pin=pin)
+        self._claim = number, channel & ~INVERTED
+        self.timer_id = number
+        self._ramped = False
+        self._stats = attach('PWM TIM%d_CH%d' % self._claim,
+                             ('sets', 'ramps'))
+        if fast:
+            from fastio import compare_register
+            self._raw = compare_register(*self._claim).write
+        else:
+            self._raw = self.channel.pulse_width
+        # The last pulse width written, in ticks. The getters read it
+        # rather than the timer, and _write skips rewriting it.
+        self._ticks = None
+        self._write = self._set
 
         self.length = 1000000 / self.timer.freq()
+        # Scale factors for the integer setters and getters.
+        self._period = self.timer.period()
+        self.full = full = self._period + 1
+        self._to_ticks = scale(self.timer.source_freq(),
+                               (self.timer.prescaler() + 1) * 1000000,
+                               round(self.length) + 1)
+        self._u16 = scale(full, 0x10000, 0xffff)
+        self._from_ticks = scale(0x10000, full, full)
         self.duty(0)
 
+    def ticks(self, width):
+        """Convert a width in microseconds to timer ticks.
+
+        This isn't for hot paths; use it to precompute tick values."""
+
+        mul, shift = self._to_ticks
+        return int(width) * mul >> shift
+
+    def _set(self, ticks):
+        """Write ticks to the compare register, if it isn't there already.
+
+        All writes go through here, ramps included, so the cache in
+        self._ticks stays right. Write through the methods rather than
+        self.channel for the same reason."""
+
+        if ticks != self._ticks:
+            self._ticks = ticks
+            self._raw(ticks)
+
+    def _cancel(self):
+        """Stop any ramp in progress."""
+
+        self._ramped = False
+        _scheduler.cancel(self)
+
+    def deinit(self):
+        """Stop this output and give its timer channel back."""
+
+        self.duty(0)
+        release(*self._claim)
+
     def duty(self, percentage=None):
         """Get/Set the duty cycle as a percentage.
-        
+
         The duty cycle is the time the output signal is on.
         Returns the last set value if called with no arguments."""
 
         if percentage is None:
-            return round(100 * self.channel.pulse_width() / self.timer.period())
-        self.channel.pulse_width_percent(max(0, min(percentage, 100)))
+            return round(100 * self._ticks / self._period)
+        if self._ramped:
+            self._cancel()
+        if self._stats is not None:
+            self._stats.count(SETS)
+        self._write(int(self.full * max(0, min(percentage, 100)) // 100))
 
-    def pulse_width(self, width=None, time=0):
+    def duty_u16(self, value=None):
+        """Get/Set the duty cycle as an int from 0 to 65535.
+
+        Neither getting nor setting allocates, so this is safe to use
+        from interrupt handlers."""
+
+        if value is None:
+            mul, shift = self._from_ticks
+            return min(self._ticks * mul >> shift, 0xffff)
+        if self._ramped:
+            self._cancel()
+        if self._stats is not None:
+            self._stats.count(SETS)
+        mul, shift = self._u16
+        if value >= 0xffff:
+            self._write(self.full)
+        else:
+            self._write(max(0, value) * mul >> shift)
+
+    def pulse_width_ticks(self, ticks=None):
+        """Get/Set the pulse width in timer ticks, from 0 to self.full.
+
+        Doesn't allocate; use ticks() to convert from microseconds
+        ahead of time."""
+
+        if ticks is None:
+            return self._ticks
+        if self._ramped:
+            self._cancel()
+        if self._stats is not None:
+            self._stats.count(SETS)
+        self._write(max(0, min(ticks, self.full)))
+
+    def pulse_width(self, width=None, time=0, profile=0):
         """Get/Set the pulse width in microseconds.
-        
+
         The width is the length of time the signal is on.  Returns the
         current value rounded to the nearest int if called with no
         arguments.
-        
+
         Time is the number of milliseconds to take to get to the new
         width.  At least that many milliseconds will pass; if it's 0,
-        the change will happen now."""
+        the change will happen now. Timed changes are run by the ramp
+        scheduler, using the easing profile from ramp.py."""
 
         if width is None:
-            return round(self.length * self.channel.pulse_width() /
-                         self.timer.period())
-        target = self.timer.period() * min(width, self.length) / self.length
-        self.target = round(target)
+            return round(self.length * self._ticks / self._period)
+        target = round(self._period * min(width, self.length) / self.length)
         if time == 0:
-            self.channel.pulse_width(self.target)
+            if self._ramped:
+                self._cancel()
+            if self._stats is not None:
+                self._stats.count(SETS)
+            self._write(target)
         else:
-            self.delta = int((target - self.channel.pulse_width()) * self.length
-                             / (time * 1000))
-            self.channel.callback(self.timed_change)
+            if self._stats is not None:
+                self._stats.count(RAMPS)
             # No initial change so we get minimum length.
-
-    def timed_change(self, timer):
-        """Make a timed change in width."""
-
-        old = self.channel.pulse_width()
-        if abs(old - self.target) > abs(self.delta):
-            self.channel.pulse_width(old + self.delta)
-        else:
-            self.channel.callback(None)
-            self.channel.pulse_width(self.target)
-            
-            
-        
+            self._ramped = True
+            _ramps().start(self, self._write, self._ticks, target, time,
+                           profile)
@@ -0,0 +1,227 @@
+"""Timed changes ("ramps") run from a single timer interrupt.
+
+Rather than each PWM output installing its own channel callback, all
+the ramps in flight are owned by a Scheduler, which updates them on
+each tick of one timer. A ramp moves an integer value from start to
+end over a number of ticks, calling a setter with each new value. The
+position is tracked in fixed point, so slow ramps don't stall, and a
+ramp always finishes on exactly the tick it was due to.
+
+Most code uses the default scheduler via scheduler(), which is created
+on first use at DEFAULT_FREQ Hz on a timer no PWM output is using.
+Call configure() before that to use a different rate or timer.
+
+The same tick also runs a commands.Queue, if one is attached, so
+timed commands and ramps share one interrupt."""
+
+from pyb import micros
+
+from pwm2 import free_timer
+from stats import attach
+
+# Easing profiles.
+LINEAR = 0
+EASE_IN = 1
+EASE_OUT = 2
+EASE_IN_OUT = 3
+
+DEFAULT_FREQ = 500
+DEFAULT_SLOTS = 16
+
+# Progress through a ramp is fixed point, with ONE being done. It's
+# small enough that the easing math stays in small ints.
+SHIFT = 14
+ONE = 1 << SHIFT
+MASK = ONE - 1
+
+_scheduler = None
+
+# Scheduler stats counters and timers, see stats.py.
+STARTED = 0
+TICKS = 1
+STEPS = 2
+FINISHED = 3
+TICK = 0
+
+
+class RampError(Exception):
+    pass
+
+
+def ease(profile, progress):
+    """Map linear progress to eased progress, both in 0 to ONE."""
+
+    if profile == EASE_IN:
+        return progress * progress >> SHIFT
+    if profile == EASE_OUT:
+        progress = ONE - progress
+        return ONE - (progress * progress >> SHIFT)
+    if profile == EASE_IN_OUT:
+        return (progress * progress >> SHIFT) * (3 * ONE - 2 * progress) >> SHIFT
+    return progress
+
+
+class Ramp:
+    """One ramp slot. These are reused, so the IRQ never allocates."""
+
+    def __init__(self):
+        self.owner = None
+        self.setter = None
+        self.active = False
+        self.start = self.end = 0
+        self.span_high = self.span_low = 0
+        self.step = self.steps = 1
+        self.profile = LINEAR
+
+    def setup(self, owner, setter, start, end, steps, profile):
+        self.active = False
+        self.owner, self.setter = owner, setter
+        self.start, self.end = start, end
+        # The span is split so span * progress stays in small ints.
+        span = end - start
+        sign = -1 if span < 0 else 1
+        span = abs(span)
+        self.span_high, self.span_low = sign * (span >> SHIFT), sign * (span & MASK)
+        self.step, self.steps = 0, steps
+        self.profile = profile
+        self.active = True
+
+    def advance(self):
+        """Move one tick along the ramp, returning False when done."""
+
+        self.step += 1
+        if self.step >= self.steps:
+            self.active = False
+            self.setter(self.end)
+            return False
+        eased = ease(self.profile, self.step * ONE // self.steps)
+        self.setter(self.start + self.span_high * eased
+                    + (self.span_low * eased >> SHIFT))
+        return True
+
+
+class Scheduler:
+    """Runs up to slots ramps at once from one timer at freq Hz.
+
+    If timer is None, a free timer is picked (see pwm2.free_timer),
+    otherwise it's the pyb.Timer to use."""
+
+    def __init__(self, freq=DEFAULT_FREQ, timer=None, slots=DEFAULT_SLOTS):
+        self.freq = freq
+        self.ramps = [Ramp() for _ in range(slots)]
+        self.timer = timer if timer is not None else free_timer(freq)
+        self._tick = self.tick
+        self._running = False
+        # A commands.Queue dispatched on each tick, if any.
+        self.queue = None
+        self._stats = attach('ramp', ('started', 'ticks', 'steps',
+                                      'finished'), ('tick',))
+
+    def start(self, owner, setter, start, end, time, profile=LINEAR):
+        """Ramp from start to end over time milliseconds.
+
+        setter is called with each new value from the timer interrupt,
+        so must not allocate. Any ramp owner already has is replaced."""
+
+        steps = max(1, (time * self.freq + 999) // 1000)
+        slot = self.find(owner)
+        if slot is None:
+            for ramp in self.ramps:
+                if not ramp.active:
+                    slot = ramp
+                    break
+            else:
+                raise RampError("All %d ramps are in use" % len(self.ramps))
+        slot.setup(owner, setter, start, end, steps, profile)
+        if self._stats is not None:
+            self._stats.count(STARTED)
+        self.run()
+
+    def run(self):
+        """Start ticking, if it isn't already.
+
+        Ticking stops by itself once nothing is left to do."""
+
+        if not self._running:
+            self._running = True
+            self.timer.callback(self._tick)
+
+    def slew(self, owner, setter, start, end, rate):
+        """Ramp linearly from start to end at rate units per second.
+
+        Used for acceleration limits. If owner is already heading for
+        end, its ramp is left alone, so calling this repeatedly with
+        the same target is cheap."""
+
+        ramp = self.find(owner)
+        if ramp is not None and ramp.end == end and ramp.setter is setter:
+            return
+        self.start(owner, setter, start, end, abs(end - start) * 1000 // rate)
+
+    def find(self, owner):
+        """Return the active ramp for owner, or None."""
+
+        for ramp in self.ramps:
+            if ramp.active and ramp.owner is owner:
+                return ramp
+        return None
+
+    def cancel(self, owner):
+        """Stop owner's ramp, leaving the value where it is."""
+
+        ramp = self.find(owner)
+        if ramp is not None:
+            ramp.active = False
+
+    def busy(self, owner=None):
+        """Is owner (or anything, if owner is None) ramping?"""
+
+        if owner is not None:
+            return self.find(owner) is not None
+        for ramp in self.ramps:
+            if ramp.active:
+                return True
+        return False
+
+    def tick(self, timer):
+        """The timer callback: advance all the active ramps, and
+        dispatch any queued commands that are due."""
+
+        stats = self._stats
+        if stats is not None:
+            start = micros()
+        busy = False
+        for ramp in self.ramps:
+            if ramp.active:
+                if ramp.advance():
+                    busy = True
+                elif stats is not None:
+                    stats.count(FINISHED)
+                if stats is not None:
+                    stats.count(STEPS)
+        queue = self.queue
+        if queue is not None and queue.count:
+            if queue.dispatch():
+                busy = True
+        if stats is not None:
+            stats.count(TICKS)
+            stats.time(TICK, start)
+        if not busy:
+            self._running = False
+            timer.callback(None)
+
+
+def configure(freq=DEFAULT_FREQ, timer=None, slots=DEFAULT_SLOTS):
+    """Create the default scheduler with these settings."""
+
+    global _scheduler
+    if _scheduler is not None:
+        raise RampError("The ramp scheduler is already running")
+    _scheduler = Scheduler(freq, timer, slots)
+    return _scheduler
+
+
+def scheduler():
+    """Return the default scheduler, creating it if needed."""
+
+    return _scheduler if _scheduler is not None else configure()
@@ -0,0 +1,34 @@
+"""Stand-in for the micropython module, for running drivers on CPython."""
+
+from simclock import clock
+
+
+def const(value):
+    return value
+
+
+def native(fun):
+    return fun
+
+
+viper = native
+
+
+def schedule(fun, arg):
+    clock.schedule(fun, arg)
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def heap_lock():
+    return 0
+
+
+def heap_unlock():
+    return 0
+
+
+def mem_info(verbose=None):
+    print('simulated, no heap information')
@@ -0,0 +1,81 @@
+"""A simulated DC motor with an encoder, driven by an HBridge.
+
+The motor doesn't move until the drive is past a dead zone, then its
+steady speed rises with drive, bent by exponent, up to max_speed
+counts per second. It approaches that speed with a first order lag
+of lag ms, updated every step µs of simulated time. By default the
+dead zone is 50% in run/coast mode and 10% otherwise, which is what
+a DRV8835 driven platform did (see the README).
+
+If encoder is a Timer in encoder mode, e.g. motors.encoder.Encoder's,
+the motor's counts show up in its counter."""
+
+from simclock import clock
+
+RUN_COAST = 1
+
+
+class Motor:
+    def __init__(self, bridge, max_speed=1000, deadband=None, exponent=1.0,
+                 lag=50, step=1000, encoder=None):
+        self.bridge = bridge
+        self.encoder = encoder
+        self.max_speed = max_speed
+        if deadband is None:
+            deadband = 50 if bridge.mode == RUN_COAST else 10
+        self.deadband = deadband
+        self.exponent = exponent
+        self.lag = lag
+        self.step = step
+        self.speed = 0.0
+        self.position = 0.0
+        self._next = clock.now + step
+        clock.tickers.append(self)
+
+    def remove(self):
+        """Stop simulating the motor."""
+
+        clock.tickers.remove(self)
+
+    def drive(self):
+        """The bridge's drive, from -100 (full reverse) to 100."""
+
+        bridge = self.bridge
+        if bridge.mode == bridge.ONE_SPEED:
+            duty = _duty(bridge.in2)
+            return duty if bridge.in1.value() else -duty
+        # Forward is in2 driven more than in1, whichever input is PWM.
+        return _duty(bridge.in2) - _duty(bridge.in1)
+
+    def steady(self, drive):
+        """The speed the motor settles at for drive."""
+
+        level = abs(drive)
+        if level <= self.deadband:
+            return 0.0
+        level = ((level - self.deadband) / (100 - self.deadband)) \
+            ** self.exponent
+        return self.max_speed * level * (1 if drive > 0 else -1)
+
+    def count(self):
+        """The encoder count."""
+
+        return int(self.position)
+
+    def due(self):
+        return self._next
+
+    def fire(self):
+        dt = self.step / 1000000
+        target = self.steady(self.drive())
+        self.speed += (target - self.speed) * min(1, self.step / 1000
+                                                  / self.lag)
+        last = int(self.position)
+        self.position += self.speed * dt
+        if self.encoder is not None:
+            self.encoder.encode(int(self.position) - last)
+        self._next += self.step
+
+
+def _duty(pwm):
+    return 100 * pwm.channel.compare() / pwm.full
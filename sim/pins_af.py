@@ -0,0 +1,49 @@
+# Stand-in for the pins_af.py generated by the micropython build, with
+# the timer alternate functions of a NUCLEO_F401RE.
+PINS_AF = (
+  ('PA0', (1, 'TIM2_CH1'), (2, 'TIM5_CH1'), (8, 'USART2_CTS'), ),
+  ('PA1', (1, 'TIM2_CH2'), (2, 'TIM5_CH2'), (7, 'USART2_RTS'), ),
+  ('PA2', (1, 'TIM2_CH3'), (2, 'TIM5_CH3'), (3, 'TIM9_CH1'), (7, 'USART2_TX'), ),
+  ('PA3', (1, 'TIM2_CH4'), (2, 'TIM5_CH4'), (3, 'TIM9_CH2'), (7, 'USART2_RX'), ),
+  ('PA4', (5, 'SPI1_NSS'), (6, 'SPI3_NSS'), ),
+  ('PA5', (1, 'TIM2_CH1'), (1, 'TIM2_ETR'), (5, 'SPI1_SCK'), ),
+  ('PA6', (1, 'TIM1_BKIN'), (2, 'TIM3_CH1'), (5, 'SPI1_MISO'), ),
+  ('PA7', (1, 'TIM1_CH1N'), (2, 'TIM3_CH2'), (5, 'SPI1_MOSI'), ),
+  ('PA8', (1, 'TIM1_CH1'), (4, 'I2C3_SCL'), (7, 'USART1_CK'), ),
+  ('PA9', (1, 'TIM1_CH2'), (4, 'I2C3_SMBA'), (7, 'USART1_TX'), ),
+  ('PA10', (1, 'TIM1_CH3'), (7, 'USART1_RX'), ),
+  ('PA11', (1, 'TIM1_CH4'), (7, 'USART1_CTS'), ),
+  ('PA12', (1, 'TIM1_ETR'), (7, 'USART1_RTS'), ),
+  ('PA15', (1, 'TIM2_CH1'), (1, 'TIM2_ETR'), (5, 'SPI1_NSS'), ),
+  ('PB0', (1, 'TIM1_CH2N'), (2, 'TIM3_CH3'), ),
+  ('PB1', (1, 'TIM1_CH3N'), (2, 'TIM3_CH4'), ),
+  ('PB2', ),
+  ('PB3', (1, 'TIM2_CH2'), (5, 'SPI1_SCK'), ),
+  ('PB4', (2, 'TIM3_CH1'), (5, 'SPI1_MISO'), ),
+  ('PB5', (2, 'TIM3_CH2'), (5, 'SPI1_MOSI'), ),
+  ('PB6', (2, 'TIM4_CH1'), (4, 'I2C1_SCL'), (7, 'USART1_TX'), ),
+  ('PB7', (2, 'TIM4_CH2'), (4, 'I2C1_SDA'), (7, 'USART1_RX'), ),
+  ('PB8', (2, 'TIM4_CH3'), (3, 'TIM10_CH1'), (4, 'I2C1_SCL'), ),
+  ('PB9', (2, 'TIM4_CH4'), (3, 'TIM11_CH1'), (4, 'I2C1_SDA'), ),
+  ('PB10', (1, 'TIM2_CH3'), (4, 'I2C2_SCL'), ),
+  ('PB12', (1, 'TIM1_BKIN'), (5, 'SPI2_NSS'), ),
+  ('PB13', (1, 'TIM1_CH1N'), (5, 'SPI2_SCK'), ),
+  ('PB14', (1, 'TIM1_CH2N'), (5, 'SPI2_MISO'), ),
+  ('PB15', (1, 'TIM1_CH3N'), (5, 'SPI2_MOSI'), ),
+  ('PC0', ),
+  ('PC1', ),
+  ('PC2', (5, 'SPI2_MISO'), ),
+  ('PC3', (5, 'SPI2_MOSI'), ),
+  ('PC4', ),
+  ('PC5', ),
+  ('PC6', (2, 'TIM3_CH1'), (8, 'USART6_TX'), ),
+  ('PC7', (2, 'TIM3_CH2'), (8, 'USART6_RX'), ),
+  ('PC8', (2, 'TIM3_CH3'), (8, 'USART6_CK'), ),
+  ('PC9', (2, 'TIM3_CH4'), (4, 'I2C3_SDA'), ),
+  ('PC10', (6, 'SPI3_SCK'), ),
+  ('PC11', (6, 'SPI3_MISO'), ),
+  ('PC12', (6, 'SPI3_MOSI'), ),
+  ('PC13', ),
+  ('PC14', ),
+  ('PC15', ),
+)
@@ -0,0 +1,564 @@
+"""Stand-in for the micropython pyb module, for running drivers on CPython.
+
+Put the sim directory at the front of sys.path to use it. Pin names
+follow a NUCLEO_F401RE, so both cpu names ('A5') and Arduino header
+names ('D13') work.
+
+Time comes from the virtual clock in simclock: micros() and friends
+read it, udelay() and delay() advance it, and timers with callbacks
+fire as it passes: timer callbacks at each update, channel callbacks
+at their compare match within the period. Pin changes and timer
+compare changes are logged to clock.log. Pin.drive() sets the level
+of a pin from outside, as a sensor would, firing any ExtInt on it."""
+
+from simclock import clock
+
+MICROS_MASK = 0x3fffffff
+
+# Arduino header name -> cpu pin name
+BOARD = dict(D0='A3', D1='A2', D2='A10', D3='B3', D4='B5', D5='B4',
+             D6='B10', D7='A8', D8='A9', D9='C7', D10='B6', D11='A7',
+             D12='A6', D13='A5', D14='B9', D15='B8',
+             A0='A0', A1='A1', A2='A4', A3='B0', A4='C1', A5='C0')
+
+
+def micros():
+    return int(clock.now) & MICROS_MASK
+
+
+def millis():
+    return int(clock.now // 1000) & MICROS_MASK
+
+
+def elapsed_micros(start):
+    return (micros() - start) & MICROS_MASK
+
+
+def elapsed_millis(start):
+    return (millis() - start) & MICROS_MASK
+
+
+def udelay(us):
+    clock.advance(us)
+
+
+def delay(ms):
+    clock.advance(1000 * ms)
+
+
+def disable_irq():
+    state, clock.irq_enabled = clock.irq_enabled, False
+    return state
+
+
+def enable_irq(state=True):
+    clock.irq_enabled = state
+    if state and clock.held:
+        clock.enable()
+
+
+def reset():
+    """Simulator only: forget all pins and timers, and reset the clock."""
+
+    Pin._pins.clear()
+    _timers.clear()
+    clock.reset()
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OUT_PP = 1
+    OUT_OD = 0x11
+    AF_PP = 2
+    AF_OD = 0x12
+    ALT = 2
+    ANALOG = 3
+    PULL_NONE = 0
+    PULL_UP = 1
+    PULL_DOWN = 2
+
+    # Like pyb, there's one Pin object per pin.
+    _pins = {}
+
+    def __new__(cls, name, *args, **kwargs):
+        if isinstance(name, Pin):
+            return name
+        name = BOARD.get(name, name)
+        if name.startswith('P') and len(name) > 2:
+            name = name[1:]
+        pin = cls._pins.get(name)
+        if pin is None:
+            pin = cls._pins[name] = object.__new__(cls)
+            pin._name = name
+            pin._value = 0
+            pin._mode = Pin.IN
+            pin._pull = Pin.PULL_NONE
+            pin._alt = -1
+            pin._irq = None
+            pin._captures = []
+        return pin
+
+    def __init__(self, name, mode=-1, pull=-1, value=None, alt=-1):
+        if mode != -1:
+            self.init(mode, pull, value=value, alt=alt)
+
+    def __repr__(self):
+        return 'Pin(Pin.cpu.%s)' % self._name
+
+    @classmethod
+    def at(cls, port, pin):
+        """Simulator only: the pin for a port and pin number."""
+
+        return cls('%c%d' % (ord('A') + port, pin))
+
+    def init(self, mode=IN, pull=PULL_NONE, value=None, alt=-1):
+        self._mode = mode
+        self._pull = pull
+        self._alt = alt
+        if value is not None:
+            self.value(value)
+
+    def name(self):
+        return self._name
+
+    def port(self):
+        return ord(self._name[0]) - ord('A')
+
+    def pin(self):
+        return int(self._name[1:])
+
+    def af(self):
+        return self._alt
+
+    def mode(self):
+        return self._mode
+
+    def pull(self):
+        return self._pull
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._set(1 if value else 0)
+
+    def on(self):
+        self._set(1)
+
+    def off(self):
+        self._set(0)
+
+    high = on
+    low = off
+
+    def _set(self, value):
+        if value != self._value:
+            self._value = value
+            clock.record(self._name, value)
+            for ch in self._captures:
+                ch._edge(value)
+
+    def drive(self, value):
+        """Simulator only: set the pin level from outside."""
+
+        old = self._value
+        self._set(1 if value else 0)
+        if self._irq is not None and old != self._value:
+            self._irq._edge(self._value)
+
+
+class ExtInt:
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+    IRQ_RISING_FALLING = 3
+    EVT_RISING = 5
+    EVT_FALLING = 6
+    EVT_RISING_FALLING = 7
+
+    def __init__(self, pin, mode, pull, callback):
+        self._pin = Pin(pin)
+        self._pin.init(Pin.IN, pull)
+        self._mode = mode
+        self._callback = callback
+        self._enabled = True
+        self._pin._irq = self
+
+    def _edge(self, value):
+        if self._enabled and self._mode & (1 if value else 2):
+            clock.irq(self._callback, self.line())
+
+    def disable(self):
+        self._enabled = False
+
+    def enable(self):
+        self._enabled = True
+
+    def line(self):
+        return self._pin.pin()
+
+    def swint(self):
+        clock.irq(self._callback, self.line())
+
+
+# Timers with 32 bit counters on the F401, and all that exist.
+_WIDE = (2, 5)
+_TIMERS = (1, 2, 3, 4, 5, 9, 10, 11)
+
+# Like pyb, one Timer object per timer.
+_timers = {}
+
+
+class Timer:
+    PWM = 0
+    PWM_INVERTED = 1
+    OC_TIMING = 2
+    OC_ACTIVE = 3
+    OC_INACTIVE = 4
+    OC_TOGGLE = 5
+    OC_FORCED_ACTIVE = 6
+    OC_FORCED_INACTIVE = 7
+    IC = 8
+    ENC_A = 9
+    ENC_B = 10
+    ENC_AB = 11
+    UP = 0
+    DOWN = 1
+    CENTER = 2
+    HIGH = 0
+    LOW = 2
+    RISING = 0
+    FALLING = 2
+    BOTH = 10
+
+    source = 84000000
+
+    def __new__(cls, id, **kwargs):
+        if id not in _TIMERS:
+            raise ValueError('Timer(%d) does not exist' % id)
+        timer = _timers.get(id)
+        if timer is None:
+            timer = _timers[id] = object.__new__(cls)
+            timer._id = id
+            timer._channels = {}
+            timer._callback = None
+            timer._prescaler = 0
+            timer._period = 0xffff
+            timer._start = 0.0
+            timer._next = None
+            timer._running = False
+            timer._encoded = None
+        return timer
+
+    def __init__(self, id, **kwargs):
+        if kwargs:
+            self.init(**kwargs)
+
+    def __repr__(self):
+        return 'Timer(%d)' % self._id
+
+    def init(self, freq=None, prescaler=None, period=None, mode=UP, div=1,
+             callback=None, deadtime=0):
+        if freq is not None:
+            ticks = max(1, round(self.source / freq))
+            limit = 0xffffffff if self._id in _WIDE else 0xffff
+            prescaler = 1
+            while ticks // prescaler > limit + 1:
+                prescaler += 1
+            self._prescaler = prescaler - 1
+            self._period = round(ticks / prescaler) - 1
+        else:
+            self._prescaler = prescaler or 0
+            self._period = period if period is not None else 0xffff
+        self._start = clock.now
+        self._running = True
+        self._next = None
+        if callback is not None:
+            self.callback(callback)
+        self._schedule()
+
+    def deinit(self):
+        self._callback = None
+        for ch in self._channels.values():
+            ch._listen(None)
+        self._channels = {}
+        self._running = False
+        self._encoded = None
+        self._schedule()
+
+    def callback(self, fun):
+        self._callback = fun
+        self._schedule()
+
+    def channel(self, channel, mode=None, pin=None, pulse_width=None,
+                pulse_width_percent=None, compare=None, polarity=None,
+                callback=None):
+        if mode is None:
+            return self._channels.get(channel)
+        old = self._channels.get(channel)
+        if old is not None:
+            old._listen(None)
+        ch = TimerChannel(self, channel, mode, pin, polarity)
+        self._channels[channel] = ch
+        if mode in (Timer.ENC_A, Timer.ENC_B, Timer.ENC_AB):
+            self._encoded = 0
+        if pulse_width is not None:
+            ch.pulse_width(pulse_width)
+        elif pulse_width_percent is not None:
+            ch.pulse_width_percent(pulse_width_percent)
+        elif compare is not None:
+            ch.compare(compare)
+        if callback is not None:
+            ch.callback(callback)
+        return ch
+
+    def ticks(self):
+        """Simulator only: timer ticks since the timer was started."""
+
+        return int((clock.now - self._start) * self.source
+                   / (self._prescaler + 1) / 1000000)
+
+    def counter(self, value=None):
+        if self._encoded is not None:
+            if value is None:
+                return self._encoded % (self._period + 1)
+            self._encoded = value
+            return
+        if value is None:
+            return self.ticks() % (self._period + 1)
+        self._start = clock.now - value * (self._prescaler + 1) \
+            * 1000000 / self.source
+
+    def encode(self, counts):
+        """Simulator only: count encoder edges, in encoder mode."""
+
+        self._encoded += counts
+
+    def freq(self, value=None):
+        if value is None:
+            return self.source / (self._prescaler + 1) / (self._period + 1)
+        self.init(freq=value)
+
+    def period(self, value=None):
+        if value is None:
+            return self._period
+        self._period = value
+
+    def prescaler(self, value=None):
+        if value is None:
+            return self._prescaler
+        self._prescaler = value
+
+    def source_freq(self):
+        return self.source
+
+    # The clock calls these to fire our callbacks once per period.
+    def _ccmr(self, first, value=None):
+        """Simulator only: get/set the input selection bits of the
+        CCMR register for channels first and first + 1.
+
+        Selection 1 captures the channel's own pin and 2 its
+        partner's, so one pin can be captured by both channels."""
+
+        if value is None:
+            bits = 0
+            for n, shift in ((first, 0), (first + 1, 8)):
+                ch = self._channels.get(n)
+                if ch is not None and ch._mode == Timer.IC:
+                    bits |= ch._select << shift
+            return bits
+        for n, shift, other in ((first, 0, first + 1), (first + 1, 8, first)):
+            ch = self._channels.get(n)
+            if ch is None or ch._mode != Timer.IC:
+                continue
+            ch._select = value >> shift & 3
+            source = ch if ch._select == 1 else self._channels.get(other)
+            ch._listen(source._pin if source is not None
+                       and ch._select in (1, 2) else None)
+
+    def _interval(self):
+        return (self._prescaler + 1) * (self._period + 1) * 1000000 / self.source
+
+    def _wanted(self):
+        return self._running and (self._callback is not None or any(
+            ch._callback is not None for ch in self._channels.values()))
+
+    def _schedule(self):
+        if self._wanted():
+            if self._next is None:
+                self._next = clock.now + self._interval()
+            if self not in clock.tickers:
+                clock.tickers.append(self)
+        else:
+            self._next = None
+            if self in clock.tickers:
+                clock.tickers.remove(self)
+
+    def due(self):
+        event = self._compare_event()
+        return event[0] if event else self._next
+
+    def _position(self):
+        """Ticks into the current period, as a float."""
+
+        tick = (self._prescaler + 1) * 1000000 / self.source
+        return (clock.now - self._next + self._interval()) / tick
+
+    def _compare_event(self):
+        """The (time, channel) of the next compare match with a callback
+        before the next update, or None."""
+
+        best = None
+        if self._next is None:
+            return None
+        tick = (self._prescaler + 1) * 1000000 / self.source
+        start = self._next - self._interval()
+        for ch in self._channels.values():
+            if ch._callback is None or ch._matched \
+               or ch._compare > self._period or ch._mode == Timer.IC:
+                continue
+            due = start + ch._compare * tick
+            if due < self._next and (best is None or due < best[0]):
+                best = (due, ch)
+        return best
+
+    def fire(self):
+        event = self._compare_event()
+        if event is not None:
+            # A compare match, part way through the period.
+            ch = event[1]
+            ch._matched = True
+            clock.irq(ch._callback, self)
+            return
+        self._next += self._interval()
+        for ch in self._channels.values():
+            ch._matched = False
+        if self._callback is not None:
+            clock.irq(self._callback, self)
+        if not self._wanted():
+            self._schedule()
+
+
+class TimerChannel:
+    def __init__(self, timer, channel, mode, pin, polarity=None):
+        self._timer = timer
+        self._channel = channel
+        self._mode = mode
+        self._pin = pin
+        self._compare = 0
+        self._callback = None
+        # Input capture: the edges to capture, the CCMR input selection
+        # and the pin captured.
+        self._polarity = Timer.RISING if polarity is None else polarity
+        self._select = 1 if mode == Timer.IC else 0
+        self._input = None
+        if mode == Timer.IC:
+            self._listen(Pin(pin) if pin is not None else None)
+        # Set once the compare has matched this period.
+        self._matched = False
+        self._name = 'TIM%d_CH%d' % (timer._id, channel)
+        # Writes of values that would be boxed on micropython.
+        self.float_writes = 0
+
+    def __repr__(self):
+        return 'TimerChannel(timer=%d, channel=%d)' % (self._timer._id,
+                                                      self._channel)
+
+    def callback(self, fun):
+        self._callback = fun
+        self._timer._schedule()
+
+    def _listen(self, pin):
+        """Capture edges on pin, or stop capturing if it's None."""
+
+        if self._input is not None:
+            self._input._captures.remove(self)
+        self._input = pin
+        if pin is not None:
+            pin._captures.append(self)
+
+    def _edge(self, value):
+        """A level change on the captured pin."""
+
+        if self._polarity == Timer.BOTH or \
+           (self._polarity == Timer.FALLING) == (value == 0):
+            self._compare = self._timer.counter()
+            if self._callback is not None:
+                clock.irq(self._callback, self._timer)
+
+    def capture(self, value=None):
+        return self.compare(value)
+
+    def compare(self, value=None):
+        if value is None:
+            return self._compare
+        if not isinstance(value, int):
+            self.float_writes += 1
+        self._write(int(value))
+
+    def pulse_width(self, value=None):
+        return self.compare(value)
+
+    def pulse_width_percent(self, value=None):
+        period = self._timer._period + 1
+        if value is None:
+            return 100 * self._compare / period
+        if not isinstance(value, int):
+            self.float_writes += 1
+        self._write(min(period, round(period * value / 100)))
+
+    def _write(self, value):
+        if value != self._compare:
+            self._compare = value
+            clock.record(self._name, value)
+            # As on hardware, a compare ahead of the counter matches
+            # later this period, and one behind it waits for the next.
+            timer = self._timer
+            if timer._next is not None:
+                self._matched = value <= timer._position()
+
+
+class SPI:
+    """An SPI bus, shifting bytes out on its SCK and MOSI pins.
+
+    Each bit shows up in the clock log as pin transitions, and a send
+    takes as long as it would at the baud rate."""
+
+    MASTER = 0
+    SLAVE = 1
+    MSB = 0
+    LSB = 0x80
+
+    # Bus -> (SCK, MOSI) cpu pin names.
+    _BUSES = {1: ('A5', 'A7'), 2: ('B13', 'B15'), 3: ('C10', 'C12')}
+
+    def __init__(self, bus, mode=MASTER, baudrate=328125, polarity=1,
+                 phase=0, bits=8, firstbit=MSB, **kwargs):
+        if bus not in self._BUSES:
+            raise ValueError('SPI(%d) does not exist' % bus)
+        self._bus = bus
+        self.init(mode, baudrate, polarity, phase, bits, firstbit)
+
+    def init(self, mode=MASTER, baudrate=328125, polarity=1, phase=0, bits=8,
+             firstbit=MSB, **kwargs):
+        self._baudrate = baudrate
+        self._polarity = polarity
+        self._bits = bits
+        self._firstbit = firstbit
+        self._sck, self._mosi = (Pin(name) for name in self._BUSES[self._bus])
+        self._sck._set(polarity)
+
+    def deinit(self):
+        pass
+
+    def send(self, data, timeout=5000):
+        if isinstance(data, int):
+            data = (data,)
+        order = range(self._bits) if self._firstbit == self.LSB \
+            else range(self._bits - 1, -1, -1)
+        idle = self._polarity
+        for byte in data:
+            for bit in order:
+                self._mosi._set(byte >> bit & 1)
+                self._sck._set(1 - idle)
+                self._sck._set(idle)
+        clock.advance(len(data) * self._bits * 1000000 / self._baudrate)
@@ -0,0 +1,122 @@
+"""The simulator's virtual clock.
+
+Time only moves when something advances it: udelay/delay in the
+simulated pyb, or a test or benchmark calling advance(). While it
+advances, timer callbacks and scheduled actions fire in time order,
+so runs are repeatable. Interrupts raised while they're disabled are
+held, and run when they're enabled again. Every pin transition and timer compare change
+is recorded in log as (time in µs, source, value), unless logging is
+turned off, as the benchmarks do."""
+
+
+class Clock:
+    def __init__(self):
+        self.logging = True
+        self.reset()
+
+    def reset(self):
+        """Back to time 0, with nothing scheduled or logged."""
+
+        self.now = 0.0
+        self.log = []
+        self.tickers = []
+        self.actions = []
+        self._seq = 0
+        self.pending = []
+        self.in_irq = False
+        self.irq_enabled = True
+        self.held = []
+
+    def micros(self):
+        return int(self.now)
+
+    def record(self, source, value):
+        if self.logging:
+            self.log.append((int(self.now), source, value))
+
+    def trace(self, source):
+        """The (time, value) log entries for source."""
+
+        return [(t, v) for t, s, v in self.log if s == source]
+
+    def after(self, delay, fun, *args):
+        """Call fun(*args) delay µs from now, as if from an interrupt."""
+
+        self._seq += 1
+        self.actions.append((self.now + delay, self._seq, fun, args))
+        self.actions.sort(key=lambda a: (a[0], a[1]))
+
+    def schedule(self, fun, arg):
+        """Queue fun(arg) to run once the current interrupt is done."""
+
+        self.pending.append((fun, arg))
+        if not self.in_irq:
+            self.run_pending()
+
+    def run_pending(self):
+        while self.pending:
+            fun, arg = self.pending.pop(0)
+            fun(arg)
+
+    def irq(self, fun, *args):
+        """Run fun(*args) as an interrupt handler.
+
+        While interrupts are disabled it's held pending instead, and
+        runs once they're enabled, as on hardware. Like a pending flag,
+        raising the same one again while it's held runs it only once."""
+
+        if not self.irq_enabled:
+            if (fun, args) not in self.held:
+                self.held.append((fun, args))
+            return
+        nested, self.in_irq = self.in_irq, True
+        try:
+            fun(*args)
+        finally:
+            self.in_irq = nested
+        if not nested:
+            self.run_pending()
+
+    def enable(self, state=True):
+        """Enable or disable interrupts, running any held on enabling."""
+
+        self.irq_enabled = state
+        while self.irq_enabled and self.held:
+            fun, args = self.held.pop(0)
+            self.irq(fun, *args)
+
+    def _next(self):
+        """The time of the next event and how to run it, or None."""
+
+        best = None
+        for ticker in self.tickers:
+            due = ticker.due()
+            if due is not None and (best is None or due < best[0]):
+                best = (due, ticker.fire)
+        if self.actions and (best is None or self.actions[0][0] <= best[0]):
+            due, _, fun, args = self.actions[0]
+            return due, lambda: (self.actions.pop(0), self.irq(fun, *args))
+        return best
+
+    def advance(self, us):
+        """Move the clock forward us µs, firing anything due.
+
+        Inside an interrupt handler, time passes but other interrupts
+        wait until the handler is done, as they would on hardware."""
+
+        if self.in_irq:
+            self.now += us
+        else:
+            self.run_until(self.now + us)
+
+    def run_until(self, end):
+        while True:
+            event = self._next()
+            if event is None or event[0] > end:
+                break
+            self.now = max(self.now, event[0])
+            event[1]()
+        self.now = max(self.now, end)
+
+
+clock = Clock()
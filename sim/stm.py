@@ -0,0 +1,168 @@
+"""Stand-in for the micropython stm module, for running drivers on CPython.
+
+mem8, mem16 and mem32 are backed by a simulated memory map. GPIO
+registers read and write the simulated pyb pins (so BSRR writes show
+up as pin transitions in the clock log), and timer CCR, CNT, ARR and
+PSC registers read and write the simulated pyb timers, as do the
+input selection bits of CCMR. Anything else is plain storage."""
+
+import pyb
+
+GPIOA = 0x40020000
+GPIOB = 0x40020400
+GPIOC = 0x40020800
+GPIOD = 0x40020c00
+GPIOE = 0x40021000
+GPIOH = 0x40021c00
+
+GPIO_MODER = 0x00
+GPIO_OTYPER = 0x04
+GPIO_OSPEEDR = 0x08
+GPIO_PUPDR = 0x0c
+GPIO_IDR = 0x10
+GPIO_ODR = 0x14
+GPIO_BSRR = 0x18
+GPIO_LCKR = 0x1c
+GPIO_AFR0 = 0x20
+GPIO_AFR1 = 0x24
+
+TIM2 = 0x40000000
+TIM3 = 0x40000400
+TIM4 = 0x40000800
+TIM5 = 0x40000c00
+TIM1 = 0x40010000
+TIM9 = 0x40014000
+TIM10 = 0x40014400
+TIM11 = 0x40014800
+
+TIM_CR1 = 0x00
+TIM_CR2 = 0x04
+TIM_SMCR = 0x08
+TIM_DIER = 0x0c
+TIM_SR = 0x10
+TIM_EGR = 0x14
+TIM_CCMR1 = 0x18
+TIM_CCMR2 = 0x1c
+TIM_CCER = 0x20
+TIM_CNT = 0x24
+TIM_PSC = 0x28
+TIM_ARR = 0x2c
+TIM_CCR1 = 0x34
+TIM_CCR2 = 0x38
+TIM_CCR3 = 0x3c
+TIM_CCR4 = 0x40
+
+_TIMER_BASES = {TIM1: 1, TIM2: 2, TIM3: 3, TIM4: 4, TIM5: 5,
+                TIM9: 9, TIM10: 10, TIM11: 11}
+_GPIO_SIZE = GPIOB - GPIOA
+
+
+def _gpio(addr):
+    """Return (port, register offset) if addr is a GPIO register."""
+
+    if GPIOA <= addr < GPIOA + 8 * _GPIO_SIZE:
+        return (addr - GPIOA) // _GPIO_SIZE, (addr - GPIOA) % _GPIO_SIZE
+    return None
+
+
+def _timer(addr):
+    """Return (pyb.Timer, register offset) if addr is a timer register."""
+
+    number = _TIMER_BASES.get(addr & ~0x3ff)
+    if number is None:
+        return None
+    return pyb.Timer(number), addr & 0x3ff
+
+
+class Mem:
+    def __init__(self, width):
+        self.mask = (1 << width) - 1
+        self.writes = 0
+
+    def __getitem__(self, addr):
+        gpio = _gpio(addr)
+        if gpio is not None:
+            port, reg = gpio
+            if reg in (GPIO_IDR, GPIO_ODR):
+                return sum(pyb.Pin.at(port, n).value() << n for n in range(16)
+                           if _exists(port, n))
+        timer = _timer(addr)
+        if timer is not None:
+            timer, reg = timer
+            if TIM_CCR1 <= reg <= TIM_CCR4:
+                ch = timer.channel((reg - TIM_CCR1) // 4 + 1)
+                return ch.compare() if ch else _memory.get(addr, 0)
+            if reg in (TIM_CCMR1, TIM_CCMR2):
+                return timer._ccmr(1 if reg == TIM_CCMR1 else 3)
+            if reg == TIM_CNT:
+                return timer.counter()
+            if reg == TIM_ARR:
+                return timer.period()
+            if reg == TIM_PSC:
+                return timer.prescaler()
+        return _memory.get(addr, 0) & self.mask
+
+    def __setitem__(self, addr, value):
+        self.writes += 1
+        value &= self.mask
+        gpio = _gpio(addr)
+        if gpio is not None:
+            port, reg = gpio
+            if reg == GPIO_BSRR:
+                pins = pyb.Pin._pins
+                for name, level in _bsrr(port, value):
+                    pin = pins.get(name)
+                    (pin or pyb.Pin(name))._set(level)
+                return
+            if reg == GPIO_ODR:
+                for n in range(16):
+                    if _exists(port, n):
+                        pyb.Pin.at(port, n).value(value & (1 << n))
+                return
+        timer = _timer(addr)
+        if timer is not None:
+            timer, reg = timer
+            if TIM_CCR1 <= reg <= TIM_CCR4:
+                ch = timer.channel((reg - TIM_CCR1) // 4 + 1)
+                if ch:
+                    ch.compare(value)
+                    return
+            elif reg in (TIM_CCMR1, TIM_CCMR2):
+                return timer._ccmr(1 if reg == TIM_CCMR1 else 3, value)
+            elif reg == TIM_CNT:
+                return timer.counter(value)
+            elif reg == TIM_ARR:
+                return timer.period(value)
+            elif reg == TIM_PSC:
+                return timer.prescaler(value)
+        _memory[addr] = value
+
+
+_bsrr_cache = {}
+
+
+def _bsrr(port, value):
+    """The (pin name, level) changes a BSRR write makes."""
+
+    changes = _bsrr_cache.get((port, value))
+    if changes is None:
+        changes = []
+        for n in range(16):
+            name = '%c%d' % (ord('A') + port, n)
+            # Set wins if both bits are given, as on hardware.
+            if value & (1 << n):
+                changes.append((name, 1))
+            elif value & (1 << (n + 16)):
+                changes.append((name, 0))
+        _bsrr_cache[port, value] = changes
+    return changes
+
+
+def _exists(port, n):
+    return ('%c%d' % (ord('A') + port, n)) in pyb.Pin._pins
+
+
+_memory = {}
+mem8 = Mem(8)
+mem16 = Mem(16)
+mem32 = Mem(32)
@@ -0,0 +1,282 @@
+"""Software PWM on any GPIO pin, for pins with no timer channel.
+
+pwm2.PWM needs a pin wired to a timer channel. A SoftPWM can use any
+output pin instead, run by a SoftEngine: one timer counting µs, whose
+update interrupt starts every output's pulse and whose channel 1
+compare interrupt ends them. The pulse ends are kept in one table of
+edges sorted by time, and the pins changing at each are batched into
+one BSRR write per GPIO port, so outputs with the same width share an
+interrupt, and a period costs one interrupt per distinct width plus
+one however many outputs there are.
+
+The table is rebuilt when a width changes, not each period. Changes
+made from interrupt handlers, such as ramps, are merged into one
+rebuild run by micropython.schedule, and the new table takes over at
+the start of the next period, so a pulse is never cut short.
+
+The price is jitter: an edge is late by however long the interrupts
+ahead of it take, where a timer channel's edges are exact. That's fine
+for LEDs and servos, but not for motors. pwm2.output picks a timer
+channel when the pin has one and a SoftPWM when it doesn't."""
+
+import micropython
+import stm
+from pyb import Pin, Timer
+
+from pwm2 import free_timer, reserve, scale, unreserve
+
+GPIO_SIZE = stm.GPIOB - stm.GPIOA
+
+# Timers with a channel 1, to try for engines.
+SOFT_TIMERS = (14, 13, 12, 11, 10, 9, 8, 5, 4, 3, 2, 1)
+
+# Edges due within this many µs of the one being handled, or of the
+# period start, are handled with it, as there isn't time to set up
+# another interrupt for them: its compare would be missed, leaving the
+# pulse on for a whole period.
+GUARD = 8
+
+# The shared engines, by frequency.
+_engines = {}
+
+
+def shared(freq=50):
+    """The shared SoftEngine running at freq Hz, created on first use."""
+
+    soft = _engines.get(freq)
+    if soft is None:
+        soft = _engines[freq] = SoftEngine(freq)
+    return soft
+
+
+def _flatten(writes):
+    """A {address: bits} dict as a flat [address, bits, ...] list."""
+
+    flat = []
+    for address in writes:
+        flat.append(address)
+        flat.append(writes[address])
+    return flat
+
+
+class SoftEngine:
+    """Software PWM outputs at freq Hz, all run from one timer.
+
+    The timer counts µs, so output widths are in µs too, and freq
+    must be at least 16 on a 16 bit timer. If timer is None, a free
+    timer with a channel 1 is picked, otherwise it's a string 'TIM#'."""
+
+    def __init__(self, freq=50, timer=None):
+        self.freq = freq
+        if timer is None:
+            self.timer = free_timer(freq, SOFT_TIMERS)
+        else:
+            self.timer = reserve(int(timer[3:]), freq=freq)
+        self.full = 1000000 // freq
+        self.timer.init(prescaler=self.timer.source_freq() // 1000000 - 1,
+                        period=self.full - 1)
+        self.outputs = []
+
+        # The table in use: the BSRR writes that start a period, the
+        # edge times, ending with one that never comes, and the BSRR
+        # writes for each edge. _next is the table to switch to.
+        self._starts = []
+        self._times = [self.full]
+        self._edges = []
+        self._edge = 0
+        self._next = None
+        self._queued = False
+        self._rebuild = self.rebuild
+        self.channel = self.timer.channel(1, Timer.OC_TIMING,
+                                          compare=self.full,
+                                          callback=self._end)
+        self.timer.callback(self._start)
+
+    def _start(self, timer):
+        """The update callback: switch tables, and start the pulses."""
+
+        table = self._next
+        if table is not None:
+            self._next = None
+            self._starts, self._times, self._edges = table
+        mem, starts = stm.mem32, self._starts
+        for i in range(0, len(starts), 2):
+            mem[starts[i]] = starts[i + 1]
+        self._edge = 0
+        if self._times[0] > timer.counter() + GUARD:
+            self.channel.compare(self._times[0])
+        else:
+            self._end(timer)
+
+    def _end(self, timer):
+        """The compare callback: end the pulses due, and wait for the next."""
+
+        mem, times, edges = stm.mem32, self._times, self._edges
+        edge = self._edge
+        while True:
+            clears = edges[edge]
+            for i in range(0, len(clears), 2):
+                mem[clears[i]] = clears[i + 1]
+            edge += 1
+            if edge == len(edges) or times[edge] > timer.counter() + GUARD:
+                break
+        self._edge = edge
+        self.channel.compare(times[edge])
+
+    def add(self, output):
+        """Start running output, a SoftPWM."""
+
+        self.outputs.append(output)
+        self.changed()
+
+    def remove(self, output):
+        """Stop running output, leaving its pin low."""
+
+        self.outputs.remove(output)
+        stm.mem32[output.bsrr] = output.bit << 16
+        self.changed()
+
+    def changed(self):
+        """Queue a rebuild, merged with any other changes before it runs."""
+
+        if not self._queued:
+            self._queued = True
+            micropython.schedule(self._rebuild, None)
+
+    def rebuild(self, _=None):
+        """Build the table from the outputs' widths.
+
+        Outputs at 0 are cleared at the start of each period, which
+        costs nothing extra as their port is usually written anyway.
+        The new table is used from the start of the next period."""
+
+        self._queued = False
+        full = self.full
+        starts, ends = {}, {}
+        for output in self.outputs:
+            width, bsrr, bit = output.width, output.bsrr, output.bit
+            if width <= 0:
+                starts[bsrr] = starts.get(bsrr, 0) | bit << 16
+                continue
+            starts[bsrr] = starts.get(bsrr, 0) | bit
+            if width < full:
+                clears = ends.setdefault(width, {})
+                clears[bsrr] = clears.get(bsrr, 0) | bit << 16
+        times = sorted(ends)
+        self._next = (_flatten(starts), times + [full],
+                      [_flatten(ends[time]) for time in times])
+
+    def deinit(self):
+        """Stop the engine, leaving all its pins low."""
+
+        self.timer.callback(None)
+        self.channel.callback(None)
+        for output in self.outputs:
+            stm.mem32[output.bsrr] = output.bit << 16
+        unreserve(self.timer)
+        if _engines.get(self.freq) is self:
+            del _engines[self.freq]
+
+
+class SoftPWM:
+    """A PWM output on any pin, run by a SoftEngine.
+
+    It has the same methods as pwm2.PWM, so it can stand in for one,
+    but the timer ticks are µs, so self.full is the length. Either
+    length or freq sets the pulse length, as for PWM, and defaults
+    to 50Hz. engine is the SoftEngine to use, by default the shared
+    one for the frequency (see shared()).
+
+    Widths are only exact to GUARD µs: a pulse end within GUARD of the
+    one before it, or of the period start, is made with it, up to
+    GUARD µs early. So widths below GUARD come out as glitches of no
+    width, and outputs whose widths are within GUARD of each other end
+    together. Each end is also late by the interrupt latency, as
+    described above."""
+
+    def __init__(self, pin, length=None, freq=None, engine=None):
+        if length:
+            freq = round(1000000 / length)
+        elif not freq:
+            freq = 50
+        if engine is None:
+            engine = shared(freq)
+        self.engine = engine
+        self.timer = engine.timer
+        self.length = self.full = full = engine.full
+        pin.init(Pin.OUT)
+        self.bsrr = stm.GPIOA + GPIO_SIZE * pin.port() + stm.GPIO_BSRR
+        self.bit = 1 << pin.pin()
+        self.width = 0
+        self._ramps = None
+        self._ramped = False
+        self._write = self._set
+        self._u16 = scale(full, 0x10000, 0xffff)
+        self._from_ticks = scale(0x10000, full, full)
+        engine.add(self)
+
+    def ticks(self, width):
+        """Convert a width in microseconds to timer ticks, which are µs."""
+
+        return int(width)
+
+    def _set(self, ticks):
+        ticks = max(0, min(ticks, self.full))
+        if ticks != self.width:
+            self.width = ticks
+            self.engine.changed()
+
+    def _cancel(self):
+        if self._ramped:
+            self._ramped = False
+            self._ramps.cancel(self)
+
+    def deinit(self):
+        """Stop this output, leaving the pin low."""
+
+        self._cancel()
+        self.engine.remove(self)
+
+    def duty(self, percentage=None):
+        """Get/Set the duty cycle as a percentage."""
+
+        if percentage is None:
+            return round(100 * self.width / self.full)
+        self._cancel()
+        self._set(int(self.full * max(0, min(percentage, 100)) // 100))
+
+    def duty_u16(self, value=None):
+        """Get/Set the duty cycle as an int from 0 to 65535."""
+
+        if value is None:
+            mul, shift = self._from_ticks
+            return min(self.width * mul >> shift, 0xffff)
+        self._cancel()
+        mul, shift = self._u16
+        self._set(self.full if value >= 0xffff else max(0, value) * mul >> shift)
+
+    def pulse_width_ticks(self, ticks=None):
+        """Get/Set the pulse width in timer ticks, from 0 to self.full."""
+
+        if ticks is None:
+            return self.width
+        if self._ramped:
+            self._cancel()
+        self._set(ticks)
+
+    def pulse_width(self, width=None, time=0, profile=0):
+        """Get/Set the pulse width in microseconds, as pwm2.PWM does."""
+
+        if width is None:
+            return self.width
+        target = round(min(width, self.length))
+        if time == 0:
+            self._cancel()
+            self._set(target)
+        else:
+            if self._ramps is None:
+                from ramp import scheduler
+                self._ramps = scheduler()
+            self._ramped = True
+            self._ramps.start(self, self._write, self.width, target, time,
+                              profile)
@@ -0,0 +1,203 @@
+"""Opt-in counters and latency histograms for the drivers.
+
+Instrumentation is off unless enable() is called before the drivers
+are created. Each driver asks attach() for a Stats object, and gets
+None when it's off, so the only cost then is an `is not None` test on
+each instrumented path. When it's on, the drivers count events (calls,
+bogus echoes, timeouts, ramp steps and so on) and time their hot
+paths with micros() into histograms. Neither allocates, so both work
+in interrupt handlers.
+
+Histograms have BUCKETS fixed buckets by powers of two: bucket 0
+counts 0µs, bucket n counts 2**(n-1) to 2**n - 1µs, and the last one
+also counts anything longer. Buckets stop counting at 65535.
+
+snapshot() packs every driver's numbers into a few hundred bytes,
+which dump() writes to a file to copy off a board. decode() turns a
+snapshot back into python objects, and report() prints one, on the
+board or on a host."""
+
+from array import array
+
+try:
+    import struct
+except ImportError:
+    import ustruct as struct
+
+from pyb import elapsed_micros
+
+BUCKETS = 16
+MAGIC = b'ST\x01'
+
+_enabled = False
+_attached = []
+
+
+class Stats:
+    """The counters and histograms for one driver.
+
+    counters and timers are lists of names. Drivers refer to them by
+    index, with constants for the indices."""
+
+    def __init__(self, name, counters=(), timers=()):
+        self.name = name
+        self.counters = tuple(counters)
+        self.timers = tuple(timers)
+        self.counts = array('L', [0] * len(self.counters))
+        self.histograms = array('H', [0] * (BUCKETS * len(self.timers)))
+
+    def count(self, counter, n=1):
+        """Add n to counter."""
+
+        self.counts[counter] += n
+
+    def time(self, timer, start):
+        """Add the µs since start, a micros() value, to timer's histogram."""
+
+        self.add(timer, elapsed_micros(start))
+
+    def add(self, timer, us):
+        """Add a duration of us µs to timer's histogram."""
+
+        bucket = 0
+        while us and bucket < BUCKETS - 1:
+            us >>= 1
+            bucket += 1
+        self.record(timer, bucket)
+
+    def record(self, timer, bucket):
+        """Add one to bucket of timer's histogram."""
+
+        i = timer * BUCKETS + bucket
+        if self.histograms[i] < 0xffff:
+            self.histograms[i] += 1
+
+    def reset(self):
+        """Zero everything."""
+
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        for i in range(len(self.histograms)):
+            self.histograms[i] = 0
+
+
+def enable(on=True):
+    """Turn instrumentation on for drivers created from now on."""
+
+    global _enabled
+    _enabled = on
+
+
+def attach(name, counters=(), timers=()):
+    """A new Stats for a driver, or None if instrumentation is off."""
+
+    if not _enabled:
+        return None
+    stats = Stats(name, counters, timers)
+    _attached.append(stats)
+    return stats
+
+
+def attached():
+    """The Stats of every instrumented driver."""
+
+    return _attached
+
+
+def reset():
+    """Zero every driver's Stats."""
+
+    for stats in _attached:
+        stats.reset()
+
+
+def _pack_name(name):
+    data = name.encode()
+    return bytes((len(data),)) + data
+
+
+def snapshot():
+    """Every driver's Stats, packed into bytes. See decode."""
+
+    parts = [MAGIC, bytes((len(_attached), BUCKETS))]
+    for stats in _attached:
+        parts.append(_pack_name(stats.name))
+        parts.append(bytes((len(stats.counters), len(stats.timers))))
+        for name in stats.counters + stats.timers:
+            parts.append(_pack_name(name))
+        parts.append(struct.pack('<%dL' % len(stats.counts), *stats.counts))
+        parts.append(struct.pack('<%dH' % len(stats.histograms),
+                                 *stats.histograms))
+    return b''.join(parts)
+
+
+def dump(filename='stats.bin'):
+    """Write a snapshot to filename."""
+
+    with open(filename, 'wb') as out:
+        out.write(snapshot())
+
+
+def _unpack_name(data, at):
+    size = data[at]
+    return data[at + 1:at + 1 + size].decode(), at + 1 + size
+
+
+def decode(data):
+    """Unpack a snapshot.
+
+    Returns a list of (name, {counter: count}, {timer: buckets}) for
+    each driver, where buckets is a list of BUCKETS counts."""
+
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a stats snapshot")
+    at = len(MAGIC)
+    drivers, buckets = data[at], data[at + 1]
+    at += 2
+    result = []
+    for _ in range(drivers):
+        name, at = _unpack_name(data, at)
+        counters, timers = data[at], data[at + 1]
+        at += 2
+        names = []
+        for _ in range(counters + timers):
+            label, at = _unpack_name(data, at)
+            names.append(label)
+        counts = struct.unpack_from('<%dL' % counters, data, at)
+        at += 4 * counters
+        histograms = struct.unpack_from('<%dH' % (timers * buckets), data, at)
+        at += 2 * timers * buckets
+        result.append((name, dict(zip(names[:counters], counts)),
+                       {names[counters + i]:
+                        list(histograms[i * buckets:(i + 1) * buckets])
+                        for i in range(timers)}))
+    return result
+
+
+def bucket_label(bucket):
+    """The range of µs counted by bucket, as text."""
+
+    if bucket == 0:
+        return '0'
+    low = 1 << (bucket - 1)
+    if bucket == BUCKETS - 1:
+        return '%d+' % low
+    return '%d-%d' % (low, 2 * low - 1) if low > 1 else '1'
+
+
+def report(data=None):
+    """Print a snapshot, by default a new one."""
+
+    for name, counts, histograms in decode(data or snapshot()):
+        print(name)
+        for counter in counts:
+            print('  %-12s %10d' % (counter, counts[counter]))
+        for timer in histograms:
+            buckets = histograms[timer]
+            total = sum(buckets)
+            print('  %-12s %10d timed' % (timer, total))
+            for bucket, count in enumerate(buckets):
+                if count:
+                    print('    %10sus %8d %5.1f%%' % (bucket_label(bucket),
+                                                      count,
+                                                      100 * count / total))
@@ -0,0 +1,28 @@
+"""Runs the drivers against the simulator in the sim directory."""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'sim'), ROOT]
+
+import commands
+import pyb
+import pwm2
+import ramp
+from simclock import clock
+
+
+@pytest.fixture(autouse=True)
+def sim():
+    """A fresh simulator for each test: no pins, no timers, time 0.
+
+    The timers the drivers were holding go with it, and the default
+    ramp scheduler and command queue."""
+
+    pyb.reset()
+    pwm2._timers.clear()
+    pwm2._scheduler = ramp._scheduler = commands._queue = None
+    return clock
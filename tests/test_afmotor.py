@@ -0,0 +1,165 @@
+from motors.AFMotorShield import AFMotorShieldV1
+
+
+def shield_with_writes():
+    shield = AFMotorShieldV1()
+    written = []
+    write = shield.latch.write
+
+    def record(value):
+        written.append(value)
+        write(value)
+
+    shield.latch.write = record
+    return shield, written
+
+
+def interrupting(sim, shield, handler, *args):
+    """Raise handler as an interrupt in the middle of the next latch write."""
+
+    write = shield.latch.write
+    raised = []
+
+    def hook(value):
+        if not raised:
+            raised.append(value)
+            sim.irq(handler, *args)
+        write(value)
+
+    shield.latch.write = hook
+    return raised
+
+
+def test_step_during_set(sim):
+    """A step landing in the middle of go's latch write loses nothing."""
+
+    shield, written = shield_with_writes()
+    shield.motor(1)
+    stepper = shield.stepper(2)
+    interrupting(sim, shield, stepper._step, 1)
+    shield.go(-50, 1)
+    assert written[-1] == shield.latch_value == shield.latch.value
+    a, b, _ = shield.motor_bits[0]
+    assert shield.latch_value & (a | b) == b
+    assert shield.latch_value & stepper._mask == stepper._table[1]
+
+
+def test_step_during_brake(sim):
+    shield, written = shield_with_writes()
+    shield.motor(1)
+    shield.go(50, 1)
+    stepper = shield.stepper(2)
+    interrupting(sim, shield, stepper._step, -1)
+    shield.brake(1)
+    assert written[-1] == shield.latch_value == shield.latch.value
+    assert shield.latch_value & stepper._mask == stepper._table[-1]
+
+
+
+def test_go_during_step(sim):
+    """A ramp tick landing in a step's latch write waits for it."""
+
+    shield, written = shield_with_writes()
+    shield.acceleration(1000)
+    shield.motor(1)
+    motor = shield.motors[0]
+    stepper = shield.stepper(2)
+    interrupting(sim, shield, motor.drive, -40)
+    stepper._step(1)
+    assert written[-1] == shield.latch_value == shield.latch.value
+    assert shield.latch_value & stepper._mask == stepper._table[1]
+    assert motor._latched() and not motor._forward
+
+
+def test_accel_reverse(sim):
+    """A ramp through zero flips the direction bits, and enables the shield."""
+
+    shield, written = shield_with_writes()
+    shield.acceleration(1)
+    shield.motor(1)
+    motor = shield.motors[0]
+    a, b, _ = shield.motor_bits[0]
+    shield.go(50, 1)
+    sim.advance(100000)
+    assert motor._speed == 50
+    assert shield.en_pin.value() == 1
+    assert shield.latch.value & (a | b) == a
+    shield.go(-50, 1)
+    sim.advance(150000)
+    assert motor._speed == -50
+    assert shield.latch.value & (a | b) == b
+    assert round(motor.pwm.duty()) == 50
+
+
+def stepper_steps(sim, **kwargs):
+    """A stepper, and a log of (time, position) after each of its steps."""
+
+    shield = AFMotorShieldV1()
+    stepper = shield.stepper(1, **kwargs)
+    steps = []
+    write = shield.latch.write
+
+    def record(value):
+        steps.append((sim.micros(), stepper.position()))
+        write(value)
+
+    shield.latch.write = record
+    return stepper, steps
+
+
+def intervals(steps):
+    return [b[0] - a[0] for a, b in zip(steps, steps[1:])]
+
+
+def test_stepper_profile(sim):
+    """Accelerate at accel steps/s/s up to speed, cruise, then slow to
+    stop on the target."""
+
+    stepper, steps = stepper_steps(sim, speed=1000, accel=10000)
+    stepper.move_to(400)
+    assert stepper.moving
+    sim.advance(1000000)
+    assert not stepper.moving
+    assert stepper.position() == 400
+    assert [p for t, p in steps] == list(range(1, 401))
+    waits = intervals(steps)
+    # 1000 steps/s is reached after 1000**2 / (2 * 10000) = 50 steps.
+    assert waits[:45] == sorted(waits[:45], reverse=True)
+    assert all(995 <= wait <= 1005 for wait in waits[55:-55])
+    assert waits[-45:] == sorted(waits[-45:])
+    assert min(waits) >= 995
+    # 0.4s cruising, plus 0.1s for the ramps at half speed.
+    assert 490000 <= steps[-1][0] <= 520000
+
+
+def test_stepper_reverse(sim):
+    """A move back the other way slows to a stop first."""
+
+    stepper, steps = stepper_steps(sim, speed=1000, accel=10000)
+    stepper.move_to(400)
+    sim.advance(200000)
+    turned_at = stepper.position()
+    stepper.move_to(-100)
+    sim.advance(2000000)
+    assert stepper.position() == -100 and not stepper.moving
+    positions = [p for t, p in steps]
+    peak = positions.index(max(positions))
+    assert positions[:peak + 1] == list(range(1, positions[peak] + 1))
+    assert positions[peak:] == list(range(positions[peak], -101, -1))
+    # Stopping from full speed takes about 50 steps.
+    assert 45 <= positions[peak] - turned_at <= 55
+    waits = intervals(steps)
+    assert min(waits) >= 995
+    assert min(waits[peak - 2:peak + 2]) > 3000
+
+
+def test_stepper_stop(sim):
+    stepper, steps = stepper_steps(sim, speed=1000, accel=10000)
+    stepper.move_to(1000)
+    sim.advance(300000)
+    stopped_at = stepper.position()
+    stepper.stop()
+    sim.advance(1000000)
+    assert not stepper.moving
+    assert stepper.position() == stepper.target()
+    assert 45 <= stepper.position() - stopped_at <= 55
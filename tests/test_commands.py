@@ -0,0 +1,85 @@
+import pytest
+
+import commands
+import ramp
+
+
+def recorder(sim):
+    """A setter logging (time, value), and its log."""
+
+    log = []
+
+    def setter(value):
+        log.append((sim.micros(), value))
+
+    return setter, log
+
+
+def test_deadlines(sim):
+    """Commands run in deadline order, within a tick of their time."""
+
+    queue = commands.queue()
+    setter, log = recorder(sim)
+    queue.after(7000, 'a', setter, 'a')
+    queue.after(3000, 'b', setter, 'b')
+    queue.after(3000, 'c', setter, 'c')
+    assert queue.pending() == 3
+    sim.advance(20000)
+    assert [value for t, value in log] == ['b', 'c', 'a']
+    tick = 1000000 // ramp.DEFAULT_FREQ
+    for (t, value), deadline in zip(log, (3000, 3000, 7000)):
+        assert deadline <= t < deadline + tick
+    assert queue.pending() == 0
+    assert not queue.ramps.busy()
+
+
+def test_supersede(sim):
+    queue = commands.queue()
+    setter, log = recorder(sim)
+    # A new command drops the owner's later ones...
+    queue.after(9000, 'servo', setter, 1)
+    queue.after(5000, 'servo', setter, 2)
+    assert queue.pending('servo') == 1
+    # ...and of several due on one tick, only the last runs.
+    queue.after(5100, 'servo', setter, 3)
+    queue.after(20000, 'wheel', setter, 4)
+    sim.advance(10000)
+    assert [value for t, value in log] == [3]
+    queue.cancel('wheel')
+    sim.advance(20000)
+    assert [value for t, value in log] == [3]
+
+
+def test_wrap(sim):
+    """Deadlines past the micros() wrap wait for it."""
+
+    sim.now = commands.MASK - 1000
+    queue = commands.queue()
+    setter, log = recorder(sim)
+    queue.after(3000, 'a', setter, 'a')
+    sim.advance(2000)
+    assert not log
+    sim.advance(4000)
+    assert [value for t, value in log] == ['a']
+
+
+def test_with_ramps(sim):
+    """Commands and ramps share the scheduler's tick."""
+
+    queue = commands.queue()
+    setter, log = recorder(sim)
+    values = []
+    queue.ramps.start(values, values.append, 0, 100, 100)
+    queue.after(50000, 'a', setter, 'a')
+    sim.advance(100000)
+    assert values[-1] == 100 and [value for t, value in log] == ['a']
+
+
+def test_full(sim):
+    queue = commands.Queue(slots=2)
+    queue.after(1000, 'a', abs, 1)
+    queue.after(1000, 'b', abs, 1)
+    with pytest.raises(commands.QueueError):
+        queue.after(1000, 'c', abs, 1)
+    with pytest.raises(commands.QueueError):
+        commands.Queue()
@@ -0,0 +1,76 @@
+import pyb
+import pytest
+from motor import Motor
+
+from motors.curve import UNIT, Curve, calibrate
+from motors.hbridge import HBridge
+
+POINTS = [(10, 40), (50, 70), (100, 100)]
+
+
+def test_endpoints():
+    table = Curve(POINTS).table
+    assert len(table) == 101
+    # Speed 0 always stops, whatever the first point says.
+    assert table[0] == 0
+    assert table[100] == 100 * 100
+    # Flat below the first point.
+    assert list(table[1:11]) == [40 * 100] * 10
+
+
+def test_flat_past_last_point():
+    table = Curve([(20, 30), (80, 90)]).table
+    assert list(table[80:]) == [90 * 100] * 21
+    assert list(table[1:21]) == [30 * 100] * 20
+
+
+def test_interpolation():
+    curve = Curve(POINTS)
+    assert curve.table[30] == 55 * 100
+    assert curve.table[75] == 85 * 100
+    assert curve.duty(-30) == 55
+    assert curve.duty(250) == 100
+
+
+def test_monotonic():
+    table = Curve(POINTS).table
+    assert all(a <= b for a, b in zip(table, table[1:]))
+
+
+def test_clamped():
+    table = Curve([(1, -5), (100, 120)]).table
+    assert min(table) == 0 and max(table) == UNIT
+
+
+def test_one_point():
+    table = Curve([(50, 60)]).table
+    assert table[0] == 0
+    assert set(table[1:]) == {60 * 100}
+
+
+def test_no_points():
+    with pytest.raises(ValueError):
+        Curve([])
+
+
+def test_calibrate():
+    bridge = HBridge(HBridge.RUN_BRAKE, pyb.Pin('PA2'), pyb.Pin('PA3'))
+    motor = Motor(bridge, exponent=0.7)
+
+    def measure():
+        start = motor.count()
+        pyb.delay(100)
+        return (motor.count() - start) * 10
+
+    try:
+        curve = calibrate(bridge, measure)
+    finally:
+        motor.remove()
+    table = curve.table
+    assert curve.mode == HBridge.RUN_BRAKE
+    assert table[0] == 0
+    assert all(a <= b for a, b in zip(table, table[1:]))
+    # Nothing moves in the dead zone, so the smallest speed needs more.
+    assert table[1] > motor.deadband * 100
+    assert table[100] == UNIT
+    assert bridge.curve is None and bridge.go() == 0
@@ -0,0 +1,105 @@
+import pyb
+import stm
+
+from motors.gang import UDIS, Gang
+from motors.hbridge import HBridge
+
+PINS = (('PA0', 'PA1'), ('PB6', 'PB7'), ('PA8', 'PA9'), ('PC6', 'PC7'))
+
+
+class Recorder(stm.Mem):
+    """stm.mem32, logging each write with whether interrupts were on."""
+
+    def __init__(self, sim):
+        stm.Mem.__init__(self, 32)
+        self.sim = sim
+        self.log = []
+
+    def __setitem__(self, addr, value):
+        self.log.append((addr, value, self.sim.irq_enabled))
+        stm.Mem.__setitem__(self, addr, value)
+
+
+def gang(sync):
+    motors = [HBridge(HBridge.RUN_COAST, pyb.Pin(a), pyb.Pin(b), fast=True)
+              for a, b in PINS]
+    return Gang(motors[:2], motors[2:], sync=sync), motors
+
+
+def recording(sim, monkeypatch):
+    recorder = Recorder(sim)
+    monkeypatch.setattr(stm, 'mem32', recorder)
+    return recorder.log
+
+
+def compares(motors):
+    return [(pwm.timer_id, pwm.channel._channel)
+            for motor in motors for pwm in motor.pwms()]
+
+
+def test_sync(sim, monkeypatch):
+    """All the timers are written inside one interrupt-disabled window,
+    with their update events held until every compare is in."""
+
+    gang_, motors = gang(True)
+    log = recording(sim, monkeypatch)
+    gang_.go(60)
+    timers = dict((getattr(stm, 'TIM%d' % timer), timer)
+                  for timer, channel in compares(motors))
+    assert len(timers) == 4
+    assert all(not enabled for addr, value, enabled in log)
+    assert sim.irq_enabled
+
+    holds, releases, written = [], [], []
+    for i, (addr, value, enabled) in enumerate(log):
+        timer, reg = timers[addr & ~0x3ff], addr & 0x3ff
+        if reg == stm.TIM_CR1:
+            (holds if value & UDIS else releases).append((i, timer))
+        else:
+            written.append((i, (timer, (reg - stm.TIM_CCR1) // 4 + 1)))
+    assert sorted(timer for i, timer in holds) == sorted(timers.values())
+    assert sorted(timer for i, timer in releases) == sorted(timers.values())
+    # Only the input that changes on each motor is written.
+    assert set(c for i, c in written) < set(compares(motors))
+    assert sorted(c[0] for i, c in written) == sorted(timers.values())
+    assert max(holds)[0] < min(written)[0]
+    assert max(written)[0] < min(releases)[0]
+    for motor, speed in zip(motors, (60, 60, -60, -60)):
+        assert motor.go() == speed
+
+
+def test_sync_single_window(sim, monkeypatch):
+    """Interrupts are disabled once for the whole commit."""
+
+    import motors.gang as module
+
+    gang_, motors = gang(True)
+    calls = []
+    disable, enable = module.disable_irq, module.enable_irq
+    monkeypatch.setattr(module, 'disable_irq',
+                        lambda: calls.append('disable') or disable())
+    monkeypatch.setattr(module, 'enable_irq',
+                        lambda state: calls.append('enable') or enable(state))
+    gang_.set((10, 20, 30, 40))
+    assert calls == ['disable', 'enable']
+    # Nothing changed, so nothing is written.
+    gang_.set((10, 20, 30, 40))
+    assert calls == ['disable', 'enable']
+    assert [motor.go() for motor in motors] == [10, 20, -30, -40]
+
+
+def test_sync_cancels_ramps(sim):
+    gang_, motors = gang(True)
+    motors[0].go(100, 500)
+    sim.advance(100000)
+    gang_.go(-20)
+    sim.advance(500000)
+    assert [motor.go() for motor in motors] == [-20, -20, 20, 20]
+
+
+def test_unsynced(sim, monkeypatch):
+    gang_, motors = gang(False)
+    log = recording(sim, monkeypatch)
+    gang_.go(60)
+    assert all(enabled for addr, value, enabled in log)
+    assert [motor.go() for motor in motors] == [60, 60, -60, -60]
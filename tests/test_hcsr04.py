@@ -0,0 +1,157 @@
+import asyncio
+
+from pyb import Pin
+
+from HCSR04 import HCSR04
+
+
+def sensor():
+    return HCSR04(Pin('C1'), Pin('B5'))
+
+
+async def echo(clock, pin, width, delay=200):
+    """Answer the trigger with a width µs echo on pin, after delay µs."""
+
+    await asyncio.sleep(0)
+    clock.advance(delay)
+    pin.drive(1)
+    clock.advance(width)
+    pin.drive(0)
+
+
+def test_measure(sim):
+    s = sensor()
+
+    async def main():
+        return await asyncio.gather(s.measure(), echo(sim, s.return_pin, 1000))
+
+    distance, _ = asyncio.run(main())
+    assert s.elapsed == 1000
+    assert distance == s.sos * 1000 / 2
+    assert s.valid
+
+
+def test_measure_echo_before_wait(sim, monkeypatch):
+    """An echo that lands after the check but before the wait isn't missed."""
+
+    import HCSR04 as module
+
+    s = sensor()
+    pin = s.return_pin
+    elapsed_micros = module.elapsed_micros
+    calls = []
+
+    def echo_now(start):
+        # measure's first timeout sum: the echo interrupts it.
+        calls.append(start)
+        if len(calls) == 1:
+            pin.drive(1)
+            sim.advance(580)
+            pin.drive(0)
+        return elapsed_micros(start)
+
+    monkeypatch.setattr(module, 'elapsed_micros', echo_now)
+
+    async def main():
+        # Well under the timeout, so measure didn't wait it out.
+        return await asyncio.wait_for(s.measure(timeout_ms=1000), 0.5)
+
+    assert asyncio.run(main()) == s.sos * 580 / 2
+
+
+def test_measure_timeout(sim):
+    s = sensor()
+
+    async def silent():
+        await asyncio.sleep(0)
+        sim.advance(40000)
+
+    async def main():
+        return await asyncio.gather(s.measure(timeout_ms=30), silent())
+
+    distance, _ = asyncio.run(main())
+    assert distance == 0
+    assert s.elapsed is None
+    assert not s.valid
+
+
+def test_readings(sim):
+    s = sensor()
+    widths = [1000, 1200, 1400]
+
+    async def main():
+        got = []
+        async for distance in s.readings(rate=50):
+            got.append(distance)
+            if len(got) == len(widths):
+                return got
+            # Time passes between readings, as on a board.
+            sim.advance(20000)
+            asyncio.ensure_future(echo(sim, s.return_pin, widths[len(got)]))
+
+    async def first():
+        asyncio.ensure_future(echo(sim, s.return_pin, widths[0]))
+        return await main()
+
+    assert asyncio.run(first()) == [s.sos * w / 2 for w in widths]
+
+
+def test_filter_median(sim):
+    s = sensor()
+    for _ in range(4):
+        s._filter(1000)
+    before = s.distance(filtered=True)
+    # A spike within range is accepted, but doesn't move the median,
+    # so the average stays put. Nor does a second one.
+    for _ in range(2):
+        s._filter(5000)
+        assert s.valid
+        assert s.distance(filtered=True) == before
+
+
+def test_filter_rejects(sim):
+    s = sensor()
+    for echo in (1000, 1000, 1000):
+        s._filter(echo)
+    before = s.distance(filtered=True)
+    assert before == s.sos * 1000 / 2
+    for echo in (0, s.max_echo + 1, 60000):
+        s._filter(echo)
+        assert not s.valid
+        assert s.distance(filtered=True) == before
+    assert s.confidence == 3 * 100 // 16
+    s._filter(s.max_echo)
+    assert s.valid
+
+
+def test_filter_bogus_and_timeouts(sim):
+    s = sensor()
+    s._filter(1000)
+    # A falling edge with no rising one, then a timeout.
+    s.IRQ(s.return_pin)
+    assert s.bogus and not s.valid
+    s.no_echo()
+    assert not s.valid
+    assert s.distance(filtered=True) == s.sos * 1000 / 2
+
+
+def test_filter_max_range(sim):
+    s = HCSR04(Pin('C1'), Pin('B5'), max_range=100)
+    s._filter(round(2 * 100 / s.sos) + 1)
+    assert not s.valid
+    assert s.distance(filtered=True) == 0
+    s._filter(2000)
+    assert s.valid
+
+
+def test_filter_follows(sim):
+    """A real change gets through the median, and the average follows."""
+
+    s = sensor()
+    for _ in range(5):
+        s._filter(1000)
+    for _ in range(40):
+        s._filter(2000)
+    assert abs(s.distance(filtered=True) - s.sos * 2000 / 2) < s.sos
+    s.reset_filter()
+    assert s.distance(filtered=True) == 0
@@ -0,0 +1,142 @@
+import pyb
+import pytest
+
+import ramp
+from motors.hbridge import HBridge
+
+PROFILES = (ramp.LINEAR, ramp.EASE_IN, ramp.EASE_OUT, ramp.EASE_IN_OUT)
+
+
+def monotonic(values):
+    steps = [b - a for a, b in zip(values, values[1:])]
+    return all(s >= 0 for s in steps) or all(s <= 0 for s in steps)
+
+
+def test_ease():
+    half = ramp.ONE // 2
+    for profile in PROFILES:
+        eased = [ramp.ease(profile, p) for p in range(0, ramp.ONE + 1, 64)]
+        assert eased[0] == 0 and eased[-1] == ramp.ONE
+        assert monotonic(eased)
+    assert ramp.ease(ramp.EASE_IN, half) < half < ramp.ease(ramp.EASE_OUT, half)
+    assert ramp.ease(ramp.EASE_IN_OUT, half) == half
+
+
+@pytest.mark.parametrize('profile', PROFILES)
+@pytest.mark.parametrize('start, end', [(0, 1000), (1000, 0),
+                                        (-70000, 90000)])
+def test_final_value(sim, profile, start, end):
+    """Every ramp ends on its end value, on the tick it was due."""
+
+    values = []
+    scheduler = ramp.scheduler()
+    scheduler.start(values, values.append, start, end, 100, profile)
+    sim.advance(98000)
+    assert len(values) == 49
+    sim.advance(2000)
+    assert len(values) == 50 and values[-1] == end
+    assert monotonic([start] + values)
+    sim.advance(10000)
+    assert len(values) == 50
+    assert not scheduler.busy()
+
+
+@pytest.mark.parametrize('profile', PROFILES)
+def test_through_zero(sim, profile):
+    values = []
+    ramp.scheduler().start(values, values.append, 50, -50, 200, profile)
+    sim.advance(200000)
+    assert values[-1] == -50
+    assert monotonic([50] + values)
+    assert min(abs(v) for v in values) <= 2
+
+
+def test_replace_and_cancel(sim):
+    values = []
+    scheduler = ramp.scheduler()
+    scheduler.start(values, values.append, 0, 100, 100)
+    sim.advance(50000)
+    scheduler.start(values, values.append, values[-1], -100, 100)
+    sim.advance(100000)
+    assert values[-1] == -100
+    assert max(values) < 100
+    scheduler.start(values, values.append, -100, 100, 100)
+    sim.advance(50000)
+    scheduler.cancel(values)
+    stopped = values[-1]
+    sim.advance(100000)
+    assert values[-1] == stopped and -10 < stopped < 10
+
+
+def test_slew(sim):
+    values = []
+    scheduler = ramp.scheduler()
+    scheduler.slew(values, values.append, 0, 100, 1000)
+    sim.advance(50000)
+    # Heading the same way again leaves the ramp alone.
+    scheduler.slew(values, values.append, values[-1], 100, 1000)
+    sim.advance(50000)
+    assert values[-1] == 100 and len(values) == 50
+
+
+def test_all_in_use(sim):
+    scheduler = ramp.Scheduler(slots=2)
+    scheduler.start(1, abs, 0, 10, 100)
+    scheduler.start(2, abs, 0, 10, 100)
+    with pytest.raises(ramp.RampError):
+        scheduler.start(3, abs, 0, 10, 100)
+
+
+def hbridge():
+    return HBridge(HBridge.RUN_COAST, pyb.Pin('PA0'), pyb.Pin('PA1'))
+
+
+def inputs(sim, motor):
+    """The (time, in1 ticks, in2 ticks) each time either changed."""
+
+    log = sorted([(t, 1, v) for t, v in sim.trace(motor.in1.channel._name)]
+                 + [(t, 2, v) for t, v in sim.trace(motor.in2.channel._name)])
+    ticks, changes = [0, 0, 0], []
+    for t, which, value in log:
+        ticks[which] = value
+        changes.append((t, ticks[1], ticks[2]))
+    return changes
+
+
+def check_through_zero(changes, full):
+    """Speed goes down through zero to -50, never driving both inputs."""
+
+    speeds = [in2 - in1 for t, in1, in2 in changes]
+    assert all(in1 == 0 or in2 == 0 for t, in1, in2 in changes)
+    assert monotonic(speeds)
+    assert speeds[0] > 0 and 0 in speeds
+    assert speeds[-1] == -full // 2
+
+
+def test_hbridge_go_through_zero(sim):
+    motor = hbridge()
+    motor.go(50)
+    start = sim.now
+    motor.go(-50, 200, ramp.EASE_IN_OUT)
+    sim.advance(300000)
+    assert motor.go() == -50
+    changes = inputs(sim, motor)
+    check_through_zero([c for c in changes if c[0] >= start],
+                       motor.in1.full)
+    assert changes[-1][0] - start <= 200000
+
+
+def test_hbridge_acceleration(sim):
+    motor = hbridge()
+    motor.acceleration(1)
+    motor.go(50)
+    sim.advance(60000)
+    assert motor.go() == 50
+    start = sim.now
+    motor.go(-50)
+    sim.advance(50000)
+    assert -2 <= motor.go() <= 2
+    sim.advance(60000)
+    assert motor.go() == -50
+    check_through_zero([c for c in inputs(sim, motor) if c[0] >= start],
+                       motor.in1.full)
@@ -0,0 +1,39 @@
+import pyb
+from pyb import ExtInt, Pin
+
+
+def test_held_interrupts(sim):
+    seen = []
+    pin = Pin('B5')
+    ExtInt(pin, ExtInt.IRQ_RISING_FALLING, Pin.PULL_DOWN,
+           lambda line: seen.append(pin.value()))
+    state = pyb.disable_irq()
+    pin.drive(1)
+    assert seen == []
+    pyb.enable_irq(state)
+    assert seen == [1]
+
+
+def test_held_once(sim):
+    seen = []
+    timer = pyb.Timer(9, freq=1000)
+    timer.callback(lambda t: seen.append(pyb.micros()))
+    state = pyb.disable_irq()
+    sim.advance(3500)
+    assert seen == []
+    # Like a pending flag, three updates while disabled run it once.
+    pyb.enable_irq(state)
+    assert seen == [3500]
+    sim.advance(1000)
+    assert len(seen) == 2
+
+
+def test_nested_disable(sim):
+    seen = []
+    outer = pyb.disable_irq()
+    inner = pyb.disable_irq()
+    sim.irq(seen.append, 1)
+    pyb.enable_irq(inner)
+    assert seen == []
+    pyb.enable_irq(outer)
+    assert seen == [1]
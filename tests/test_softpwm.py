@@ -0,0 +1,66 @@
+import pyb
+
+import softpwm
+from softpwm import GUARD, SoftEngine, SoftPWM
+
+
+def run(sim, widths, freq=1000, periods=3):
+    """Run outputs of widths for periods, and return their pin traces."""
+
+    engine = SoftEngine(freq)
+    names = ['C%d' % i for i in range(len(widths))]
+    for name, width in zip(names, widths):
+        SoftPWM(pyb.Pin(name), engine=engine).pulse_width_ticks(width)
+    sim.advance((periods + 1) * engine.full - 1)
+    engine.deinit()
+    return [sim.trace(name) for name in names]
+
+
+def pulses(trace):
+    """The (start, width) of each pulse in a pin trace."""
+
+    return [(t, end - t) for (t, v), (end, _) in zip(trace, trace[1:]) if v]
+
+
+def test_one_percent(sim):
+    """A 1% duty at 1kHz is a 10µs pulse."""
+
+    trace, = run(sim, [10])
+    assert pulses(trace)[-2:] == [(2000, 10), (3000, 10)]
+
+
+def test_widths(sim):
+    short, long = run(sim, [300, 700])
+    assert pulses(short)[-1] == (3000, 300)
+    assert pulses(long)[-1] == (3000, 700)
+
+
+def test_below_guard(sim):
+    """A width under GUARD ends at the period start, never a period late."""
+
+    trace, = run(sim, [GUARD - 3])
+    for start, width in pulses(trace):
+        assert width == 0
+
+
+def test_within_guard(sim):
+    """Ends within GUARD of each other are made together, early."""
+
+    first, second = run(sim, [200, 200 + GUARD - 2])
+    assert pulses(first)[-1] == (3000, 200)
+    assert pulses(second)[-1] == (3000, 200)
+
+
+def test_late_start(sim, monkeypatch):
+    """An edge already due when the period starts late isn't missed."""
+
+    engine = SoftEngine(1000)
+    output = SoftPWM(pyb.Pin('C0'), engine=engine)
+    output.pulse_width_ticks(20)
+    sim.advance(1500)
+    # The update interrupt runs 30µs late: the edge's compare is past.
+    counter = engine.timer.counter
+    monkeypatch.setattr(engine.timer, 'counter', lambda: counter() + 30)
+    engine._start(engine.timer)
+    assert pyb.Pin('C0').value() == 0
+    assert engine._edge == 1
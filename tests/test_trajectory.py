@@ -0,0 +1,47 @@
+import pyb
+
+from motors.servo import Servo
+from motors.trajectory import Player, trapezoid, waypoints
+
+
+def servo(name):
+    s = Servo(pyb.Pin(name))
+    s.calibration(1000, 2000, 1500, 500, 500)
+    return s
+
+
+def test_play(sim):
+    first, second = servo('PB6'), servo('PB7')
+    player = Player()
+    player.load(first, waypoints(first, [(0, 0), (500, 90)]))
+    player.load(second, trapezoid(second, 0, -45, 180, 360))
+    player.play()
+    sim.advance(300000)
+    assert player.elapsed() == 300
+    sim.advance(1000000)
+    assert not player.playing
+    assert player.elapsed() == player.frames * 1000 // player.rate
+    assert first.angle() == 90
+    assert second.angle() == -45
+
+
+def test_load_while_playing(sim):
+    """A tick landing in the middle of load sees all of it, or none."""
+
+    first, second = servo('PB6'), servo('PB7')
+    player = Player()
+    player.load(first, waypoints(first, [(0, 0), (200, 90)]))
+    player.play()
+    sim.advance(50000)
+
+    class Hooked(list):
+        def append(self, item):
+            list.append(self, item)
+            sim.irq(player.tick, player.timer)
+
+    player._tables = Hooked(player._tables)
+    player.load(second, waypoints(second, [(0, -30), (1000, 30)]))
+    assert player.frames == len(player._tables[1])
+    sim.advance(2000000)
+    assert first.angle() == 90
+    assert second.angle() == 30